@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.11/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -73,6 +74,16 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": "/usr/src/data/database",
+        # scheduler worker processes write at the same time, wait for locks
+        "OPTIONS": {"timeout": 20},
+        # a file rather than SQLite's in-memory database, whose threads fail
+        # at once on each other's locks instead of waiting like in production
+        "TEST": {
+            "NAME": os.getenv(
+                "TEST_DATABASE_NAME",
+                os.path.join(tempfile.gettempdir(), "to_do_overs_test_database"),
+            )
+        },
     }
 }
 
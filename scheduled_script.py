@@ -4,259 +4,598 @@ This script is run once a day to add repeats of tasks.
 """
 from __future__ import print_function
 
-from builtins import str
-
 __author__ = "Katie Patterson kirska.com"
 __license__ = "MIT"
 
-from datetime import date, datetime, timedelta
+from collections import Counter
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from datetime import date, timedelta
+from itertools import groupby, islice
+import asyncio
 import schedule
 import time
-import pytz
-import requests
-import json
 import os
 
-import smtplib, ssl
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
-
 # pylint: disable=unused-import
 from Habitica_ToDoOvers.wsgi import application  # noqa: F401
 
+from django.db import connection, connections
+from django.db.models import Q
+from django.db.models.functions import Mod
+from django.template.loader import render_to_string
+from django.utils import timezone
+
 from to_do_overs.models import Tasks, Users
-from to_do_overs.app_functions.cipher_functions import decrypt_text
+from to_do_overs.app_functions import (
+    email_delivery,
+    habitica_client,
+    leases,
+    metrics,
+    profiling,
+    report_store,
+    tag_cache,
+    work_queue,
+)
+from to_do_overs.app_functions.cipher_functions import (
+    clear_credential_cache,
+    start_credential_cache,
+)
+from to_do_overs.app_functions.recreation import check_recreate_task
 from to_do_overs.app_functions.to_do_overs_data import ToDoOversData
-from to_do_overs.app_functions.local_defines import CIPHER_FILE
 
+# "snapshot" fetches each user's todos in bulk, "task" fetches every task on its own
+SYNC_MODE = os.getenv("SYNC_MODE", "snapshot")
+# "sync" checks users one after another, "async" checks users concurrently
+SCHEDULER_ENGINE = os.getenv("SCHEDULER_ENGINE", "sync")
+SCHEDULER_MAX_CONCURRENCY = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "8"))
+SCHEDULER_MAX_PER_USER = int(os.getenv("SCHEDULER_MAX_PER_USER", "2"))
+# worker processes for job(), users are split between them by pk
+SCHEDULER_PROCESSES = int(os.getenv("SCHEDULER_PROCESSES", "1"))
+# with webhooks registered, polling is only a safety net and can run less often
+SCHEDULER_INTERVAL_MINUTES = int(os.getenv("SCHEDULER_INTERVAL_MINUTES", "10"))
+# a user checked by one replica isn't checked again by another for this long
+SYNC_SPACING = timedelta(minutes=SCHEDULER_INTERVAL_MINUTES / 2.0)
+# number of tasks loaded from the database at a time
+TASK_CHUNK_SIZE = int(os.getenv("SCHEDULER_CHUNK_SIZE", "500"))
+# users reported on at the same time, and how long one user may take in seconds
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "8"))
+REPORT_USER_TIMEOUT = float(os.getenv("REPORT_USER_TIMEOUT", "120"))
+# seconds between checks of the report pool for finished and overdue users
+REPORT_POLL_SECONDS = 1
+
+
+def _sync_task(task_, tdo_data, snapshot=None):
+    """Check one task against Habitica and queue its recreation or deletion.
+
+    Args:
+        task_: the task from the tool database.
+        tdo_data: the ToDoOversData of the task owner.
+        snapshot: optional dict of the owner's todos keyed by task ID.
+    """
+    if snapshot is not None and task_.task_id in snapshot:
+        check_recreate_task(snapshot[task_.task_id], task_)
+        return
+
+    tdo_data.task_id = task_.task_id
+    task_json = tdo_data.get_task()
+
+    if task_json:
+        check_recreate_task(task_json, task_)
+    elif tdo_data.return_code == 404:
+        work_queue.enqueue_delete(task_)
+    else:
+        print("weird return code")
+        print(tdo_data.return_code)
+
+
+def _owner_data(owner):
+    """Build a ToDoOversData for talking to Habitica as a task owner."""
+    tdo_data = ToDoOversData()
+    tdo_data.hab_user_id = owner.user_id
+    tdo_data.api_token = owner.api_key
+    return tdo_data
+
+
+def _prepare_owner(owner, tdo_data):
+    """Queue a refresh of a user's stale tags and fetch their todo snapshot.
+
+    Args:
+        owner: the user from the tool database.
+        tdo_data: the ToDoOversData of the task owner.
+
+    Returns:
+        Dict of the owner's todos keyed by task ID, or None when tasks
+        have to be checked one by one.
+    """
+    # update user's tags once the cached ones are too old
+    if tag_cache.tags_stale(owner):
+        work_queue.enqueue_tag_sync(owner)
+
+    # one snapshot of the user's todos instead of one request per task
+    if SYNC_MODE != "snapshot":
+        return None
+    snapshot = tdo_data.get_todo_snapshot()
+    if snapshot is False:
+        print("snapshot failed, checking tasks one by one " + tdo_data.hab_user_id)
+        return None
+    return snapshot
+
+
+def _iter_tasks(chunk_size=TASK_CHUNK_SIZE, shard=None):
+    """Stream all tasks ordered by owner, with owner and tags already loaded.
+
+    Tasks are read in chunks of chunk_size using the last (owner, pk) seen,
+    so every chunk costs one joined query for tasks and owners plus one
+    for their tags, however large the table gets.
+
+    Args:
+        chunk_size: the number of tasks loaded per chunk.
+        shard: optional (index, count) to only load the tasks of users
+            whose pk % count == index.
+    """
+    now = timezone.now()
+    TASKS = (
+        Tasks.objects.filter(Q(next_check_at__isnull=True) | Q(next_check_at__lte=now))
+        # users another replica checked moments ago are skipped
+        .filter(Q(owner__next_sync_at__isnull=True) | Q(owner__next_sync_at__lte=now))
+        .select_related("owner")
+        .prefetch_related("tags")
+        .order_by("owner_id", "pk")
+    )
+    if shard is not None:
+        TASKS = TASKS.annotate(shard=Mod("owner_id", shard[1])).filter(shard=shard[0])
+    chunk_filter = Q()
+
+    while True:
+        chunk = list(TASKS.filter(chunk_filter)[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+
+        last = chunk[-1]
+        chunk_filter = Q(owner_id__gt=last.owner_id) | Q(
+            owner_id=last.owner_id, pk__gt=last.pk
+        )
 
-def _recreate_task(task, tdo_data):
-    tdo_data.hab_user_id = task.owner.user_id
-    tdo_data.priority = task.priority
-    tdo_data.api_token = task.owner.api_key
-    tdo_data.notes = task.notes
-    tdo_data.task_name = task.name
-    tdo_data.task_days = task.days
 
-    # convert tags from their DB ID to the tag UUID
-    tag_list = []
-    for tag in task.tags.all():
-        tag_list.append(tag.tag_id)
+def _due_today(task):
+    """Check a task can be recreated today, moving its next check if not.
 
-    tdo_data.tags = tag_list
+    Args:
+        task: the task from the tool database.
 
-    retry = True
-    delay_seconds = 0
+    Returns:
+        True if the task has to be checked on this run.
+    """
+    next_check_at = task.compute_next_check_at()
+    if next_check_at is None or next_check_at <= timezone.now():
+        return True
 
-    while retry:
-        try:
-            if tdo_data.create_task(CIPHER_FILE):
-                task.task_id = tdo_data.task_id
-                task.save()
-                retry = False
-                delay_seconds = 0
-                print("task re-created successfully " + task.task_id)
-            else:
-                print("task creation failed " + task.task_id)
-                if tdo_data.return_code == 429:
-                    print("too many requests, sleeping")
-                    retry = True
-                    delay_seconds += 90
-                    if delay_seconds > 500:
-                        # stop trying
-                        retry = False
-                        delay_seconds = 0
-                    else:
-                        time.sleep(delay_seconds)
-                else:
-                    print("unknown failure")
-                    retry = False
-                    delay_seconds = 0
-        except AttributeError:
-            print("attribute error, sleep and retry")
-            retry = True
-            delay_seconds += 90
-            if delay_seconds > 500:
-                # stop trying
-                retry = False
-                delay_seconds = 0
-            else:
-                time.sleep(delay_seconds)
-
-
-def check_recreate_task(req, task, tdo_data):
-    req_json = req.json()
-
-    if task.type == "0":
-        # Day Tasks
-        if req_json["data"]["completed"] and task.delay == 0:
-            # Task was completed and there is no delay so recreate it
-            _recreate_task(task, tdo_data)
-
-        elif req_json["data"]["completed"]:
-            # Task was completed but has a delay
-            # Get completed date and set to UTC timezone
-            completed_date_naive = datetime.strptime(
-                req_json["data"]["dateCompleted"], "%Y-%m-%dT%H:%M:%S.%fZ"
-            )
-            utc_timezone = pytz.timezone("UTC")
-            completed_date_aware = utc_timezone.localize(completed_date_naive)
-            # Get current UTC time
-            utc_now = pytz.utc.localize(datetime.utcnow())
-
-            # Need to round the datetimes down to get rid of partial days
-            completed_date_aware = completed_date_aware.replace(
-                hour=0, minute=0, second=0, microsecond=0
-            )
-            utc_now = utc_now.replace(hour=0, minute=0, second=0, microsecond=0)
-
-            # TESTING - add days to current date
-            # utc_now = utc_now + timedelta(days=2)
-            elapsed_time = utc_now - completed_date_aware
-
-            # The delay we want is 1 + delay value
-            if elapsed_time.days >= task.delay:
-                # Task was completed and the delay has passed
-                _recreate_task(task, tdo_data)
-            else:
-                print("[DAY] task completed but delay not met " + task.task_id)
-
-        else:
-            print("[DAY] task not completed " + task.task_id)
-    elif task.type == "1":
-        # Week Tasks
-        if (
-            req_json["data"]["completed"]
-            and int(task.weekday) == datetime.today().weekday()
-        ):
-            completed_at = datetime.strptime(
-                req_json["data"]["dateCompleted"], "%Y-%m-%dT%H:%M:%S.%fZ"
-            )
-            if completed_at.day != datetime.today().day:
-                _recreate_task(task, tdo_data)
-                print("[WEEK] weekly task created")
-            else:
-                print("[WEEK] task completed, but today")
-    elif task.type == "2":
-        # Month Tasks
-        if req_json["data"]["completed"] and int(task.monthday) == datetime.today().day:
-            completed_at = datetime.strptime(
-                req_json["data"]["dateCompleted"], "%Y-%m-%dT%H:%M:%S.%fZ"
-            )
-            if completed_at.day != datetime.today().day:
-                _recreate_task(task, tdo_data)
-                print("[MONTH] monthly task created")
-            else:
-                print("[MONTH] task completed, but today")
-        else:
-            print("[MONTH] not to be updated today")
+    Tasks.objects.filter(pk=task.pk).update(next_check_at=next_check_at)
+    return False
 
 
-def job():
-    TASKS = Tasks.objects.all()
-    user_tags_fetched = []
-
-    for task_ in TASKS:
-        tdo_data = ToDoOversData()
-
-        too_many_requests_delay = True
-        current_delay = 0
-
-        # update user's tags
-        if task_.owner.user_id not in user_tags_fetched:
-            user_tags_fetched.append(task_.owner.user_id)
-            while too_many_requests_delay:
-                tdo_data.hab_user_id = task_.owner.user_id
-                tdo_data.api_token = task_.owner.api_key
-                if not tdo_data.get_user_tags():
-                    if tdo_data.return_code == 429:
-                        # too many requests
-                        current_delay += 90
-                        too_many_requests_delay = True
-                        print("too many requests, sleeping")
-                        if current_delay > 500:
-                            # stop trying
-                            too_many_requests_delay = False
-                            current_delay = 0
-                        else:
-                            time.sleep(current_delay)
-                    else:
-                        too_many_requests_delay = False
-                        current_delay = 0
-                else:
-                    too_many_requests_delay = False
-                    current_delay = 0
-
-            too_many_requests_delay = True
-            current_delay = 0
-
-        while too_many_requests_delay:
-            url = "https://habitica.com/api/v3/tasks/" + str(task_.task_id)
-            headers = {
-                "x-api-user": str(task_.owner.user_id),
-                "x-api-key": decrypt_text(task_.owner.api_key, CIPHER_FILE),
-            }
-
-            req_ = requests.get(url, headers=headers)
-
-            if req_.status_code == 429:
-                # too many requests
-                current_delay += 90
-                too_many_requests_delay = True
-                print("too many requests, sleeping")
-                if current_delay > 500:
-                    # stop trying
-                    too_many_requests_delay = False
-                    current_delay = 0
-                else:
-                    time.sleep(current_delay)
-            elif req_.status_code == 200:
-                check_recreate_task(req_, task_, tdo_data)
-                too_many_requests_delay = False
-            elif req_.status_code == 404:
-                print("deleting task " + task_.task_id)
-                Tasks.objects.filter(task_id=task_.task_id).delete()
-                too_many_requests_delay = False
-            else:
-                print("weird return code")
-                print(req_.status_code)
-                too_many_requests_delay = False
+def _tasks_by_owner(chunk_size=TASK_CHUNK_SIZE, shard=None):
+    """Yield (owner, tasks) pairs for every user that has tasks due."""
+    for owner_id, owner_tasks in groupby(
+        _iter_tasks(chunk_size, shard), key=lambda t: t.owner_id
+    ):
+        owner_tasks = [task_ for task_ in owner_tasks if _due_today(task_)]
+        if owner_tasks:
+            yield owner_tasks[0].owner, owner_tasks
 
 
-def create_daily_report():
-    print("[REPORT] Daily report creation started")
-    USERS = Users.objects.all()
-
-    for user_ in USERS:
-        tdo_data = ToDoOversData()
-        tdo_data.hab_user_id = user_.user_id
-        tdo_data.api_token = user_.api_key
-
-        todo_results = tdo_data.get_today_completed_tasks()
-        habit_results = tdo_data.get_today_completed_habits()
-        daily_results = tdo_data.get_today_completed_dailies()
-        date_today = (
-            f"{datetime.today().year}{datetime.today().month}{datetime.today().day}"
+def _drain_leftovers(shard=None):
+    """Run the due jobs of every user that no other replica is working on.
+
+    Args:
+        shard: optional (index, count), see _iter_tasks.
+
+    Returns:
+        The number of jobs that succeeded.
+    """
+    owners = Users.objects.filter(jobs__next_attempt_at__lte=timezone.now()).distinct()
+    if shard is not None:
+        owners = owners.annotate(shard=Mod("pk", shard[1])).filter(shard=shard[0])
+
+    succeeded = 0
+    for owner in owners:
+        if not leases.claim_user(owner):
+            continue
+        try:
+            succeeded += work_queue.drain(owner)
+        finally:
+            leases.release_user(owner)
+    return succeeded
+
+
+def _sync_owner(owner, owner_tasks):
+    """Check all due tasks of one user and run the jobs they queued.
+
+    Returns:
+        The number of jobs that succeeded, or None if another replica holds
+        the user's lease or has checked the user since it was loaded.
+    """
+    if not leases.claim_user(owner, due_only=True):
+        return None
+    try:
+        tdo_data = _owner_data(owner)
+        snapshot = _prepare_owner(owner, tdo_data)
+
+        for task_ in owner_tasks:
+            _sync_task(task_, tdo_data, snapshot)
+        return work_queue.drain(owner)
+    finally:
+        leases.release_user(owner, next_sync_at=timezone.now() + SYNC_SPACING)
+
+
+def _close_db_after(func, *args):
+    """Run func in a worker thread and close that thread's DB connection."""
+    try:
+        return func(*args)
+    finally:
+        connection.close()
+
+
+def _next_owners(owners, count):
+    """Take the next count (owner, tasks) pairs from a _tasks_by_owner."""
+    return list(islice(owners, count))
+
+
+async def _job_async(shard=None):
+    """Check all users concurrently.
+
+    Blocking Habitica and DB calls run on a thread pool. At most
+    SCHEDULER_MAX_CONCURRENCY calls run at once overall and at most
+    SCHEDULER_MAX_PER_USER at once for a single user. Users are read in
+    batches of SCHEDULER_MAX_CONCURRENCY as earlier ones finish, so at most
+    two batches of users and their tasks are held in memory at a time.
+
+    Args:
+        shard: optional (index, count), see _iter_tasks.
+
+    Returns:
+        Counter of users and tasks checked and jobs run.
+    """
+    loop = asyncio.get_running_loop()
+    global_limit = asyncio.Semaphore(SCHEDULER_MAX_CONCURRENCY)
+    owner_slots = asyncio.Semaphore(SCHEDULER_MAX_CONCURRENCY)
+    stats = Counter()
+
+    with ThreadPoolExecutor(max_workers=SCHEDULER_MAX_CONCURRENCY) as executor:
+
+        async def run(user_limit, func, *args):
+            # take the user's slot first so a busy user doesn't hold global slots
+            async with user_limit:
+                async with global_limit:
+                    return await loop.run_in_executor(
+                        executor, _close_db_after, func, *args
+                    )
+
+        async def check_owner(owner, owner_tasks):
+            user_limit = asyncio.Semaphore(SCHEDULER_MAX_PER_USER)
+            if not await run(user_limit, leases.claim_user, owner, None, True):
+                return None
+            try:
+                snapshot = await run(
+                    user_limit, _prepare_owner, owner, _owner_data(owner)
+                )
+                # every task gets its own ToDoOversData since they run side by side
+                await asyncio.gather(
+                    *[
+                        run(user_limit, _sync_task, task_, _owner_data(owner), snapshot)
+                        for task_ in owner_tasks
+                    ]
+                )
+                return await run(user_limit, work_queue.drain, owner)
+            finally:
+                await run(
+                    user_limit,
+                    leases.release_user,
+                    owner,
+                    timezone.now() + SYNC_SPACING,
+                )
+
+        async def sync_owner(owner, owner_tasks):
+            try:
+                jobs = await check_owner(owner, owner_tasks)
+            except Exception as exception:  # pylint: disable=broad-except
+                print("[ASYNC] checking tasks failed for " + owner.user_id)
+                print(repr(exception))
+                jobs = 0
+            finally:
+                owner_slots.release()
+            if jobs is None:
+                # leased by another replica
+                return
+            stats["users"] += 1
+            stats["tasks"] += len(owner_tasks)
+            stats["jobs"] += jobs
+
+        # pick up work left over from earlier runs first
+        stats["jobs"] += await loop.run_in_executor(
+            executor, _close_db_after, _drain_leftovers, shard
         )
-        results = {
-            "date": date_today,
-            "habits": habit_results,
-            "dailys": daily_results,
-            "todos": todo_results,
-        }
-        with open(
-            "reports/" + date_today + "_" + tdo_data.hab_user_id + ".txt", "w"
-        ) as f:
-            json.dump(results, f, default=str)
-            print(
-                f"[REPORT]: Created report for {tdo_data.hab_user_id} at {date_today}"
+
+        owners = _tasks_by_owner(shard=shard)
+        running = set()
+        while True:
+            # the generator is only ever advanced by one thread at a time
+            batch = await loop.run_in_executor(
+                executor,
+                _close_db_after,
+                _next_owners,
+                owners,
+                SCHEDULER_MAX_CONCURRENCY,
             )
+            if not batch:
+                break
+            for owner, owner_tasks in batch:
+                await owner_slots.acquire()
+                running.add(asyncio.ensure_future(sync_owner(owner, owner_tasks)))
+            running = {future for future in running if not future.done()}
+        await asyncio.gather(*running)
+    return stats
+
+
+def _run_cycle(shard=None):
+    """Check every due task, or only those of the users in one shard.
+
+    Args:
+        shard: optional (index, count), see _iter_tasks.
+
+    Returns:
+        Counter of users and tasks checked and jobs run, plus the run's
+        metrics.
+    """
+    # only count this run's requests
+    metrics.take()
+    stats = _check_users(shard)
+    stats.update(metrics.take())
+    return stats
+
+
+def _check_users(shard=None):
+    start_credential_cache()
+    try:
+        with leases.Heartbeat():
+            if SCHEDULER_ENGINE == "async":
+                return asyncio.run(_job_async(shard))
+
+            stats = Counter()
+            # pick up work left over from earlier runs first
+            stats["jobs"] += _drain_leftovers(shard)
+
+            for owner, owner_tasks in _tasks_by_owner(shard=shard):
+                try:
+                    jobs = _sync_owner(owner, owner_tasks)
+                except Exception as exception:  # pylint: disable=broad-except
+                    # one broken user must not stop the others
+                    print("checking tasks failed for " + owner.user_id)
+                    print(repr(exception))
+                    jobs = 0
+                if jobs is None:
+                    # leased by another replica
+                    continue
+                stats["users"] += 1
+                stats["tasks"] += len(owner_tasks)
+                stats["jobs"] += jobs
+            return stats
+    finally:
+        # connections and credentials are reused for the whole run, not between runs
+        habitica_client.close()
+        clear_credential_cache()
+
+
+def _init_worker():
+    """Give a worker process its own DB connection and HTTP pool."""
+    connections.close_all()
+    habitica_client.close()
+
+
+def _job_processes(count):
+    """Split the users between count worker processes.
+
+    Every user belongs to exactly one shard, so no task is checked twice.
+
+    Args:
+        count: the number of worker processes.
+
+    Returns:
+        Counter of users and tasks checked and jobs run, over all workers.
+    """
+    # workers must not share the connection the parent has open
+    connections.close_all()
+    stats = Counter()
+
+    with ProcessPoolExecutor(max_workers=count, initializer=_init_worker) as executor:
+        futures = {
+            executor.submit(_run_cycle, (index, count)): index for index in range(count)
+        }
+        for future in as_completed(futures):
+            try:
+                stats.update(future.result())
+            except Exception as exception:  # pylint: disable=broad-except
+                print("[SCHEDULER] shard %d failed: %r" % (futures[future], exception))
+    return stats
+
 
+@profiling.profiled("job")
+def job():
+    started_at = timezone.now()
+    started = time.monotonic()
+    if SCHEDULER_PROCESSES > 1:
+        stats = _job_processes(SCHEDULER_PROCESSES)
+    else:
+        stats = _run_cycle()
+    duration = time.monotonic() - started
+    print(
+        "[SCHEDULER] checked %d tasks of %d users and ran %d jobs in %.1fs"
+        % (stats["tasks"], stats["users"], stats["jobs"], duration)
+    )
+    print(
+        "[SCHEDULER] %d requests, %d answered 429, %.1fs waiting on rate limits"
+        % (
+            stats["http_requests"],
+            stats["http_429"],
+            stats["rate_limit_wait_seconds"],
+        )
+    )
+    metrics.save_run(started_at, duration, stats)
+
+
+def _run_report_pool(func, users, label):
+    """Run func(user) for every user on a pool of REPORT_WORKERS threads.
+
+    A user that takes longer than REPORT_USER_TIMEOUT seconds is given up
+    on, so a few slow accounts can't hold up the other users. Its thread
+    can't be stopped though, so the pool still waits for it before
+    returning and the caller can safely tear down what the workers share.
+
+    Args:
+        func: the report function, called with one user.
+        users: the users to report on.
+        label: the name of the report in the progress output.
+
+    Returns:
+        Counter of the users "done", "failed" and "timed out".
+    """
+    started_at = time.time()
+    user_started_at = {}
+
+    def run(user_):
+        user_started_at[user_.pk] = time.time()
+        return _close_db_after(func, user_)
+
+    executor = ThreadPoolExecutor(max_workers=REPORT_WORKERS)
+    futures = {executor.submit(run, user_): user_ for user_ in users}
+    pending = set(futures)
+    stats = Counter()
+    progress_every = max(1, len(futures) // 10)
+    next_progress = progress_every
+    try:
+        while pending:
+            done, pending = wait(
+                pending, timeout=REPORT_POLL_SECONDS, return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                try:
+                    future.result()
+                    stats["done"] += 1
+                except Exception as exception:  # pylint: disable=broad-except
+                    stats["failed"] += 1
+                    print(
+                        f"[REPORT] {label} failed for {futures[future].user_id}: "
+                        f"{exception!r}"
+                    )
+                finished = stats["done"] + stats["failed"]
+                if finished >= next_progress:
+                    next_progress += progress_every
+                    print(f"[REPORT] {label}: {finished}/{len(futures)} users")
+
+            now = time.time()
+            for future in list(pending):
+                user_ = futures[future]
+                if now - user_started_at.get(user_.pk, now) > REPORT_USER_TIMEOUT:
+                    # stop counting on the user, the thread runs on
+                    pending.discard(future)
+                    stats["timed out"] += 1
+                    print(f"[REPORT] {label} timed out for {user_.user_id}")
+    finally:
+        stragglers = sum(1 for future in futures if future.running())
+        if stragglers:
+            print(f"[REPORT] {label}: waiting for {stragglers} timed out users")
+        # users not started yet are dropped, those running are waited for
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    print(
+        f"[REPORT] {label} finished: {stats['done']} done, {stats['failed']} failed, "
+        f"{stats['timed out']} timed out in {time.time() - started_at:.1f}s"
+    )
+    return stats
+
+
+def _create_daily_report_for(user_, report_date):
+    tdo_data = ToDoOversData()
+    tdo_data.hab_user_id = user_.user_id
+    tdo_data.api_token = user_.api_key
+
+    results = tdo_data.get_today_report(report_date)
+    if results is False:
+        raise RuntimeError("fetching tasks failed")
+    report_store.save_daily_report(user_, report_date, results)
+    print(f"[REPORT]: Created report for {tdo_data.hab_user_id} at {report_date}")
+
+
+@profiling.profiled("create_daily_report")
+def create_daily_report():
+    """Save every user's report of today.
 
-def create_weekly_report():
+    Returns:
+        Counter of the users "done", "failed" and "timed out".
+    """
+    print("[REPORT] Daily report creation started")
+    USERS = list(Users.objects.all())
+    # fixed once, a run that goes past midnight still reports on the same day
+    report_date = date.today()
+
+    start_credential_cache()
+    try:
+        return _run_report_pool(
+            lambda user_: _create_daily_report_for(user_, report_date),
+            USERS,
+            "daily report",
+        )
+    finally:
+        habitica_client.close()
+        clear_credential_cache()
+
+
+def _create_weekly_report_for(user_, dates_raw, mailer):
+    # Totals kept up to date by the daily reports
+    habits, dailys, todos = report_store.weekly_totals(user_, dates_raw[0])
+
+    html = render_to_string(
+        "to_do_overs/weekly_report_email.html",
+        {
+            "start": dates_raw[0],
+            "end": dates_raw[-1],
+            # pairs rather than dicts, the template would look up a habit
+            # called "items" before calling .items()
+            "habits": sorted(habits.items()),
+            "dailys": sorted(dailys.items()),
+            "todos": todos,
+        },
+    )
+    date_str = date.today().strftime("%d.%m.%Y")
+    message = email_delivery.build_message(
+        f"[BOT] Weekly Report - {date_str}",
+        html,
+        report_store.report_attachments(user_, dates_raw),
+    )
+    print("[REPORT] Sending weekly report")
+    mailer.send(message)
+
+
+@profiling.profiled("create_weekly_report")
+def create_weekly_report(mailer=None):
+    """Email every user's weekly report.
+
+    Args:
+        mailer: optional email_delivery.Mailer to send with, a new one
+            connecting to SMTP_HOST by default.
+
+    Returns:
+        Counter of the users "done", "failed" and "timed out".
+    """
     print("[REPORT] Weekly report creation started")
-    USERS = Users.objects.all()
+    USERS = list(Users.objects.all())
 
     # Set timerange = week
     theday = date.today()
@@ -265,121 +604,27 @@ def create_weekly_report():
     start = theday - timedelta(days=weekday)
     # build a simple range
     dates_raw = [start + timedelta(days=d) for d in range(1, 8)]
-    dates = [f"{d.year}{d.month}{d.day}" for d in dates_raw]
 
-    for user_ in USERS:
-        tdo_data = ToDoOversData()
-        tdo_data.hab_user_id = user_.user_id
-        tdo_data.api_token = user_.api_key
-
-        # Create filenames / files dict
-        f_content = []
-        filenames = []
-        for d in dates:
-            try:
-                filename = "reports/" + d + "_" + str(tdo_data.hab_user_id) + ".txt"
-                with open(filename) as f:
-                    lines = f.readlines()
-                    f_content.append(json.loads(lines[0]))
-                    filenames.append(filename)
-            except:
-                pass
-
-        # Consolidate file contents for timerange
-        habits = {}
-        dailys = {}
-        todos = []
-        for e in f_content:
-            # Habits
-            for h in e["habits"]:
-                h_name = h["text"]
-                print(h)
-                if h_name in habits:
-                    if h["frequency"] == "weekly":
-                        habits[h_name] = max(
-                            [habits[h_name], (h["counterUp"] - h["counterDown"])]
-                        )
-                    if h["frequency"] == "daily":
-                        habits[h_name] += h["counterUp"] - h["counterDown"]
-                else:
-                    habits[h_name] = h["counterUp"] - h["counterDown"]
-
-            for d in e["dailys"]:
-                d_name = d["text"]
-                if d_name in dailys:
-                    dailys[d_name] += 1
-                else:
-                    dailys[d_name] = 1
-
-            for t in e["todos"]:
-                todos.append(t["text"])
-
-        # Create results string
-        # Define the HTML document
-        html = f"""
-            <html>
-                <body>
-                    <h1>Weekly Results</h1>
-                    <p>{dates_raw[0].strftime("%d.%m.%Y")} - {dates_raw[-1].strftime("%d.%m.%Y")}</p><br>
-                    <h3>HABITS:</h3>
-            """
-        for key, value in habits.items():
-            html += f"<p>{key}: {value}</p>"
-        html += "<br><h3>DAILYS:</h3>"
-        for key, value in dailys.items():
-            html += f"<p>{key}: {value}</p>"
-        html += "<br><h3>ToDos:</h3>"
-        for t in todos:
-            html += f"<p>- {t}</p>"
-        html += "</body></html>"
-        send_email(html, filenames)
-
-
-def send_email(text, attachments):
-    date_str = date.today().strftime("%d.%m.%Y")
-    # Please replace below with your email address and password
-    email_from = os.getenv("EMAIL_FROM")
-    email_to = os.getenv("EMAIL_TO")
-    password = os.getenv("EMAIL_PASS")
-    email_message = MIMEMultipart()
-    email_message["From"] = email_from
-    email_message["To"] = email_to
-    email_message["Subject"] = f"[BOT] Weekly Report - {date_str}"
-    email_message.attach(MIMEText(text, "html"))
-
-    def attach_file_to_email(email_message, filename):
-        # Open the attachment file for reading in binary mode, and make it a MIMEApplication class
-        with open(filename, "rb") as f:
-            file_attachment = MIMEApplication(f.read())
-        # Add header/name to the attachments
-        file_attachment.add_header(
-            "Content-Disposition",
-            f"attachment; filename= {filename}",
+    # one set of logged in SMTP connections for the whole batch
+    if mailer is None:
+        mailer = email_delivery.Mailer()
+    try:
+        return _run_report_pool(
+            lambda user_: _create_weekly_report_for(user_, dates_raw, mailer),
+            USERS,
+            "weekly report",
         )
-        # Attach the file to the message
-        email_message.attach(file_attachment)
-
-    for a in attachments:
-        attach_file_to_email(email_message, a)
-
-    # Connect to the Gmail SMTP server and Send Email
-    # Create a secure default settings context
-    context = ssl.create_default_context()
-    # Connect to Gmail's SMTP Outgoing Mail server with such context
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as server:
-        print("[REPORT] Sending weekly report")
-        # Provide Gmail's login information
-        server.login(email_from, password)
-        # Send mail with from_addr, to_addrs, msg, which were set up as variables above
-        server.sendmail(email_from, email_to, email_message.as_string())
-
-
-print("[SCHEUDLER] start....")
-schedule.every().day.at("23:45").do(create_daily_report)
-schedule.every().sunday.at("23:55").do(create_weekly_report)
-schedule.every(10).minutes.do(job)
-# schedule.every(10).seconds.do(job)
-
-while True:
-    schedule.run_pending()
-    time.sleep(1)  # wait one minute
+    finally:
+        mailer.close()
+
+
+if __name__ == "__main__":
+    print("[SCHEUDLER] start....")
+    schedule.every().day.at("23:45").do(create_daily_report)
+    schedule.every().sunday.at("23:55").do(create_weekly_report)
+    schedule.every(SCHEDULER_INTERVAL_MINUTES).minutes.do(job)
+    # schedule.every(10).seconds.do(job)
+
+    while True:
+        schedule.run_pending()
+        time.sleep(1)  # wait one minute
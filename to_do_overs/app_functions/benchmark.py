@@ -0,0 +1,302 @@
+"""Benchmark - Habitica To Do Over tool
+
+Measures the scheduler and the report jobs against a FakeHabitica: seeds
+users and tasks, completes a share of the tasks before every scheduler
+cycle, and reports cycles per second, requests per recreation and peak
+memory. Results are appended to a JSON lines file so runs can be compared
+over time.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+__author__ = "Katie Patterson kirska.com"
+__license__ = "MIT"
+
+from datetime import datetime, timedelta
+import json
+import os
+import random
+import subprocess
+import time
+import tracemalloc
+
+from django.utils import timezone
+
+from to_do_overs.models import Jobs, SchedulerRuns, Tags, Tasks, Users
+from . import email_delivery, habitica_client
+from .cipher_functions import encrypt_text
+
+# a result counts as a regression when it is this much worse than the last one
+REGRESSION_THRESHOLD = 0.2
+
+
+class _NullSMTP(object):
+    """SMTP connection that drops every message, the benchmark sends none."""
+
+    def send_message(self, message):
+        pass
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def seed(fake, users, tasks_per_user):
+    """Create users with To-Do Overs in the database and on the fake.
+
+    Every user also gets a habit and a daily with history today, so the
+    daily report has something to report.
+
+    Args:
+        fake: the running FakeHabitica.
+        users: number of users.
+        tasks_per_user: number of To-Do Overs per user.
+    """
+    api_key = str(encrypt_text("benchmark"))
+    today_ms = time.time() * 1e3
+    for user_number in range(users):
+        user_id = "benchmark-user-%d" % user_number
+        tag_id = fake.add_user(user_id)
+        user = Users.objects.create(user_id=user_id, api_key=api_key, username=user_id)
+        tag = Tags.objects.create(tag_id=tag_id, tag_text="benchmark", tag_owner=user)
+        fake.add_task(
+            user_id,
+            type="habit",
+            frequency="daily",
+            counterUp=1,
+            counterDown=0,
+            history=[{"date": today_ms, "value": 1}],
+        )
+        fake.add_task(
+            user_id,
+            type="daily",
+            frequency="daily",
+            repeat={},
+            everyX=1,
+            streak=1,
+            history=[{"date": today_ms, "isDue": True, "completed": True}],
+        )
+        tasks = [
+            Tasks(
+                task_id=fake.add_task(user_id, tags=[tag_id])["id"],
+                name="task %d" % task_number,
+                owner=user,
+            )
+            for task_number in range(tasks_per_user)
+        ]
+        Tasks.objects.bulk_create(tasks)
+        Tasks.tags.through.objects.bulk_create(
+            Tasks.tags.through(tasks_id=task.pk, tags_id=tag.pk)
+            for task in Tasks.objects.filter(owner=user)
+        )
+    # the tags were just seeded, don't count a tag sync per user
+    Users.objects.update(tags_synced_at=timezone.now())
+
+
+def _prepare_cycle(fake, rng, complete_fraction):
+    # every task is due and no user was checked recently
+    Tasks.objects.update(next_check_at=None)
+    Users.objects.update(next_sync_at=None, lease_owner="", lease_expires_at=None)
+    task_ids = list(Tasks.objects.values_list("task_id", flat=True))
+    # completed a minute ago, so week/month style same-day checks don't apply
+    completed_at = datetime.utcnow() - timedelta(minutes=1)
+    for task_id in rng.sample(task_ids, int(len(task_ids) * complete_fraction)):
+        fake.complete(task_id, completed_at)
+
+
+def _traced(func):
+    # run func once under tracemalloc, returning its result and peak in KiB
+    tracemalloc.start()
+    try:
+        result = func()
+        return result, tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def run(
+    fake,
+    users=10,
+    tasks_per_user=20,
+    cycles=3,
+    complete_fraction=0.2,
+    engine="sync",
+    seed_=0,
+):
+    """Benchmark job() and the report jobs against a fake Habitica.
+
+    Runs in the current database, which should be a throwaway one.
+
+    Args:
+        fake: the running FakeHabitica.
+        users: number of users to seed.
+        tasks_per_user: number of To-Do Overs per user.
+        cycles: number of timed scheduler cycles.
+        complete_fraction: share of the tasks completed before each cycle.
+        engine: the SCHEDULER_ENGINE to benchmark, "sync" or "async".
+        seed_: seed for picking the completed tasks.
+
+    Returns:
+        Dict of the results.
+    """
+    # the scheduler script lives next to manage.py, outside the app
+    import scheduled_script
+
+    rng = random.Random(seed_)
+    api_url = habitica_client.API_URL
+    scheduler_engine = scheduled_script.SCHEDULER_ENGINE
+    scheduler_processes = scheduled_script.SCHEDULER_PROCESSES
+    habitica_client.API_URL = fake.url
+    scheduled_script.SCHEDULER_ENGINE = engine
+    # worker processes would start without the throwaway database's settings
+    scheduled_script.SCHEDULER_PROCESSES = 1
+    try:
+        seed(fake, users, tasks_per_user)
+
+        durations = []
+        requests = 0
+        recreations = 0
+        http_429 = 0
+        for _ in range(cycles):
+            _prepare_cycle(fake, rng, complete_fraction)
+            started = time.perf_counter()
+            scheduled_script.job()
+            durations.append(time.perf_counter() - started)
+            run_ = SchedulerRuns.objects.order_by("-started_at", "-pk").first()
+            requests += run_.http_requests
+            recreations += run_.recreations
+            http_429 += run_.http_429
+
+        # memory is traced in a cycle of its own, tracing slows the timed ones
+        _prepare_cycle(fake, rng, complete_fraction)
+        _, job_peak = _traced(scheduled_script.job)
+
+        started = time.perf_counter()
+        daily_stats, daily_peak = _traced(scheduled_script.create_daily_report)
+        daily_seconds = time.perf_counter() - started
+
+        mailer = email_delivery.Mailer(smtp_factory=_NullSMTP)
+        started = time.perf_counter()
+        weekly_stats, weekly_peak = _traced(
+            lambda: scheduled_script.create_weekly_report(mailer)
+        )
+        weekly_seconds = time.perf_counter() - started
+    finally:
+        habitica_client.API_URL = api_url
+        scheduled_script.SCHEDULER_ENGINE = scheduler_engine
+        scheduled_script.SCHEDULER_PROCESSES = scheduler_processes
+        habitica_client.close()
+
+    total = sum(durations)
+    report_stats = daily_stats + weekly_stats
+    return {
+        "users": users,
+        "tasks_per_user": tasks_per_user,
+        "cycles": cycles,
+        "complete_fraction": complete_fraction,
+        "engine": engine,
+        "latency": fake.latency,
+        "error_429_rate": fake.error_429_rate,
+        "error_5xx_rate": fake.error_5xx_rate,
+        "cycle_seconds": [round(duration, 4) for duration in durations],
+        "cycles_per_second": cycles / total if total else None,
+        "tasks_per_second": users * tasks_per_user * cycles / total if total else None,
+        "requests_per_recreation": requests / recreations if recreations else None,
+        "recreations": recreations,
+        "http_requests": requests,
+        "http_429": http_429,
+        # as served by the fake, the scheduler ledger only counts 429s
+        "http_5xx": sum(
+            count
+            for (method, pattern, status), count in fake.requests.items()
+            if status >= 500
+        ),
+        "jobs_left": Jobs.objects.count(),
+        "jobs_given_up": Jobs.objects.filter(next_attempt_at__isnull=True).count(),
+        "report_failed": report_stats["failed"],
+        "report_timed_out": report_stats["timed out"],
+        "job_peak_kib": round(job_peak, 1),
+        "daily_report_seconds": round(daily_seconds, 4),
+        "daily_report_peak_kib": round(daily_peak, 1),
+        "weekly_report_seconds": round(weekly_seconds, 4),
+        "weekly_report_peak_kib": round(weekly_peak, 1),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _same_setup(result, other):
+    keys = (
+        "users",
+        "tasks_per_user",
+        "cycles",
+        "complete_fraction",
+        "engine",
+        "latency",
+        "error_429_rate",
+        "error_5xx_rate",
+    )
+    return all(result.get(key) == other.get(key) for key in keys)
+
+
+def compare(result, path):
+    """Compare a result with the last one of the same setup in a results file.
+
+    Args:
+        result: the result from run.
+        path: the JSON lines file of earlier results.
+
+    Returns:
+        List of messages about the numbers that got worse by more than
+        REGRESSION_THRESHOLD.
+    """
+    if not os.path.exists(path):
+        return []
+    previous = None
+    with open(path) as results:
+        for line in results:
+            if line.strip():
+                other = json.loads(line)
+                if _same_setup(result, other):
+                    previous = other
+    if previous is None:
+        return []
+
+    regressions = []
+    # higher is better for the first, lower for the others
+    for key, higher_is_better in (
+        ("cycles_per_second", True),
+        ("requests_per_recreation", False),
+        ("job_peak_kib", False),
+        ("daily_report_seconds", False),
+        ("weekly_report_seconds", False),
+    ):
+        old, new = previous.get(key), result.get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if (-change if higher_is_better else change) > REGRESSION_THRESHOLD:
+            regressions.append(
+                "%s went from %s to %s since %s"
+                % (key, old, new, previous.get("commit") or previous.get("date"))
+            )
+    return regressions
+
+
+def save(result, path):
+    """Append a result to a JSON lines file, with the date and git commit."""
+    result = dict(result, date=timezone.now().isoformat(), commit=_git_commit())
+    with open(path, "a") as results:
+        results.write(json.dumps(result, sort_keys=True) + "\n")
+    return result
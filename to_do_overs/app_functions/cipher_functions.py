@@ -10,12 +10,36 @@ __license__ = "MIT"
 
 import os
 import sys
+from functools import lru_cache
 
 # import argparse
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
 
 from .local_defines import CIPHER_FILE
 
+# decrypted text by cipher text, only kept while a scheduler run is going on
+_credential_cache = None
+
+
+@lru_cache(maxsize=None)
+def _cipher_suite(cipher_file_path=CIPHER_FILE):
+    """Load the cipher key once per process.
+
+    The cipher file may hold several keys, one per line, to rotate keys.
+    The first key encrypts and any of them decrypts.
+
+    Args:
+        cipher_file_path: optional specification of path to file.
+
+    Returns:
+        The Fernet or MultiFernet built from the key file.
+    """
+    with open(cipher_file_path, "rb") as cipher_file:
+        keys = cipher_file.read().split()
+    if len(keys) == 1:
+        return Fernet(keys[0])
+    return MultiFernet([Fernet(key) for key in keys])
+
 
 def generate_cipher_key():
     """Generates a cipher key.
@@ -27,12 +51,13 @@ def generate_cipher_key():
     key = Fernet.generate_key()
     with open(CIPHER_FILE, "wb") as cipher_file:
         cipher_file.write(key)
+    _cipher_suite.cache_clear()
 
 
 def encrypt_text(text):
     """Encrypt some text using the cipher key.
 
-    Read the cipher key from file and use it to encrypt some text.
+    Use the cipher key from the cipher file to encrypt some text.
 
     Args:
         text: the text to be encrypted.
@@ -40,17 +65,15 @@ def encrypt_text(text):
     Returns:
         The encrypted text.
     """
-    with open(CIPHER_FILE, "rb") as cipher_file:
-        key = cipher_file.read()
-        cipher_suite = Fernet(key)
-        cipher_text = cipher_suite.encrypt(bytes(text, "utf-8"))
-        return cipher_text
+    return _cipher_suite().encrypt(bytes(text, "utf-8"))
 
 
 def decrypt_text(cipher_text, cipher_file_path=CIPHER_FILE):
     """Decrypt some text back into the plain text.
 
-    Read the cipher key from file and use it to decrypt some text.
+    Use the cipher key from the cipher file to decrypt some text. While a
+    credential cache is active the plain text is remembered, so every
+    Users row is only decrypted once per scheduler run.
 
     Args:
         cipher_text: the encrypted text we want to decrypt.
@@ -59,14 +82,31 @@ def decrypt_text(cipher_text, cipher_file_path=CIPHER_FILE):
     Returns:
         The decrypted text.
     """
-    with open(cipher_file_path, "rb") as cipher_file:
-        key = cipher_file.read()
-        cipher_suite = Fernet(key)
-        if isinstance(cipher_text, str):
-            cipher_text = cipher_text[2:-1]
-            cipher_text = bytes(cipher_text, "utf-8")
-        plain_text = cipher_suite.decrypt(cipher_text)
-        return plain_text
+    cache = _credential_cache
+    if cache is not None and cipher_text in cache:
+        return cache[cipher_text]
+
+    cache_key = cipher_text
+    if isinstance(cipher_text, str):
+        cipher_text = cipher_text[2:-1]
+        cipher_text = bytes(cipher_text, "utf-8")
+    plain_text = _cipher_suite(cipher_file_path).decrypt(cipher_text)
+
+    if cache is not None:
+        cache[cache_key] = plain_text
+    return plain_text
+
+
+def start_credential_cache():
+    """Remember decrypted text until clear_credential_cache is called."""
+    global _credential_cache
+    _credential_cache = {}
+
+
+def clear_credential_cache():
+    """Forget all decrypted text and stop caching it."""
+    global _credential_cache
+    _credential_cache = None
 
 
 def test_cipher(test_text):
@@ -0,0 +1,174 @@
+"""Email delivery - Habitica To Do Over tool
+
+Weekly reports are sent over a few long-lived SMTP connections that log in
+once per batch, instead of connecting and logging in again for every user.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+__author__ = "Katie Patterson kirska.com"
+__license__ = "MIT"
+
+from email.message import EmailMessage
+import os
+import queue
+import smtplib
+import ssl
+import threading
+import time
+
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+# "False" for a plain connection, e.g. to a local SMTP server while testing
+SMTP_SSL = os.getenv("SMTP_SSL", "True") == "True"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+# SMTP connections used at the same time, and how often a failed send is retried
+EMAIL_CONNECTIONS = int(os.getenv("EMAIL_CONNECTIONS", "4"))
+EMAIL_RETRIES = int(os.getenv("EMAIL_RETRIES", "3"))
+# wait before retrying, doubled after every failed attempt
+RETRY_DELAY_SECONDS = 1.0
+
+
+def connect():
+    """Open an SMTP connection and log in with EMAIL_FROM and EMAIL_PASS.
+
+    Returns:
+        The connected smtplib client.
+    """
+    if SMTP_SSL:
+        server = smtplib.SMTP_SSL(
+            SMTP_HOST,
+            SMTP_PORT,
+            context=ssl.create_default_context(),
+            timeout=SMTP_TIMEOUT,
+        )
+    else:
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+    password = os.getenv("EMAIL_PASS")
+    if password:
+        try:
+            server.login(os.getenv("EMAIL_FROM"), password)
+        except (smtplib.SMTPException, OSError):
+            # don't leave the socket open for the retry to pile up on
+            server.close()
+            raise
+    return server
+
+
+def _permanent(error):
+    # 5xx replies and refused recipients fail the same way on every attempt
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and (
+        error.smtp_code >= 500
+    )
+
+
+def build_message(subject, html, attachments):
+    """Build an HTML email from EMAIL_FROM to EMAIL_TO.
+
+    Args:
+        subject: the subject line.
+        html: the HTML body.
+        attachments: iterable of (filename, bytes) tuples. They are all
+            held in the message, smtplib sends a message in one piece.
+
+    Returns:
+        The email message.
+    """
+    message = EmailMessage()
+    message["From"] = os.getenv("EMAIL_FROM")
+    message["To"] = os.getenv("EMAIL_TO")
+    message["Subject"] = subject
+    message.set_content(html, subtype="html")
+    for filename, content in attachments:
+        message.add_attachment(
+            content,
+            maintype="application",
+            subtype="octet-stream",
+            filename=filename,
+        )
+    return message
+
+
+class Mailer(object):
+    """Send emails over a bounded pool of reused SMTP connections.
+
+    At most `connections` messages are sent at once. A connection is opened
+    the first time it is needed and kept until close. A message that fails
+    is retried on a fresh connection. It is safe to share one mailer between
+    threads.
+    """
+
+    def __init__(
+        self,
+        connections=EMAIL_CONNECTIONS,
+        retries=EMAIL_RETRIES,
+        smtp_factory=connect,
+        sleep=time.sleep,
+    ):
+        self.retries = retries
+        self._smtp_factory = smtp_factory
+        self._sleep = sleep
+        self._slots = threading.BoundedSemaphore(connections)
+        self._idle = queue.LifoQueue()
+
+    def _take(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._smtp_factory()
+
+    @staticmethod
+    def _discard(server):
+        try:
+            server.close()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+    def send(self, message):
+        """Send a message, retrying with a fresh connection on failure.
+
+        Permanent failures, 5xx replies and refused recipients, are not
+        retried.
+
+        Args:
+            message: the email message, see build_message.
+
+        Raises:
+            smtplib.SMTPException or OSError on a permanent failure or once
+            every attempt failed.
+        """
+        with self._slots:
+            for attempt in range(self.retries + 1):
+                server = None
+                try:
+                    server = self._take()
+                    server.send_message(message)
+                except (smtplib.SMTPException, OSError) as error:
+                    if _permanent(error):
+                        # the server answered and reset, the connection is fine
+                        if server is not None:
+                            self._idle.put(server)
+                        raise
+                    if server is not None:
+                        self._discard(server)
+                    if attempt == self.retries:
+                        raise
+                    print("[EMAIL] sending failed, retrying: " + repr(error))
+                    self._sleep(RETRY_DELAY_SECONDS * 2 ** attempt)
+                else:
+                    self._idle.put(server)
+                    return
+
+    def close(self):
+        """Log out of every open connection."""
+        while True:
+            try:
+                server = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                self._discard(server)
@@ -0,0 +1,284 @@
+"""Fake Habitica - Habitica To Do Over tool
+
+A small in-process stand-in for the Habitica API, for benchmarking the
+scheduler and the reports without sending load to the real API. It serves
+the endpoints the tool uses: /user, /tags, /tasks/user and /tasks/<id>.
+Latency, 429 and 5xx responses can be injected to see how the tool copes.
+Point HABITICA_API_URL (or habitica_client.API_URL) at its url.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+__author__ = "Katie Patterson kirska.com"
+__license__ = "MIT"
+
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+import uuid
+
+API_PREFIX = "/api/v3"
+
+
+def _now_text():
+    return datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # one line per request would drown the benchmark output
+        pass
+
+    def _reply(self, status, data=None, headers=None):
+        body = json.dumps(
+            {"success": status < 400, "data": data}, separators=(",", ":")
+        ).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length).decode("utf-8") if length else ""
+        if not raw:
+            return {}
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(raw)
+        # form encoded, as sent by requests for data=
+        return {
+            key: values if key == "tags" else values[0]
+            for key, values in parse_qs(raw).items()
+        }
+
+    def _handle(self):
+        fake = self.server.fake
+        split_url = urlsplit(self.path)
+        path = split_url.path
+        if path.startswith(API_PREFIX):
+            path = path[len(API_PREFIX) :]
+        body = self._body()
+        status, data, headers = fake.handle(
+            self.command,
+            path,
+            parse_qs(split_url.query),
+            self.headers.get("x-api-user", ""),
+            body,
+        )
+        self._reply(status, data, headers)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+class FakeHabitica(object):
+    """In-process fake of the Habitica API.
+
+    Users and tasks live in memory. Every request first waits `latency`
+    seconds, then is answered with 429 with probability `error_429_rate`
+    or with 503 with probability `error_5xx_rate`.
+
+    Use it as a context manager, or call start and stop.
+
+    Attributes:
+        requests (Counter): Requests served, keyed by (method, path pattern,
+            status).
+    """
+
+    def __init__(
+        self,
+        latency=0.0,
+        error_429_rate=0.0,
+        error_5xx_rate=0.0,
+        retry_after=0.1,
+        rate_limit=10000,
+        seed=0,
+    ):
+        self.latency = latency
+        self.error_429_rate = error_429_rate
+        self.error_5xx_rate = error_5xx_rate
+        self.retry_after = retry_after
+        self.rate_limit = rate_limit
+        self.requests = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._users = {}
+        self._tasks = {}
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """The base URL to use for HABITICA_API_URL."""
+        host, port = self._server.server_address[:2]
+        return "http://%s:%d%s" % (host, port, API_PREFIX)
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-habitica", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def add_user(self, user_id, name="benchmark"):
+        """Add a user with one tag and no tasks.
+
+        Returns:
+            The tag ID of the user's tag.
+        """
+        tag_id = str(uuid.uuid4())
+        with self._lock:
+            self._users[user_id] = {
+                "name": name,
+                "tags": [{"id": tag_id, "name": "benchmark"}],
+                "tasks": [],
+            }
+        return tag_id
+
+    def add_task(self, user_id, **fields):
+        """Add a task to a user, a todo unless fields say otherwise.
+
+        Returns:
+            The task as Habitica would send it.
+        """
+        task = {
+            "id": str(uuid.uuid4()),
+            "type": "todo",
+            "text": "task",
+            "notes": "",
+            "tags": [],
+            "completed": False,
+            "createdAt": _now_text(),
+            "updatedAt": _now_text(),
+        }
+        task.update(fields)
+        task["userId"] = user_id
+        with self._lock:
+            self._tasks[task["id"]] = task
+            if task.get("alias"):
+                self._tasks[task["alias"]] = task
+            self._users[user_id]["tasks"].append(task)
+        return task
+
+    def complete(self, task_id, completed_at=None):
+        """Mark a todo completed, as if the user ticked it off."""
+        with self._lock:
+            task = self._tasks[task_id]
+            task["completed"] = True
+            task["dateCompleted"] = (completed_at or datetime.utcnow()).strftime(
+                "%Y-%m-%dT%H:%M:%S.%fZ"
+            )
+
+    def _create(self, user_id, task_data):
+        alias = task_data.get("alias")
+        with self._lock:
+            if alias and alias in self._tasks:
+                return None
+        fields = {
+            key: task_data[key]
+            for key in ("text", "type", "notes", "priority", "tags", "alias", "date")
+            if key in task_data
+        }
+        return self.add_task(user_id, **fields)
+
+    def _injected_error(self):
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.error_429_rate:
+            return 429, {"Retry-After": str(self.retry_after)}
+        if roll < self.error_429_rate + self.error_5xx_rate:
+            return 503, {}
+        return None
+
+    def handle(self, method, path, query, user_id, body):
+        """Answer one API request.
+
+        Returns:
+            Tuple of the status, the "data" of the reply and extra headers.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        parts = path.strip("/").split("/")
+        pattern = "/" + "/".join(
+            "{id}" if index == 1 and parts[0] == "tasks" and part != "user" else part
+            for index, part in enumerate(parts)
+        )
+        status, data, headers = self._route(method, parts, query, user_id, body)
+        headers["X-RateLimit-Limit"] = str(self.rate_limit)
+        headers["X-RateLimit-Remaining"] = str(self.rate_limit - 1)
+        with self._lock:
+            self.requests[(method, pattern, status)] += 1
+        return status, data, headers
+
+    def _route(self, method, parts, query, user_id, body):
+        error = self._injected_error()
+        if error is not None:
+            return error[0], None, error[1]
+        user = self._users.get(user_id)
+        if user is None:
+            return 401, None, {}
+
+        if parts == ["user"] and method == "GET":
+            return 200, {"id": user_id, "profile": {"name": user["name"]}}, {}
+        if parts == ["tags"] and method == "GET":
+            return 200, user["tags"], {}
+        if parts == ["tasks", "user"] and method == "GET":
+            task_type = query.get("type", [""])[0]
+            with self._lock:
+                tasks = list(user["tasks"])
+            completed_todos = [
+                task for task in tasks if task["type"] == "todo" and task["completed"]
+            ]
+            if task_type == "completedTodos":
+                return 200, completed_todos, {}
+            # completed todos are only listed on their own
+            tasks = [task for task in tasks if task not in completed_todos]
+            if task_type:
+                # "todos", "habits", "dailys"
+                tasks = [task for task in tasks if task["type"] == task_type[:-1]]
+            return 200, tasks, {}
+        if parts == ["tasks", "user"] and method == "POST":
+            if isinstance(body, list):
+                created = [self._create(user_id, task_data) for task_data in body]
+                if None in created:
+                    return 400, None, {}
+                return 201, created, {}
+            created = self._create(user_id, body)
+            if created is None:
+                return 400, None, {}
+            return 201, created, {}
+        if len(parts) == 2 and parts[0] == "tasks":
+            with self._lock:
+                task = self._tasks.get(parts[1])
+            if task is None or task["userId"] != user_id:
+                return 404, None, {}
+            if method == "GET":
+                return 200, task, {}
+            if method == "PUT":
+                with self._lock:
+                    task.update(body)
+                return 200, task, {}
+        return 404, None, {}
@@ -0,0 +1,105 @@
+"""
+Shared HTTP client for the Habitica To Do Over tool.
+
+All requests to Habitica go through one pooled keep-alive session so the TLS
+handshake is paid once per connection instead of once per call.
+"""
+
+__author__ = "Katie Patterson kirska.com"
+__license__ = "MIT"
+
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .cipher_functions import decrypt_text
+
+# base URL of the Habitica API, e.g. a local fake Habitica for benchmarks
+API_URL = os.getenv("HABITICA_API_URL", "https://habitica.com/api/v3")
+# (connect, read) timeouts in seconds so a hung socket can't stall the scheduler
+TIMEOUT = (
+    float(os.getenv("HABITICA_CONNECT_TIMEOUT", "5")),
+    float(os.getenv("HABITICA_READ_TIMEOUT", "30")),
+)
+# keep-alive connections kept open to Habitica, should cover the scheduler's concurrency
+POOL_SIZE = int(os.getenv("HABITICA_POOL_SIZE", "10"))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Get the shared session, creating it on first use.
+
+    Returns:
+        The requests session used for every call to Habitica.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def api_url(path):
+    """Build the URL of a Habitica API endpoint.
+
+    Args:
+        path: the endpoint, e.g. "/tasks/user".
+
+    Returns:
+        The full URL under API_URL.
+    """
+    return API_URL.rstrip("/") + path
+
+
+def request(method, url, **kwargs):
+    """Send a request over the shared session with the default timeouts.
+
+    Args:
+        method: the HTTP method.
+        url: the URL to request.
+        **kwargs: passed on to requests.
+
+    Returns:
+        The response.
+    """
+    kwargs.setdefault("timeout", TIMEOUT)
+    return get_session().request(method, url, **kwargs)
+
+
+def user_headers(hab_user_id, api_token):
+    """Build the authentication headers for a user.
+
+    The plain token isn't kept here. During a scheduler run decrypt_text
+    serves it from the credential cache, which is cleared when the run ends.
+
+    Args:
+        hab_user_id: the user ID from Habitica.
+        api_token: the encrypted API token.
+
+    Returns:
+        Dict of headers.
+    """
+    return {
+        "x-client": hab_user_id + "-TODO-Overs",
+        "x-api-user": hab_user_id,
+        "x-api-key": decrypt_text(api_token),
+    }
+
+
+def close():
+    """Close the pooled connections.
+
+    The next request opens a fresh session.
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
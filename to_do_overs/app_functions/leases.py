@@ -0,0 +1,145 @@
+"""Leases - Habitica To Do Over tool
+
+Several scheduler replicas can share one database. A replica has to claim a
+user's lease before checking the user's tasks, so no two replicas work on
+the same user at once. Leases are renewed while the work runs and simply
+expire when a replica dies, letting another replica take the user over.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+__author__ = "Katie Patterson kirska.com"
+__license__ = "MIT"
+
+from datetime import timedelta
+import os
+import socket
+import threading
+import uuid
+
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from to_do_overs.models import Users
+
+# how long a claimed user stays locked to a replica without a heartbeat
+LEASE_SECONDS = int(os.getenv("SCHEDULER_LEASE_SECONDS", "300"))
+# how often held leases are renewed, well within their lifetime
+HEARTBEAT_SECONDS = LEASE_SECONDS / 3.0
+
+_replica_ids = {}
+
+
+def replica_id():
+    """Get the name this process holds its leases under.
+
+    Worker processes forked from one another get names of their own.
+
+    Returns:
+        "<host>-<pid>-<random>" for the current process.
+    """
+    pid = os.getpid()
+    if pid not in _replica_ids:
+        _replica_ids[pid] = "%s-%d-%s" % (
+            socket.gethostname(),
+            pid,
+            uuid.uuid4().hex[:8],
+        )
+    return _replica_ids[pid]
+
+
+def claim_user(user, replica=None, due_only=False):
+    """Take the lease of a user that is free, expired or already ours.
+
+    The check and the claim are a single UPDATE, so two replicas can never
+    both succeed.
+
+    Args:
+        user: the user from the tool database.
+        replica: optional name to claim under, defaults to replica_id().
+        due_only: only claim the user if its tasks are due to be checked,
+            i.e. no replica has checked them since the user was loaded.
+
+    Returns:
+        True if the lease is now held by the replica.
+    """
+    replica = replica or replica_id()
+    now = timezone.now()
+    USERS = Users.objects.filter(pk=user.pk).filter(
+        Q(lease_expires_at__isnull=True)
+        | Q(lease_expires_at__lte=now)
+        | Q(lease_owner=replica)
+    )
+    if due_only:
+        USERS = USERS.filter(Q(next_sync_at__isnull=True) | Q(next_sync_at__lte=now))
+    claimed = USERS.update(
+        lease_owner=replica,
+        lease_expires_at=now + timedelta(seconds=LEASE_SECONDS),
+    )
+    return claimed == 1
+
+
+def renew_leases(replica=None):
+    """Push back the expiry of every lease the replica still holds.
+
+    Args:
+        replica: optional name of the replica, defaults to replica_id().
+
+    Returns:
+        The number of leases renewed.
+    """
+    replica = replica or replica_id()
+    now = timezone.now()
+    return Users.objects.filter(lease_owner=replica, lease_expires_at__gt=now).update(
+        lease_expires_at=now + timedelta(seconds=LEASE_SECONDS)
+    )
+
+
+def release_user(user, next_sync_at=None, replica=None):
+    """Give up the lease of a user once the work on it is done.
+
+    Args:
+        user: the user from the tool database.
+        next_sync_at: optional time the user's tasks are due again, so
+            other replicas don't check them straight after.
+        replica: optional name of the replica, defaults to replica_id().
+    """
+    replica = replica or replica_id()
+    fields = {"lease_owner": "", "lease_expires_at": None}
+    if next_sync_at is not None:
+        fields["next_sync_at"] = next_sync_at
+    Users.objects.filter(pk=user.pk, lease_owner=replica).update(**fields)
+
+
+class Heartbeat(object):
+    """Renew this process' leases in a background thread.
+
+    Use it as a context manager around work done under leases.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval or HEARTBEAT_SECONDS
+        self.replica = replica_id()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        try:
+            while not self._stopped.wait(self.interval):
+                try:
+                    renew_leases(self.replica)
+                except Exception as exception:  # pylint: disable=broad-except
+                    # keep beating, a lease only expires after several misses
+                    print("[LEASE] renewing leases failed: " + repr(exception))
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
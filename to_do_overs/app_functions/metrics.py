@@ -0,0 +1,306 @@
+"""Metrics - Habitica To Do Over tool
+
+Counts what a scheduler run does: requests to Habitica and their latency
+per endpoint, 429 responses, time spent waiting on the rate limit and the
+tasks recreated and deleted. A run's numbers are saved to the
+SchedulerRuns ledger and served in the Prometheus text format.
+
+Also records how long users waited between completing a To-Do Over and
+getting it back, and the percentiles of that wait.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+__author__ = "Katie Patterson kirska.com"
+__license__ = "MIT"
+
+from collections import Counter, defaultdict
+from datetime import timedelta
+import json
+import math
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+from django.utils import timezone
+
+from to_do_overs.models import RecreationLatencies, SchedulerRuns, Tasks
+
+# upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# percentiles of the recreation latency
+PERCENTILES = (0.5, 0.9, 0.99)
+# recreations the percentiles on /metrics are taken over
+LATENCY_WINDOW = timedelta(days=1)
+
+_lock = threading.Lock()
+_counts = Counter()
+
+
+def endpoint_name(method, url):
+    """Name a request to Habitica without the IDs in it.
+
+    Args:
+        method: the HTTP method.
+        url: the URL requested.
+
+    Returns:
+        E.g. "GET /tasks/{id}" or "GET /tasks/user?type=completedTodos".
+    """
+    split_url = urlsplit(url)
+    parts = [part for part in split_url.path.split("/") if part]
+    if parts[:2] == ["api", "v3"]:
+        parts = parts[2:]
+    parts = [
+        # task IDs, tag IDs and tdo- aliases all have digits in them
+        "{id}" if any(char.isdigit() for char in part) else part
+        for part in parts
+    ]
+    name = method + " /" + "/".join(parts)
+    task_type = parse_qs(split_url.query).get("type")
+    if task_type:
+        name += "?type=" + task_type[0]
+    return name
+
+
+def record_request(method, url, status_code, seconds, waited):
+    """Count a request to Habitica.
+
+    Args:
+        method: the HTTP method.
+        url: the URL requested.
+        status_code: the HTTP status, 0 if there was no response.
+        seconds: how long the request took.
+        waited: seconds spent waiting on the rate limit before sending it.
+    """
+    endpoint = endpoint_name(method, url)
+    with _lock:
+        _counts["http_requests"] += 1
+        if status_code == 429:
+            _counts["http_429"] += 1
+        _counts["rate_limit_wait_seconds"] += waited
+        _counts[("http_count", endpoint)] += 1
+        _counts[("http_sum", endpoint)] += seconds
+        for bound in LATENCY_BUCKETS:
+            if seconds <= bound:
+                _counts[("http_bucket", endpoint, bound)] += 1
+
+
+def increment(name, amount=1):
+    """Add to one of the run's counters, e.g. "recreations"."""
+    with _lock:
+        _counts[name] += amount
+
+
+def take():
+    """Get the counts since the last call and start counting from zero.
+
+    Returns:
+        Counter of the counts. Counters from several processes can be
+        added up with update.
+    """
+    global _counts
+    with _lock:
+        counts, _counts = _counts, Counter()
+    return counts
+
+
+def save_run(started_at, duration, counts):
+    """Save a scheduler run to the ledger.
+
+    Args:
+        started_at: the aware datetime the run started.
+        duration: how long the run took in seconds.
+        counts: Counter of the run, see take, plus the scheduler's own
+            "users", "tasks" and "jobs" counts.
+
+    Returns:
+        The saved run.
+    """
+    latency = {}
+    for key, value in counts.items():
+        if not isinstance(key, tuple):
+            continue
+        endpoint = latency.setdefault(key[1], {"count": 0, "sum": 0.0, "buckets": {}})
+        if key[0] == "http_count":
+            endpoint["count"] = value
+        elif key[0] == "http_sum":
+            endpoint["sum"] = value
+        else:
+            endpoint["buckets"][str(key[2])] = value
+
+    return SchedulerRuns.objects.create(
+        started_at=started_at,
+        duration_seconds=duration,
+        users=counts["users"],
+        tasks_scanned=counts["tasks"],
+        jobs=counts["jobs"],
+        recreations=counts["recreations"],
+        deletes=counts["deletes"],
+        http_requests=counts["http_requests"],
+        http_429=counts["http_429"],
+        rate_limit_wait_seconds=counts["rate_limit_wait_seconds"],
+        http_latency=json.dumps(latency, sort_keys=True),
+    )
+
+
+def record_recreations(jobs):
+    """Save how long the users waited for the tasks of recreate jobs.
+
+    Jobs queued without the completion time are skipped.
+
+    Args:
+        jobs: recreate jobs whose tasks were just recreated.
+    """
+    recreated_at = timezone.now()
+    RecreationLatencies.objects.bulk_create(
+        RecreationLatencies(
+            owner_id=job.owner_id,
+            task_type=job.task.type,
+            delayed=job.task.delay > 0,
+            completed_at=job.completed_at,
+            due_at=job.due_at,
+            recreated_at=recreated_at,
+            latency_seconds=(recreated_at - job.completed_at).total_seconds(),
+            # a week task completed days early is due from the start of its
+            # day, a task completed on that day is due right away
+            lag_seconds=(
+                recreated_at - max(job.completed_at, job.due_at)
+            ).total_seconds(),
+        )
+        for job in jobs
+        if job.completed_at is not None and job.due_at is not None
+    )
+
+
+def percentile(values, fraction):
+    """Get a percentile by the nearest-rank method.
+
+    Args:
+        values: sorted numbers.
+        fraction: e.g. 0.9 for the 90th percentile.
+
+    Returns:
+        The smallest value at least that fraction of values are at or below.
+    """
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def latency_percentiles(since, until=None):
+    """Get the percentiles of the recreation latency and scheduling lag.
+
+    Args:
+        since: the aware datetime to start at.
+        until: optional aware datetime to stop before.
+
+    Returns:
+        Dict of (task type name, delayed) to a dict with the "count" of
+        recreations, the "latency" and "lag" percentiles in seconds, each a
+        dict of fraction to value, and their "latency_sum" and "lag_sum".
+    """
+    LATENCIES = RecreationLatencies.objects.filter(recreated_at__gte=since)
+    if until is not None:
+        LATENCIES = LATENCIES.filter(recreated_at__lt=until)
+
+    groups = defaultdict(lambda: ([], []))
+    type_names = dict(Tasks.TYPE_CHOICES)
+    for task_type, delayed, latency, lag in LATENCIES.values_list(
+        "task_type", "delayed", "latency_seconds", "lag_seconds"
+    ).iterator():
+        latencies, lags = groups[(type_names[task_type].lower(), delayed)]
+        latencies.append(latency)
+        lags.append(lag)
+
+    result = {}
+    for key, (latencies, lags) in sorted(groups.items()):
+        latencies.sort()
+        lags.sort()
+        result[key] = {
+            "count": len(latencies),
+            "latency_sum": sum(latencies),
+            "lag_sum": sum(lags),
+            "latency": {q: percentile(latencies, q) for q in PERCENTILES},
+            "lag": {q: percentile(lags, q) for q in PERCENTILES},
+        }
+    return result
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _latency_lines():
+    percentiles = latency_percentiles(timezone.now() - LATENCY_WINDOW)
+    lines = []
+    for name, help_text in (
+        ("latency", "Time from completing a To-Do Over to its recreation"),
+        ("lag", "Time from a To-Do Over being due to its recreation"),
+    ):
+        metric = "todo_overs_recreation_%s_seconds" % name
+        lines.append("# HELP %s %s, over the last day." % (metric, help_text))
+        lines.append("# TYPE %s summary" % metric)
+        for (task_type, delayed), group in percentiles.items():
+            label = 'type="%s",delayed="%s"' % (task_type, str(delayed).lower())
+            for fraction, value in group[name].items():
+                lines.append(
+                    '%s{%s,quantile="%s"} %s' % (metric, label, fraction, value)
+                )
+            lines.append("%s_sum{%s} %s" % (metric, label, group[name + "_sum"]))
+            lines.append("%s_count{%s} %d" % (metric, label, group["count"]))
+    return lines
+
+
+def prometheus_text():
+    """Render the ledger in the Prometheus text exposition format.
+
+    Returns:
+        The total number of runs, the recreation latency percentiles of the
+        last day and the numbers of the latest run.
+    """
+    lines = [
+        "# HELP todo_overs_scheduler_runs_total Scheduler runs in the ledger.",
+        "# TYPE todo_overs_scheduler_runs_total counter",
+        "todo_overs_scheduler_runs_total %d" % SchedulerRuns.objects.count(),
+    ]
+    lines.extend(_latency_lines())
+    run = SchedulerRuns.objects.order_by("-started_at").first()
+    if run is None:
+        return "\n".join(lines) + "\n"
+
+    gauges = (
+        ("timestamp_seconds", "Start of the run", run.started_at.timestamp()),
+        ("duration_seconds", "How long the run took", run.duration_seconds),
+        ("users", "Users checked", run.users),
+        ("tasks_scanned", "Tasks checked", run.tasks_scanned),
+        ("jobs", "Queued jobs that succeeded", run.jobs),
+        ("recreations", "Tasks recreated", run.recreations),
+        ("deletes", "Tasks deleted", run.deletes),
+        ("http_requests", "Requests sent to Habitica", run.http_requests),
+        ("http_429", "Requests answered with 429", run.http_429),
+        (
+            "rate_limit_wait_seconds",
+            "Time spent waiting on the rate limit",
+            run.rate_limit_wait_seconds,
+        ),
+    )
+    for name, help_text, value in gauges:
+        metric = "todo_overs_last_run_" + name
+        lines.append("# HELP %s %s." % (metric, help_text))
+        lines.append("# TYPE %s gauge" % metric)
+        lines.append("%s %s" % (metric, value))
+
+    metric = "todo_overs_last_run_http_request_duration_seconds"
+    lines.append("# HELP %s Latency of requests to Habitica." % metric)
+    lines.append("# TYPE %s histogram" % metric)
+    for endpoint, histogram in sorted(json.loads(run.http_latency).items()):
+        label = 'endpoint="%s"' % _label(endpoint)
+        for bound in LATENCY_BUCKETS:
+            lines.append(
+                '%s_bucket{%s,le="%s"} %d'
+                % (metric, label, bound, histogram["buckets"].get(str(bound), 0))
+            )
+        lines.append(
+            '%s_bucket{%s,le="+Inf"} %d' % (metric, label, histogram["count"])
+        )
+        lines.append("%s_sum{%s} %s" % (metric, label, histogram["sum"]))
+        lines.append("%s_count{%s} %d" % (metric, label, histogram["count"]))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,203 @@
+"""Profiling - Habitica To Do Over tool
+
+Opt-in cProfile and tracemalloc sessions around the scheduler jobs. A
+sampled run writes a timestamped .prof file, readable with pstats or
+snakeviz, and a summary of the lines that allocated the most memory.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+__author__ = "Katie Patterson kirska.com"
+__license__ = "MIT"
+
+import cProfile
+from datetime import datetime
+import functools
+import os
+import pstats
+import random
+import threading
+import tracemalloc
+
+from django.conf import settings
+
+# comma separated names of the jobs to profile, e.g. "job,create_daily_report",
+# or "all". Profiling is off when empty
+PROFILE_JOBS = os.getenv("PROFILE_JOBS", "")
+# share of the runs of those jobs that are profiled
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.1"))
+# where the profiles are written, next to the database by default
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR",
+    os.path.join(os.path.dirname(settings.DATABASES["default"]["NAME"]), "profiles"),
+)
+# lines listed in the allocation summary
+PROFILE_TOP_ALLOCATIONS = int(os.getenv("PROFILE_TOP_ALLOCATIONS", "25"))
+# frames kept per allocation, more show where it was called from but cost more
+TRACEMALLOC_FRAMES = 1
+
+
+def _sampled(name):
+    jobs = [job.strip() for job in PROFILE_JOBS.split(",") if job.strip()]
+    if name not in jobs and "all" not in jobs:
+        return False
+    return random.random() < PROFILE_SAMPLE_RATE
+
+
+class _Session(object):
+    """One profiling session, covering the thread that starts it and the
+    threads started while it runs, e.g. the report pool's workers.
+
+    A profiler can only be disabled from its own thread. The session's
+    thread disables its own in stop, every other thread when its target
+    returns. Threads still running at stop are left out of the profile.
+    """
+
+    def __init__(self):
+        self.profiles = []
+        self._lock = threading.Lock()
+        self._started_tracing = False
+        self._own_profile = None
+
+    @staticmethod
+    def _enable():
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # from Python 3.12 on the first profiler already covers every thread
+            return None
+        return profile
+
+    def _profile_thread(self, *args):
+        # called by every new thread on its first event, the call of run(),
+        # enabling the profiler replaces this hook for the thread
+        profile = self._enable()
+        if profile is None:
+            return
+        thread = threading.current_thread()
+        target = getattr(thread, "_target", None)
+        if target is not None:
+            # run() hasn't read its target yet, so the profiler can still be
+            # disabled in this thread once the target returns
+            def profiled_target(*args, **kwargs):
+                try:
+                    return target(*args, **kwargs)
+                finally:
+                    profile.disable()
+
+            thread._target = profiled_target
+        with self._lock:
+            self.profiles.append((thread, profile))
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._started_tracing = True
+        tracemalloc.reset_peak()
+        self._own_profile = self._enable()
+        if self._own_profile is not None:
+            self.profiles.append((threading.current_thread(), self._own_profile))
+        threading.setprofile(self._profile_thread)
+
+    def stop(self):
+        threading.setprofile(None)
+        if self._own_profile is not None:
+            self._own_profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        if self._started_tracing:
+            tracemalloc.stop()
+        return snapshot, peak
+
+    def finished_profiles(self):
+        """Get the profilers that are done recording.
+
+        Returns:
+            Tuple of the list of finished profilers, the session's own
+            first, and the number of threads left out as still running.
+        """
+        with self._lock:
+            profiles = list(self.profiles)
+        current = threading.current_thread()
+        finished = [
+            profile
+            for thread, profile in profiles
+            if thread is current or not thread.is_alive()
+        ]
+        return finished, len(profiles) - len(finished)
+
+
+def _write(name, session, snapshot, peak):
+    """Write the profile and allocation summary of a session.
+
+    Returns:
+        The path of the files without the .prof/.txt extension.
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(
+        PROFILE_DIR, "%s-%s" % (name, datetime.now().strftime("%Y%m%d-%H%M%S"))
+    )
+
+    profiles, running = session.finished_profiles()
+    if running:
+        print("[PROFILE] %d threads of %s still running, left out" % (running, name))
+    if profiles:
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(base + ".prof")
+    else:
+        # another profiler was already running, e.g. a debugger
+        print("[PROFILE] %s not profiled, only its memory is traced" % name)
+
+    snapshot = snapshot.filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        )
+    )
+    with open(base + ".txt", "w") as summary:
+        summary.write("peak traced memory: %.1f KiB\n" % (peak / 1024))
+        summary.write("threads profiled: %d\n" % len(profiles))
+        summary.write("top %d allocations by line:\n" % PROFILE_TOP_ALLOCATIONS)
+        for stat in snapshot.statistics("lineno")[:PROFILE_TOP_ALLOCATIONS]:
+            summary.write(str(stat) + "\n")
+    return base
+
+
+def profiled(name):
+    """Profile a sampled share of a job's runs when PROFILE_JOBS names it.
+
+    With SCHEDULER_PROCESSES > 1 only the parent process is profiled, the
+    workers' time shows up as waiting on them.
+
+    Args:
+        name: the job's name in PROFILE_JOBS.
+
+    Returns:
+        The decorator.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _sampled(name):
+                return func(*args, **kwargs)
+
+            session = _Session()
+            session.start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                snapshot, peak = session.stop()
+                try:
+                    path = _write(name, session, snapshot, peak)
+                    print("[PROFILE] %s profiled to %s" % (name, path))
+                except OSError as error:
+                    # losing a profile must not fail the job
+                    print("[PROFILE] could not write the profile: " + repr(error))
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,160 @@
+"""
+Rate limiting for the Habitica To Do Over tool.
+
+Habitica allows each user a fixed number of requests per minute and reports
+what is left in the X-RateLimit-* response headers. Requests are paced with a
+token bucket per Habitica user so we wait just long enough instead of running
+into 429 responses.
+"""
+
+__author__ = "Katie Patterson kirska.com"
+__license__ = "MIT"
+
+import threading
+import time
+from datetime import datetime
+
+# Habitica's documented limit, used until a response tells us otherwise
+DEFAULT_LIMIT = 30
+LIMIT_WINDOW_SECONDS = 60.0
+# never wait longer than one window, even if a reset header looks odd
+MAX_WAIT_SECONDS = LIMIT_WINDOW_SECONDS
+
+
+def parse_reset(value, now=None):
+    """Turn an X-RateLimit-Reset or Retry-After header into an epoch time.
+
+    Habitica sends the reset as a JavaScript date string, e.g.
+    "Sat Oct 17 2026 12:00:00 GMT+0000 (Coordinated Universal Time)".
+    Plain numbers are read as an epoch time if large, else as seconds from now.
+
+    Args:
+        value: the header value.
+        now: optional current epoch time.
+
+    Returns:
+        The epoch time, or None if the value can't be read.
+    """
+    if now is None:
+        now = time.time()
+    if not value:
+        return None
+
+    try:
+        number = float(value)
+    except ValueError:
+        pass
+    else:
+        if number > 1e12:
+            # epoch milliseconds
+            return number / 1e3
+        if number > 1e9:
+            return number
+        return now + number
+
+    try:
+        reset_at = datetime.strptime(
+            value.split(" (")[0].strip(), "%a %b %d %Y %H:%M:%S GMT%z"
+        )
+    except ValueError:
+        return None
+    return reset_at.timestamp()
+
+
+class _Bucket(object):
+    """Token bucket for a single Habitica user."""
+
+    def __init__(self, now):
+        self.capacity = float(DEFAULT_LIMIT)
+        self.tokens = float(DEFAULT_LIMIT)
+        self.updated_at = now
+        self.blocked_until = 0.0
+
+    def refill(self, now):
+        rate = self.capacity / LIMIT_WINDOW_SECONDS
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * rate)
+        self.updated_at = now
+
+    def wait_time(self, now):
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) * LIMIT_WINDOW_SECONDS / self.capacity
+
+
+class RateLimiter(object):
+    """Per-user token buckets fed by Habitica's rate limit headers.
+
+    Call acquire before each request and update with each response. It is
+    safe to share one limiter between threads.
+    """
+
+    def __init__(self, clock=time.time, sleep=time.sleep):
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def _bucket(self, user_id, now):
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = _Bucket(now)
+        return bucket
+
+    def acquire(self, user_id):
+        """Block until the user may send another request.
+
+        Args:
+            user_id: the Habitica user ID the request is sent as.
+
+        Returns:
+            The number of seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                bucket = self._bucket(user_id, now)
+                bucket.refill(now)
+                wait = min(bucket.wait_time(now), MAX_WAIT_SECONDS)
+                if wait <= 0:
+                    bucket.tokens -= 1
+                    return waited
+            self._sleep(wait)
+            waited += wait
+
+    def update(self, user_id, status_code, headers):
+        """Correct the user's bucket from a Habitica response.
+
+        Args:
+            user_id: the Habitica user ID the request was sent as.
+            status_code: the HTTP status of the response.
+            headers: the response headers.
+        """
+        with self._lock:
+            now = self._clock()
+            bucket = self._bucket(user_id, now)
+            bucket.refill(now)
+
+            limit = headers.get("X-RateLimit-Limit")
+            if limit and limit.isdigit() and int(limit) > 0:
+                bucket.capacity = float(limit)
+
+            remaining = headers.get("X-RateLimit-Remaining")
+            if remaining is not None and remaining.isdigit():
+                # the server's count wins over our estimate
+                bucket.tokens = min(bucket.tokens, float(remaining))
+
+            if status_code == 429 or bucket.tokens < 1:
+                bucket.tokens = min(bucket.tokens, 0.0)
+                reset_at = parse_reset(headers.get("Retry-After"), now) or parse_reset(
+                    headers.get("X-RateLimit-Reset"), now
+                )
+                if reset_at is not None:
+                    bucket.blocked_until = min(reset_at, now + MAX_WAIT_SECONDS)
+                elif status_code == 429:
+                    bucket.blocked_until = now + MAX_WAIT_SECONDS
+
+
+RATE_LIMITER = RateLimiter()
@@ -0,0 +1,201 @@
+"""Task recreation - Habitica To Do Over tool
+
+Decides whether a completed To-Do Over is due again and recreates it.
+Shared by the scheduled script and the webhook view.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+from builtins import str
+
+__author__ = "Katie Patterson kirska.com"
+__license__ = "MIT"
+
+from datetime import date, datetime, timedelta
+import pytz
+from to_do_overs.models import Tasks
+from . import metrics, work_queue
+from .to_do_overs_data import ToDoOversData
+
+
+def _fill_task_data(task, tdo_data):
+    tdo_data.hab_user_id = task.owner.user_id
+    tdo_data.priority = task.priority
+    tdo_data.api_token = task.owner.api_key
+    tdo_data.notes = task.notes
+    tdo_data.task_name = task.name
+    tdo_data.task_days = task.days
+
+    # convert tags from their DB ID to the tag UUID
+    tag_list = []
+    for tag in task.tags.all():
+        tag_list.append(tag.tag_id)
+
+    tdo_data.tags = tag_list
+
+
+def _mark_recreated(task, task_id):
+    task.task_id = task_id
+    # a new week/month task is not due again before its next weekday/monthday
+    tomorrow = date.today() + timedelta(days=1)
+    task.next_check_at = task.compute_next_check_at(tomorrow)
+
+
+def _completed_at(task_json):
+    # when the task was completed on Habitica, as an aware UTC datetime
+    if not task_json.get("dateCompleted"):
+        return None
+    completed_date_naive = datetime.strptime(
+        task_json["dateCompleted"], "%Y-%m-%dT%H:%M:%S.%fZ"
+    )
+    return pytz.utc.localize(completed_date_naive)
+
+
+def _start_of_today():
+    # week and month tasks are due from the start of their day
+    return pytz.utc.localize(datetime.combine(date.today(), datetime.min.time()))
+
+
+def recreate_task(task, tdo_data):
+    """Create a new copy of a task on Habitica and point the task at it.
+
+    Args:
+        task: the task from the tool database.
+        tdo_data: the ToDoOversData used to create the new task.
+
+    Returns:
+        True for success, False for failure.
+    """
+    _fill_task_data(task, tdo_data)
+
+    # 429s are retried by ToDoOversData once the user's rate limit resets
+    if tdo_data.create_task():
+        _mark_recreated(task, tdo_data.task_id)
+        task.save()
+        metrics.increment("recreations")
+        print("task re-created successfully " + task.task_id)
+        return True
+
+    print("task creation failed " + task.task_id)
+    print("return code " + str(tdo_data.return_code))
+    return False
+
+
+def create_copies(tasks, aliases):
+    """Create new copies of several tasks of one user with one request.
+
+    Args:
+        tasks: the tasks from the tool database, all of the same owner.
+        aliases: the alias to create each copy with.
+
+    Returns:
+        List of the new task IDs in the order of tasks, False for failure.
+    """
+    tasks_data = []
+    for task, alias in zip(tasks, aliases):
+        tdo_data = ToDoOversData()
+        _fill_task_data(task, tdo_data)
+        tdo_data.alias = alias
+        tasks_data.append(tdo_data.build_task_data())
+
+    owner_data = ToDoOversData()
+    owner_data.hab_user_id = tasks[0].owner.user_id
+    owner_data.api_token = tasks[0].owner.api_key
+    task_ids = owner_data.create_tasks(tasks_data)
+    if not task_ids:
+        print("batch task creation failed " + owner_data.hab_user_id)
+        print("return code " + str(owner_data.return_code))
+    return task_ids
+
+
+def save_recreated(tasks, task_ids):
+    """Point tasks at their new copies with one query.
+
+    Args:
+        tasks: the tasks from the tool database.
+        task_ids: the ID of each task's new copy, see create_copies.
+    """
+    for task, task_id in zip(tasks, task_ids):
+        _mark_recreated(task, task_id)
+    Tasks.objects.bulk_update(tasks, ["task_id", "next_check_at"])
+    metrics.increment("recreations", len(tasks))
+    print("%d tasks re-created in one request" % len(tasks))
+
+
+def check_recreate_task(task_json, task):
+    """Queue the recreation of a task if it was completed and is due again.
+
+    Args:
+        task_json: the task data from Habitica.
+        task: the task from the tool database.
+    """
+    if task.type == "0":
+        # Day Tasks
+        if task_json["completed"] and task.delay == 0:
+            # Task was completed and there is no delay so recreate it
+            completed_at = _completed_at(task_json)
+            work_queue.enqueue_recreate(task, completed_at, completed_at)
+
+        elif task_json["completed"]:
+            # Task was completed but has a delay
+            # Get completed date and set to UTC timezone
+            completed_date_aware = _completed_at(task_json)
+            completed_at = completed_date_aware
+            # Get current UTC time
+            utc_now = pytz.utc.localize(datetime.utcnow())
+
+            # Need to round the datetimes down to get rid of partial days
+            completed_date_aware = completed_date_aware.replace(
+                hour=0, minute=0, second=0, microsecond=0
+            )
+            utc_now = utc_now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+            # TESTING - add days to current date
+            # utc_now = utc_now + timedelta(days=2)
+            elapsed_time = utc_now - completed_date_aware
+
+            due_at = completed_date_aware + timedelta(days=task.delay)
+            # The delay we want is 1 + delay value
+            if elapsed_time.days >= task.delay:
+                # Task was completed and the delay has passed
+                work_queue.enqueue_recreate(task, completed_at, due_at)
+            else:
+                print("[DAY] task completed but delay not met " + task.task_id)
+                # nothing can happen before the delay has passed, so stop
+                # polling the task until the first run after that
+                task.next_check_at = due_at
+                Tasks.objects.filter(pk=task.pk).update(next_check_at=due_at)
+
+        else:
+            print("[DAY] task not completed " + task.task_id)
+    elif task.type == "1":
+        # Week Tasks
+        if (
+            task_json["completed"]
+            and int(task.weekday) == datetime.today().weekday()
+        ):
+            completed_at = datetime.strptime(
+                task_json["dateCompleted"], "%Y-%m-%dT%H:%M:%S.%fZ"
+            )
+            if completed_at.day != datetime.today().day:
+                work_queue.enqueue_recreate(
+                    task, _completed_at(task_json), _start_of_today()
+                )
+                print("[WEEK] weekly task queued")
+            else:
+                print("[WEEK] task completed, but today")
+    elif task.type == "2":
+        # Month Tasks
+        if task_json["completed"] and int(task.monthday) == datetime.today().day:
+            completed_at = datetime.strptime(
+                task_json["dateCompleted"], "%Y-%m-%dT%H:%M:%S.%fZ"
+            )
+            if completed_at.day != datetime.today().day:
+                work_queue.enqueue_recreate(
+                    task, _completed_at(task_json), _start_of_today()
+                )
+                print("[MONTH] monthly task queued")
+            else:
+                print("[MONTH] task completed, but today")
+        else:
+            print("[MONTH] not to be updated today")
@@ -0,0 +1,272 @@
+"""Report store - Habitica To Do Over tool
+
+Daily reports are kept in the Reports and ReportEntries tables, one report
+per user and day. Each one is also folded into the user's WeeklyAggregates
+row, so the weekly report reads one small record per user.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+__author__ = "Katie Patterson kirska.com"
+__license__ = "MIT"
+
+from datetime import date, datetime, timedelta
+import json
+import os
+import re
+
+from django.db import transaction
+from django.db.models import Max
+
+from to_do_overs.models import ReportEntries, Reports, WeeklyAggregates
+
+# reports/<year><month><day>_<user id>.txt as written before the store existed
+REPORT_FILE_NAME = re.compile(r"^(\d{4})(\d{2,4})_(.+)\.txt$")
+
+
+def week_start(day):
+    """Get the Monday of the week a day falls in."""
+    return day - timedelta(days=day.weekday())
+
+
+def _add_habit(habits, text, frequency, score):
+    # daily habits add up over the week, the others keep their best score.
+    # Each habit is kept as [score, entries], entries counting the report
+    # entries folded in so _remove_habit knows when the last one is gone
+    if text not in habits:
+        habits[text] = [score, 1]
+        return
+    total, entries = habits[text]
+    if frequency == "daily":
+        total += score
+    else:
+        total = max(total, score)
+    habits[text] = [total, entries + 1]
+
+
+def _remove_habit(habits, text, frequency, score):
+    # take back what _add_habit added. Returns True if a best score was taken
+    # back, the next best then has to be looked up
+    total, entries = habits[text]
+    if entries == 1:
+        del habits[text]
+        return False
+    if frequency == "daily":
+        habits[text] = [total - score, entries - 1]
+        return False
+    habits[text] = [total, entries - 1]
+    return score == total
+
+
+def _fold_into_week(user, report_date, old_entries, entries):
+    """Put a day's entries into the user's running weekly totals.
+
+    The totals are updated in place: the entries of an earlier report of
+    the same day are taken back out and the new ones added, so folding a
+    day twice counts it once and other days are never read again.
+
+    Args:
+        user: the user from the tool database.
+        report_date: the day the entries are from.
+        old_entries: the day's ReportEntries replaced by this report.
+        entries: the day's new ReportEntries.
+    """
+    monday = week_start(report_date)
+    aggregate, _ = WeeklyAggregates.objects.get_or_create(
+        owner=user, week_start=monday
+    )
+    habits = json.loads(aggregate.habits)
+    dailys = json.loads(aggregate.dailys)
+    todos = json.loads(aggregate.todos)
+
+    best_removed = set()
+    for entry in old_entries:
+        if entry.kind == ReportEntries.HABIT:
+            if _remove_habit(habits, entry.text, entry.frequency, entry.score):
+                best_removed.add(entry.text)
+        elif entry.kind == ReportEntries.DAILY:
+            dailys[entry.text] -= 1
+            if not dailys[entry.text]:
+                del dailys[entry.text]
+        else:
+            todos.remove(entry.text)
+
+    for entry in entries:
+        if entry.kind == ReportEntries.HABIT:
+            _add_habit(habits, entry.text, entry.frequency, entry.score)
+        elif entry.kind == ReportEntries.DAILY:
+            dailys[entry.text] = dailys.get(entry.text, 0) + 1
+        else:
+            todos.append(entry.text)
+
+    # rare, a re-saved day lowered the score a weekly habit peaked with
+    for text in best_removed & set(habits):
+        habits[text][0] = ReportEntries.objects.filter(
+            report__owner=user,
+            report__date__range=(monday, monday + timedelta(days=6)),
+            kind=ReportEntries.HABIT,
+            text=text,
+        ).aggregate(best=Max("score"))["best"]
+
+    aggregate.habits = json.dumps(habits)
+    aggregate.dailys = json.dumps(dailys)
+    aggregate.todos = json.dumps(todos)
+    aggregate.save()
+
+
+def save_daily_report(user, report_date, results):
+    """Save a user's daily report, replacing one saved earlier that day.
+
+    The report is folded into the user's weekly totals as well.
+
+    Args:
+        user: the user from the tool database.
+        report_date: the day the report covers.
+        results: dict of "habits", "dailys" and "todos" lists, see
+            ToDoOversData.get_today_report.
+
+    Returns:
+        The saved report.
+    """
+    entries = []
+    for habit in results.get("habits") or []:
+        entries.append(
+            ReportEntries(
+                kind=ReportEntries.HABIT,
+                text=habit["text"],
+                frequency=habit.get("frequency") or "",
+                score=habit["counterUp"] - habit["counterDown"],
+            )
+        )
+    for daily in results.get("dailys") or []:
+        entries.append(
+            ReportEntries(
+                kind=ReportEntries.DAILY,
+                text=daily["text"],
+                frequency=daily.get("frequency") or "",
+            )
+        )
+    for todo in results.get("todos") or []:
+        entries.append(ReportEntries(kind=ReportEntries.TODO, text=todo["text"]))
+
+    data = json.dumps(dict(results, date=report_date.isoformat()), default=str)
+    with transaction.atomic():
+        # writing first makes SQLite take its write lock up front, a read
+        # lock can't be upgraded while another thread is writing
+        if Reports.objects.filter(owner=user, date=report_date).update(data=data):
+            report = Reports.objects.get(owner=user, date=report_date)
+            old_entries = list(report.entries.all())
+            report.entries.all().delete()
+        else:
+            report = Reports.objects.create(owner=user, date=report_date, data=data)
+            old_entries = []
+        for entry in entries:
+            entry.report = report
+        ReportEntries.objects.bulk_create(entries)
+        _fold_into_week(user, report_date, old_entries, entries)
+    return report
+
+
+def weekly_totals(user, monday):
+    """Get a user's totals for a week, as folded in by the daily reports.
+
+    Daily habits show their total score and other habits their best one,
+    dailys how often they were done and todos are listed once per
+    completion.
+
+    Args:
+        user: the user from the tool database.
+        monday: the first day of the week.
+
+    Returns:
+        Tuple of a dict of habit scores, a dict of daily counts and a list
+        of todo names, all empty if nothing was reported that week.
+    """
+    aggregate = WeeklyAggregates.objects.filter(
+        owner=user, week_start=monday
+    ).first()
+    if aggregate is None:
+        return {}, {}, []
+    return (
+        {text: score for text, (score, _) in json.loads(aggregate.habits).items()},
+        json.loads(aggregate.dailys),
+        json.loads(aggregate.todos),
+    )
+
+
+def report_attachments(user, dates):
+    """Stream a user's daily reports over some days as email attachments.
+
+    Args:
+        user: the user from the tool database.
+        dates: the days to attach.
+
+    Returns:
+        Iterator of (filename, JSON bytes) tuples, oldest day first. Reports
+        are read from the database one at a time as it is consumed.
+    """
+    reports = Reports.objects.filter(owner=user, date__in=dates).order_by("date")
+    for report in reports.iterator():
+        yield (
+            report.date.isoformat() + "_" + user.user_id + ".txt",
+            report.data.encode("utf-8"),
+        )
+
+
+def parse_report_file_name(filename, written_on):
+    """Work out the user and day of a report file from before the store.
+
+    The old names join year, month and day without padding, so 2026111
+    can be 2026-1-11 or 2026-11-1. Reports were written on the day they
+    cover, so the reading closest to the day the file was written wins.
+
+    Args:
+        filename: the name of the file, e.g. 2026111_<user id>.txt.
+        written_on: the date the file was last modified.
+
+    Returns:
+        Tuple of the user ID and the date, or None if the name can't be read.
+    """
+    match = REPORT_FILE_NAME.match(filename)
+    if match is None:
+        return None
+    year, month_day, user_id = match.groups()
+
+    candidates = []
+    for split in range(1, len(month_day)):
+        month, day = month_day[:split], month_day[split:]
+        if len(month) > 2 or len(day) > 2:
+            continue
+        try:
+            candidates.append(date(int(year), int(month), int(day)))
+        except ValueError:
+            pass
+    if not candidates:
+        return None
+
+    return user_id, min(candidates, key=lambda day: abs(day - written_on))
+
+
+def import_report_file(path, users_by_id):
+    """Import a report file from before the store.
+
+    Args:
+        path: the path of the file.
+        users_by_id: dict of users from the tool database keyed by user ID.
+
+    Returns:
+        The saved report, or None if the file was skipped.
+    """
+    written_on = datetime.fromtimestamp(os.path.getmtime(path)).date()
+    parsed = parse_report_file_name(os.path.basename(path), written_on)
+    if parsed is None:
+        return None
+    user_id, report_date = parsed
+    user = users_by_id.get(user_id)
+    if user is None:
+        return None
+
+    with open(path) as report_file:
+        results = json.loads(report_file.readline())
+    results.pop("date", None)
+    return save_daily_report(user, report_date, results)
@@ -0,0 +1,105 @@
+"""Tag cache - Habitica To Do Over tool
+
+A user's tags are kept in the Tags table and only fetched from Habitica
+again once they are older than TAGS_CACHE_TTL. Pages and the scheduler read
+the local tags, and concurrent refreshes of one user collapse into a single
+request to Habitica.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+__author__ = "Katie Patterson kirska.com"
+__license__ = "MIT"
+
+from datetime import timedelta
+import os
+import time
+
+from django.db.models import Q
+from django.utils import timezone
+
+from to_do_overs.models import Users
+
+# seconds a user's tags are used before they are fetched from Habitica again
+TAGS_CACHE_TTL = int(os.getenv("TAGS_CACHE_TTL", "3600"))
+# seconds others wait for a running refresh before using the tags they have
+TAGS_REFRESH_WAIT = float(os.getenv("TAGS_REFRESH_WAIT", "5"))
+# seconds between looks at whether a running refresh is done
+TAGS_REFRESH_POLL = 0.1
+
+
+def tags_stale(user):
+    """Check whether a user's tags are due to be fetched again.
+
+    Args:
+        user: the user from the tool database.
+
+    Returns:
+        True if the tags were never synced or are older than the TTL.
+    """
+    return user.tags_synced_at is None or (
+        user.tags_synced_at <= timezone.now() - timedelta(seconds=TAGS_CACHE_TTL)
+    )
+
+
+def _wait_for_refresh(hab_user_id):
+    # a refresh in flight has moved tags_synced_at into the future, until
+    # the time it gives up. Wait for it to change, the winner writes the
+    # time of the fetch on success and clears it on failure
+    deadline = time.monotonic() + TAGS_REFRESH_WAIT
+    USER = Users.objects.filter(user_id=hab_user_id)
+    claimed_until = USER.values_list("tags_synced_at", flat=True).first()
+    while claimed_until is not None and claimed_until > timezone.now():
+        if time.monotonic() >= deadline:
+            break
+        time.sleep(TAGS_REFRESH_POLL)
+        synced_at = USER.values_list("tags_synced_at", flat=True).first()
+        if synced_at != claimed_until:
+            return synced_at is not None
+    return claimed_until is not None
+
+
+def refresh_tags(tdo_data):
+    """Fetch a user's tags from Habitica unless the cached ones are fresh.
+
+    Callers race for the refresh with one UPDATE that moves tags_synced_at
+    to TAGS_REFRESH_WAIT from now. The winner sends the request. Everyone
+    else, in this process or another, waits up to TAGS_REFRESH_WAIT for the
+    winner to finish and then goes on with the tags in the database.
+
+    Args:
+        tdo_data: the ToDoOversData of the user.
+
+    Returns:
+        True if the tags are fresh or were refreshed, or a refresh is still
+        running after the wait. False if the refresh failed.
+    """
+    now = timezone.now()
+    claimed_until = now + timedelta(seconds=TAGS_REFRESH_WAIT)
+    claimed = (
+        Users.objects.filter(user_id=tdo_data.hab_user_id)
+        .filter(
+            Q(tags_synced_at__isnull=True)
+            | Q(tags_synced_at__lte=now - timedelta(seconds=TAGS_CACHE_TTL))
+        )
+        .update(tags_synced_at=claimed_until)
+    )
+    if not claimed:
+        return _wait_for_refresh(tdo_data.hab_user_id)
+
+    # a user without tags gets False but a 200
+    refreshed = tdo_data.get_user_tags() is not False or tdo_data.return_code == 200
+    # let waiting callers go on, and on failure let the next caller try again
+    Users.objects.filter(
+        user_id=tdo_data.hab_user_id, tags_synced_at=claimed_until
+    ).update(tags_synced_at=timezone.now() if refreshed else None)
+    return refreshed
+
+
+def invalidate_tags(hab_user_id):
+    """Make the next refresh_tags of a user fetch the tags from Habitica.
+
+    Args:
+        hab_user_id: the user ID from Habitica.
+    """
+    Users.objects.filter(user_id=hab_user_id).update(tags_synced_at=None)
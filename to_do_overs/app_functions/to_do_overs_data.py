@@ -11,10 +11,172 @@ from builtins import str
 __author__ = "Katie Patterson kirska.com"
 __license__ = "MIT"
 
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+import hashlib
+import json
+import time
 import requests
+from django.db import transaction
+from django.db.models import Q
 from to_do_overs.models import Users, Tags
-from .cipher_functions import encrypt_text, decrypt_text
+from . import habitica_client, metrics
+from .cipher_functions import encrypt_text
+from .habitica_client import api_url, user_headers
+from .rate_limiter import RATE_LIMITER
+
+# how often a request answered with 429 is retried once the rate limit resets
+TOO_MANY_REQUESTS_RETRIES = 3
+
+
+def _tags_hash(remote_tags):
+    """Fingerprint a user's tags so unchanged tags can skip the database."""
+    text = json.dumps(sorted(remote_tags.items()))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _sync_tags(user, remote_tags, tags_hash):
+    """Make the user's tags in the database match the ones from Habitica.
+
+    Only tags that changed are written, in one bulk query each for new,
+    changed and removed tags.
+
+    Args:
+        user: the user from the tool database.
+        remote_tags: dict of tag names from Habitica keyed by tag ID.
+        tags_hash: the _tags_hash of remote_tags, saved once synced.
+    """
+    with transaction.atomic():
+        # writing first makes SQLite take its write lock up front, a read
+        # lock can't be upgraded while another process is writing
+        Users.objects.filter(pk=user.pk).update(tags_hash=tags_hash)
+        # tag IDs are unique, so a tag may still be filed under another user
+        current_tags = {
+            tag.tag_id: tag
+            for tag in Tags.objects.filter(
+                Q(tag_owner=user) | Q(tag_id__in=list(remote_tags))
+            )
+        }
+
+        new_tags = []
+        changed_tags = []
+        for tag_id, tag_text in remote_tags.items():
+            tag = current_tags.get(tag_id)
+            if tag is None:
+                new_tags.append(Tags(tag_id=tag_id, tag_text=tag_text, tag_owner=user))
+            elif tag.tag_text != tag_text or tag.tag_owner_id != user.pk:
+                tag.tag_text = tag_text
+                tag.tag_owner = user
+                changed_tags.append(tag)
+
+        leftover_tag_ids = [
+            tag_id
+            for tag_id, tag in current_tags.items()
+            if tag_id not in remote_tags and tag.tag_owner_id == user.pk
+        ]
+
+        Tags.objects.bulk_create(new_tags)
+        Tags.objects.bulk_update(changed_tags, ["tag_text", "tag_owner"])
+        if leftover_tag_ids:
+            print("deleting tags " + ", ".join(leftover_tag_ids))
+            Tags.objects.filter(tag_id__in=leftover_tag_ids).delete()
+
+
+# fields of a task copied into the daily report
+HABIT_REPORT_KEYS = [
+    "text",
+    "frequency",
+    "type",
+    "notes",
+    "createdAt",
+    "counterUp",
+    "counterDown",
+]
+DAILY_REPORT_KEYS = [
+    "text",
+    "frequency",
+    "type",
+    "notes",
+    "createdAt",
+    "repeat",
+    "everyX",
+    "streak",
+]
+
+
+def _report_window(today):
+    """Get the start and end of a local day in epoch milliseconds.
+
+    Args:
+        today: the date of the report.
+
+    Returns:
+        Tuple of the first millisecond of the day and of the day after.
+    """
+    start = datetime.combine(today, datetime.min.time())
+    end = start + timedelta(days=1)
+    return start.timestamp() * 1e3, end.timestamp() * 1e3
+
+
+def _history_on_day(history, window):
+    """Get the history entries that fall into a day.
+
+    Habitica keeps history oldest first, so the day is found by binary
+    search and only its own entries are looked at.
+
+    Args:
+        history: the history list of a habit or daily.
+        window: the day's bounds, see _report_window.
+
+    Returns:
+        The entries of the day, oldest first.
+    """
+    start_ms, end_ms = window
+    low, high = 0, len(history)
+    while low < high:
+        middle = (low + high) // 2
+        if history[middle]["date"] < start_ms:
+            low = middle + 1
+        else:
+            high = middle
+
+    entries = []
+    for entry in history[low:]:
+        if entry["date"] >= end_ms:
+            break
+        entries.append(entry)
+    return entries
+
+
+def _add_report_entries(results, task_json, today, window):
+    """Add what a task from Habitica did on a day to the daily report.
+
+    Args:
+        results: dict of "habits", "dailys" and "todos" lists to add to.
+        task_json: the task data from Habitica.
+        today: the date of the report.
+        window: the bounds of today, see _report_window.
+    """
+    if task_json["type"] == "habit":
+        for history in _history_on_day(task_json["history"], window):
+            entry = {key: task_json[key] for key in HABIT_REPORT_KEYS}
+            entry["date"] = datetime.fromtimestamp(history["date"] / 1e3)
+            results["habits"].append(entry)
+
+    elif task_json["type"] == "daily":
+        for history in _history_on_day(task_json["history"], window):
+            if history.get("isDue") and history.get("completed"):
+                results["dailys"].append(
+                    {key: task_json[key] for key in DAILY_REPORT_KEYS}
+                )
+                # a daily is only reported once a day
+                break
+
+    elif task_json["type"] == "todo" and task_json.get("dateCompleted"):
+        completed_at = datetime.strptime(
+            task_json["dateCompleted"], "%Y-%m-%dT%H:%M:%S.%fZ"
+        )
+        if completed_at.date() == today:
+            results["todos"].append(task_json)
 
 
 class ToDoOversData(object):
@@ -35,8 +197,12 @@ class ToDoOversData(object):
             See models.py for choices.
         notes (str): The description/notes of the task being created.
         tags (list): The user's tags.
+        alias (str): Optional unique alias for the task being created.
     """
 
+    # class default so sessions pickled before the attribute existed still work
+    alias = ""
+
     def __init__(self):
         self.username = ""
         self.hab_user_id = ""
@@ -56,6 +222,41 @@ class ToDoOversData(object):
 
         self.return_code = 0
 
+    def _request(self, method, url, **kwargs):
+        """Send a request to Habitica, paced by the user's rate limit.
+
+        Args:
+            method: the HTTP method.
+            url: the URL to request.
+            **kwargs: passed on to requests.
+
+        Returns:
+            The response, or None if Habitica couldn't be reached. The status
+            code is kept in return_code, which is 0 when there is no response.
+        """
+        for _ in range(TOO_MANY_REQUESTS_RETRIES + 1):
+            waited = RATE_LIMITER.acquire(self.hab_user_id)
+            started_at = time.monotonic()
+            try:
+                req = habitica_client.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as error:
+                metrics.record_request(
+                    method, url, 0, time.monotonic() - started_at, waited
+                )
+                print("request to Habitica failed: " + repr(error))
+                self.return_code = 0
+                return None
+            metrics.record_request(
+                method, url, req.status_code, time.monotonic() - started_at, waited
+            )
+            RATE_LIMITER.update(self.hab_user_id, req.status_code, req.headers)
+            if req.status_code != 429:
+                break
+            print("too many requests, waiting for rate limit reset")
+
+        self.return_code = req.status_code
+        return req
+
     def login(self, password):
         """Login with a username and password to Habitica.
 
@@ -65,13 +266,13 @@ class ToDoOversData(object):
         Returns:
             True for success, False for failure.
         """
-        req = requests.post(
-            "https://habitica.com/api/v3/user/auth/local/login",
+        req = self._request(
+            "POST",
+            api_url("/user/auth/local/login"),
             data={"username": self.username, "password": password},
         )
         # print("POST: " + req.url + " [" + str(req.status_code) + "]: " + req.text)
-        self.return_code = req.status_code
-        if req.status_code == 200:
+        if self.return_code == 200:
             req_json = req.json()
             self.hab_user_id = req_json["data"]["id"]
             self.api_token = encrypt_text(req_json["data"]["apiToken"])
@@ -96,17 +297,12 @@ class ToDoOversData(object):
         Returns:
             True for success, False for failure.
         """
-        headers = {
-            "x-client": self.hab_user_id + "-TODO-Overs",
-            "x-api-user": self.hab_user_id,
-            "x-api-key": decrypt_text(self.api_token),
-            "Content-Type": "application/json",
-        }
+        headers = dict(user_headers(self.hab_user_id, self.api_token))
+        headers["Content-Type"] = "application/json"
 
-        req = requests.get("https://habitica.com/api/v3/user", headers=headers)
+        req = self._request("GET", api_url("/user"), headers=headers)
         # print("GET: " + req.url + " [" + str(req.status_code) + "]: " + req.text)
-        self.return_code = req.status_code
-        if req.status_code == 200:
+        if self.return_code == 200:
             req_json = req.json()
             self.username = req_json["data"]["profile"]["name"]
 
@@ -123,60 +319,106 @@ class ToDoOversData(object):
             return True
         return False
 
+    def build_task_data(self):
+        """Build the Habitica task for the task being created.
+
+        Returns:
+            Dict of the task fields to post.
+        """
+        data = {
+            "text": self.task_name,
+            "type": "todo",
+            "notes": self.notes,
+            "priority": self.priority,
+            "tags": self.tags,
+        }
+        if int(self.task_days) > 0:
+            due_date = datetime.now() + timedelta(days=int(self.task_days))
+            data["date"] = due_date.isoformat()
+        if self.alias:
+            data["alias"] = self.alias
+        return data
+
     def create_task(self):
         """Create a task on Habitica.
 
+        If alias is set it is sent along. Habitica refuses a second task with
+        the same alias, so retrying a creation never makes a duplicate; the
+        task from the earlier attempt is looked up instead.
+
         Returns:
             True for success, False for failure.
         """
-        headers = {
-            "x-client": self.hab_user_id + "-TODO-Overs",
-            "x-api-user": self.hab_user_id,
-            "x-api-key": decrypt_text(self.api_token),
-        }
+        headers = user_headers(self.hab_user_id, self.api_token)
 
-        if int(self.task_days) > 0:
-            due_date = datetime.now() + timedelta(days=int(self.task_days))
-            due_date = due_date.isoformat()
+        req = self._request(
+            "POST",
+            api_url("/tasks/user"),
+            headers=headers,
+            data=self.build_task_data(),
+        )
+        # print("POST: " + req.url + " [" + str(req.status_code) + "]: " + req.text)
+        if self.return_code == 201:
+            req_json = req.json()
+            self.task_id = req_json["data"]["id"]
+            return True
+        if self.alias and self.return_code == 400:
+            # the alias is taken, so an earlier attempt already created the task
+            return self._get_task_id_by_alias()
+        return False
 
-            req = requests.post(
-                "https://habitica.com/api/v3/tasks/user",
-                headers=headers,
-                data={
-                    "text": self.task_name,
-                    "type": "todo",
-                    "notes": self.notes,
-                    "date": due_date,
-                    "priority": self.priority,
-                    "tags": self.tags,
-                },
-            )
-            # print("POST: " + req.url + " [" + str(req.status_code) + "]: " + req.text)
-            self.return_code = req.status_code
-            if req.status_code == 201:
-                req_json = req.json()
-                self.task_id = req_json["data"]["id"]
-                return True
+    def create_tasks(self, tasks_data):
+        """Create several tasks on Habitica with one request.
+
+        Args:
+            tasks_data: list of task dicts, see build_task_data.
+
+        Returns:
+            List of the new task IDs in the order of tasks_data, False for
+            failure.
+        """
+        headers = user_headers(self.hab_user_id, self.api_token)
+
+        req = self._request(
+            "POST",
+            api_url("/tasks/user"),
+            headers=headers,
+            json=tasks_data,
+        )
+        if self.return_code != 201:
             return False
-        else:
-            req = requests.post(
-                "https://habitica.com/api/v3/tasks/user",
-                headers=headers,
-                data={
-                    "text": self.task_name,
-                    "type": "todo",
-                    "notes": self.notes,
-                    "priority": self.priority,
-                    "tags": self.tags,
-                },
-            )
-            # print("POST: " + req.url + " [" + str(req.status_code) + "]: " + req.text)
-            self.return_code = req.status_code
-            if req.status_code == 201:
-                req_json = req.json()
-                self.task_id = req_json["data"]["id"]
-                return True
+
+        created = req.json()["data"]
+        if isinstance(created, dict):
+            created = [created]
+        if len(created) != len(tasks_data):
             return False
+        # match by alias where there is one, the order of the reply otherwise
+        ids_by_alias = {
+            task_json["alias"]: task_json["id"]
+            for task_json in created
+            if task_json.get("alias")
+        }
+        return [
+            ids_by_alias.get(task_data.get("alias"), task_json["id"])
+            for task_data, task_json in zip(tasks_data, created)
+        ]
+
+    def _get_task_id_by_alias(self):
+        """Look up the ID of the task created with our alias.
+
+        Returns:
+            True for success, False for failure.
+        """
+        headers = user_headers(self.hab_user_id, self.api_token)
+
+        req = self._request("GET", api_url("/tasks/" + self.alias), headers=headers)
+        # print("GET: " + req.url + " [" + str(req.status_code) + "]: " + req.text)
+        if self.return_code == 200:
+            req_json = req.json()
+            self.task_id = req_json["data"]["id"]
+            return True
+        return False
 
     def edit_task(self):
         """Edit a task on Habitica.
@@ -184,18 +426,15 @@ class ToDoOversData(object):
         Returns:
             True for success, False for failure.
         """
-        headers = {
-            "x-client": self.hab_user_id + "-TODO-Overs",
-            "x-api-user": self.hab_user_id,
-            "x-api-key": decrypt_text(self.api_token),
-        }
-        url = "https://habitica.com/api/v3/tasks/" + str(self.task_id)
+        headers = user_headers(self.hab_user_id, self.api_token)
+        url = api_url("/tasks/" + str(self.task_id))
 
         if int(self.task_days) > 0:
             due_date = datetime.now() + timedelta(days=int(self.task_days))
             due_date = due_date.isoformat()
 
-            req = requests.put(
+            req = self._request(
+                "PUT",
                 url,
                 headers=headers,
                 data={
@@ -207,14 +446,14 @@ class ToDoOversData(object):
                 },
             )
             # print("PUT: " + req.url + " [" + str(req.status_code) + "]: " + req.text)
-            self.return_code = req.status_code
-            if req.status_code == 200:
+            if self.return_code == 200:
                 req_json = req.json()
                 self.task_id = req_json["data"]["id"]
                 return True
             return False
         else:
-            req = requests.put(
+            req = self._request(
+                "PUT",
                 url,
                 headers=headers,
                 data={
@@ -225,8 +464,7 @@ class ToDoOversData(object):
                 },
             )
             # print("PUT: " + req.url + " [" + str(req.status_code) + "]: " + req.text)
-            self.return_code = req.status_code
-            if req.status_code == 200:
+            if self.return_code == 200:
                 req_json = req.json()
                 self.task_id = req_json["data"]["id"]
                 return True
@@ -239,48 +477,111 @@ class ToDoOversData(object):
         Returns:
             Dict of tags for success, False for failure.
         """
-        headers = {
-            "x-client": self.hab_user_id + "-TODO-Overs",
-            "x-api-user": self.hab_user_id,
-            "x-api-key": decrypt_text(self.api_token),
-        }
+        headers = user_headers(self.hab_user_id, self.api_token)
 
-        req = requests.get("https://habitica.com/api/v3/tags", headers=headers, data={})
+        req = self._request("GET", api_url("/tags"), headers=headers, data={})
         # print("GET: " + req.url + " [" + str(req.status_code) + "]: " + req.text)
-        self.return_code = req.status_code
-        if req.status_code == 200:
+        if self.return_code == 200:
             req_json = req.json()
 
-            user = Users.objects.get(user_id=self.hab_user_id)
+            if req_json["data"]:
+                user = Users.objects.get(user_id=self.hab_user_id)
+                remote_tags = {
+                    tag_json["id"]: tag_json["name"] for tag_json in req_json["data"]
+                }
+                tags_hash = _tags_hash(remote_tags)
+                if tags_hash != user.tags_hash:
+                    _sync_tags(user, remote_tags, tags_hash)
+                return req_json["data"]
+            return False
+        return False
 
-            current_tags = Tags.objects.filter(tag_owner=user)
-            current_tag_ids = []
-            for tag in current_tags:
-                current_tag_ids.append(tag.tag_id)
+    def get_task(self):
+        """Get a single task from Habitica.
 
-            if req_json["data"]:
-                # Add/update tags in database
-                for tag_json in req_json["data"]:
-                    tag_text = tag_json["name"]
-                    tag_text = tag_text
-
-                    Tags.objects.update_or_create(
-                        tag_id=tag_json["id"],
-                        defaults={
-                            "tag_owner": user,
-                            "tag_text": tag_text,
-                        },
-                    )
-                    if tag_json["id"] in current_tag_ids:
-                        current_tag_ids.remove(tag_json["id"])
+        Returns:
+            Dict of the task data for success, False for failure.
+        """
+        headers = user_headers(self.hab_user_id, self.api_token)
 
-                for leftover_tag in current_tag_ids:
-                    print("deleting tag " + leftover_tag)
-                    Tags.objects.filter(tag_id=leftover_tag).delete()
+        req = self._request(
+            "GET", api_url("/tasks/" + str(self.task_id)), headers=headers
+        )
+        # print("GET: " + req.url + " [" + str(req.status_code) + "]: " + req.text)
+        if self.return_code == 200:
+            req_json = req.json()
+            return req_json["data"]
+        return False
 
-                return req_json["data"]
+    def get_todo_snapshot(self):
+        """Get all of a user's active and completed todos in two requests.
+
+        Habitica only returns the most recently completed todos, so a task
+        missing from the snapshot still has to be fetched with get_task.
+
+        Returns:
+            Dict of task data keyed by task ID for success, False for failure.
+        """
+        headers = user_headers(self.hab_user_id, self.api_token)
+
+        snapshot = {}
+        for task_type in ["todos", "completedTodos"]:
+            req = self._request(
+                "GET",
+                api_url("/tasks/user?type=" + task_type),
+                headers=headers,
+                data={},
+            )
+            # print("GET: " + req.url + " [" + str(req.status_code) + "]: " + req.text)
+            if self.return_code != 200:
+                return False
+
+            req_json = req.json()
+            for task_json in req_json["data"]:
+                snapshot[task_json["id"]] = task_json
+        return snapshot
+
+    def register_webhook(self, url):
+        """Register a webhook for the user's scored tasks on Habitica.
+
+        Nothing is sent if a webhook with the same URL already exists.
+
+        Args:
+            url: the URL Habitica should post taskActivity events to.
+
+        Returns:
+            True for success, False for failure.
+        """
+        headers = user_headers(self.hab_user_id, self.api_token)
+
+        req = self._request("GET", api_url("/user/webhook"), headers=headers)
+        # print("GET: " + req.url + " [" + str(req.status_code) + "]: " + req.text)
+        if self.return_code != 200:
             return False
-        return False
+        req_json = req.json()
+        for webhook in req_json["data"]:
+            if webhook["url"] == url:
+                return True
+
+        req = self._request(
+            "POST",
+            api_url("/user/webhook"),
+            headers=headers,
+            json={
+                "url": url,
+                "label": "To-Do Overs",
+                "type": "taskActivity",
+                "enabled": True,
+                "options": {
+                    "created": False,
+                    "updated": False,
+                    "deleted": False,
+                    "scored": True,
+                },
+            },
+        )
+        # print("POST: " + req.url + " [" + str(req.status_code) + "]: " + req.text)
+        return self.return_code == 201
 
     def get_user_tasks(self):
         """Get the list of a user's tasks.
@@ -288,18 +589,11 @@ class ToDoOversData(object):
         Returns:
             Dict of tags for success, False for failure.
         """
-        headers = {
-            "x-client": self.hab_user_id + "-TODO-Overs",
-            "x-api-user": self.hab_user_id,
-            "x-api-key": decrypt_text(self.api_token),
-        }
+        headers = user_headers(self.hab_user_id, self.api_token)
 
-        req = requests.get(
-            "https://habitica.com/api/v3/tasks/user", headers=headers, data={}
-        )
+        req = self._request("GET", api_url("/tasks/user"), headers=headers, data={})
         # print("GET: " + req.url + " [" + str(req.status_code) + "]: " + req.text)
-        self.return_code = req.status_code
-        if req.status_code == 200:
+        if self.return_code == 200:
             req_json = req.json()
 
             user = Users.objects.get(user_id=self.hab_user_id)
@@ -332,148 +626,32 @@ class ToDoOversData(object):
             return False
         return False
 
-    def get_today_completed_tasks(self):
-        """Get the list of a user's completed tasks.
+    def get_today_report(self, today=None):
+        """Collect the habits, dailys and todos a user completed today.
 
-        Returns:
-            Dict of tags for success, False for failure.
-        """
-        headers = {
-            "x-client": self.hab_user_id + "-TODO-Overs",
-            "x-api-user": self.hab_user_id,
-            "x-api-key": decrypt_text(self.api_token),
-        }
+        Habits and dailys come with one /tasks/user call and completed todos
+        with one more, and both are filtered in a single pass.
 
-        req = requests.get(
-            "https://habitica.com/api/v3/tasks/user?type=completedTodos",
-            headers=headers,
-            data={},
-        )
-        # print("GET: " + req.url + " [" + str(req.status_code) + "]: " + req.text)
-        self.return_code = req.status_code
-        if req.status_code == 200:
-            req_json = req.json()
-
-            user = Users.objects.get(user_id=self.hab_user_id)
-            results = []
-            if req_json["data"]:
-                for tag_json in req_json["data"]:
-                    completedAt = datetime.strptime(
-                        tag_json["dateCompleted"], "%Y-%m-%dT%H:%M:%S.%fZ"
-                    )
-                    if (
-                            (completedAt.day == datetime.today().day)
-                            and (completedAt.month == datetime.today().month)
-                            and (completedAt.year == datetime.today().year)
-                            and (tag_json["type"] == "todo")
-                    ):
-                        results.append(tag_json)
-                return results
-            return False
-        return False
-
-    def get_today_completed_habits(self):
-        """Get the list of a user's completed tasks.
-
-        Returns:
-            Dict of tags for success, False for failure.
-        """
-        headers = {
-            "x-client": self.hab_user_id + "-TODO-Overs",
-            "x-api-user": self.hab_user_id,
-            "x-api-key": decrypt_text(self.api_token),
-        }
-
-        req = requests.get(
-            "https://habitica.com/api/v3/tasks/user?type=habits",
-            headers=headers,
-            data={},
-        )
-        # print("GET: " + req.url + " [" + str(req.status_code) + "]: " + req.text)
-        self.return_code = req.status_code
-        if req.status_code == 200:
-            req_json = req.json()
-
-            user = Users.objects.get(user_id=self.hab_user_id)
-            results = []
-            if req_json["data"]:
-                for tag_json in req_json["data"]:
-                    for h in tag_json["history"]:
-                        updatedAt = datetime.fromtimestamp(h["date"] / 1e3)
-                        if (
-                                (updatedAt.day == datetime.today().day)
-                                and (updatedAt.month == datetime.today().month)
-                                and (updatedAt.year == datetime.today().year)
-                        ):
-                            entry = {
-                                key: tag_json[key]
-                                for key in [
-                                    "text",
-                                    "frequency",
-                                    "type",
-                                    "notes",
-                                    "createdAt",
-                                    "counterUp",
-                                    "counterDown",
-                                ]
-                            }
-                            entry["date"] = updatedAt
-                            results.append(entry)
-                return results
-            return False
-        return False
-
-    def get_today_completed_dailies(self):
-        """Get the list of a user's completed tasks.
+        Args:
+            today: optional date to report on, defaults to today.
 
         Returns:
-            Dict of tags for success, False for failure.
+            Dict of "habits", "dailys" and "todos" lists for success, False
+            for failure.
         """
-        headers = {
-            "x-client": self.hab_user_id + "-TODO-Overs",
-            "x-api-user": self.hab_user_id,
-            "x-api-key": decrypt_text(self.api_token),
-        }
-
-        req = requests.get(
-            "https://habitica.com/api/v3/tasks/user?type=dailys",
-            headers=headers,
-            data={},
-        )
-        # print("GET: " + req.url + " [" + str(req.status_code) + "]: " + req.text)
-        self.return_code = req.status_code
-        if req.status_code == 200:
-            req_json = req.json()
-            results = []
-            if req_json["data"]:
-                for tag_json in req_json["data"]:
-                    duplicat_check = []
-                    for h in tag_json["history"]:
-                        updatedAt = datetime.fromtimestamp(h["date"] / 1e3)
-                        if (
-                                (updatedAt.day == datetime.today().day)
-                                and (updatedAt.month == datetime.today().month)
-                                and (updatedAt.year == datetime.today().year)
-                                and (h["isDue"] == True)
-                                and (h["completed"] == True)
-                                and (tag_json["text"] not in duplicat_check)
-                        ):
-                            results.append(
-                                {
-                                    key: tag_json[key]
-                                    for key in [
-                                    "text",
-                                    "frequency",
-                                    "type",
-                                    "notes",
-                                    "createdAt",
-                                    "repeat",
-                                    "everyX",
-                                    "streak",
-                                ]
-                                }
-                            )
-                            duplicat_check.append(tag_json["text"])
-                return results
-            return False
-        return False
+        headers = user_headers(self.hab_user_id, self.api_token)
+        if today is None:
+            today = date.today()
+        window = _report_window(today)
+        results = {"habits": [], "dailys": [], "todos": []}
+
+        for url in (
+            api_url("/tasks/user"),
+            api_url("/tasks/user?type=completedTodos"),
+        ):
+            req = self._request("GET", url, headers=headers)
+            if self.return_code != 200:
+                return False
+            for task_json in req.json()["data"]:
+                _add_report_entries(results, task_json, today, window)
+        return results
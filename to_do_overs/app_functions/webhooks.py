@@ -0,0 +1,107 @@
+"""Webhooks - Habitica To Do Over tool
+
+Habitica posts a taskActivity event as soon as a task is scored, which lets
+a completed To-Do Over be recreated within seconds instead of waiting for
+the next scheduler run.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+__author__ = "Katie Patterson kirska.com"
+__license__ = "MIT"
+
+import hashlib
+import hmac
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+
+from to_do_overs.models import Tasks
+from . import leases, work_queue
+from .recreation import check_recreate_task
+
+
+def webhook_token(hab_user_id):
+    """Get the secret that authenticates webhook calls for a user.
+
+    Habitica doesn't sign webhook calls, so the token is part of the URL we
+    register and is derived from SECRET_KEY.
+
+    Args:
+        hab_user_id: the user ID from Habitica.
+
+    Returns:
+        The token as a hex string.
+    """
+    return hmac.new(
+        settings.SECRET_KEY.encode("utf-8"),
+        ("webhook:" + hab_user_id).encode("utf-8"),
+        hashlib.sha256,
+    ).hexdigest()
+
+
+def check_webhook_token(hab_user_id, token):
+    """Check a token from a webhook URL belongs to the user."""
+    return hmac.compare_digest(webhook_token(hab_user_id), token)
+
+
+def webhook_url(base_url, hab_user_id):
+    """Build the URL Habitica should post a user's events to.
+
+    Args:
+        base_url: the public address of the tool, e.g. https://example.com.
+        hab_user_id: the user ID from Habitica.
+
+    Returns:
+        The full webhook URL.
+    """
+    path = reverse(
+        "to_do_overs:webhook",
+        kwargs={"user_id": hab_user_id, "token": webhook_token(hab_user_id)},
+    )
+    return base_url.rstrip("/") + path
+
+
+def handle_task_activity(hab_user_id, payload):
+    """Recreate a To-Do Over that a taskActivity event reports as completed.
+
+    Args:
+        hab_user_id: the user ID the webhook was registered for.
+        payload: the decoded JSON body sent by Habitica.
+
+    Returns:
+        True if the event was about one of the user's To-Do Overs.
+    """
+    if payload.get("type") != "scored" or payload.get("direction") != "up":
+        return False
+    if payload.get("user", {}).get("_id", hab_user_id) != hab_user_id:
+        return False
+
+    task_json = payload.get("task") or {}
+    if task_json.get("type") != "todo":
+        return False
+
+    task = (
+        Tasks.objects.select_related("owner")
+        .prefetch_related("tags")
+        .filter(task_id=task_json.get("id"), owner__user_id=hab_user_id)
+        .first()
+    )
+    if task is None:
+        return False
+
+    # scoring a todo up completes it
+    task_json.setdefault("completed", True)
+    if not task_json.get("dateCompleted"):
+        task_json["dateCompleted"] = timezone.now().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    print("[WEBHOOK] task scored " + task.task_id)
+    check_recreate_task(task_json, task)
+    # run the recreation right away rather than on the next scheduler run,
+    # unless a scheduler replica is working on the user and will run it
+    if leases.claim_user(task.owner):
+        try:
+            work_queue.drain(task.owner)
+        finally:
+            leases.release_user(task.owner)
+    return True
@@ -0,0 +1,246 @@
+"""Work queue - Habitica To Do Over tool
+
+Recreations, tag syncs and deletes are stored in the Jobs table before they
+run. A failed job is retried on a later drain instead of sleeping in line,
+and work left over after a crash or restart is picked up by the next drain.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+__author__ = "Katie Patterson kirska.com"
+__license__ = "MIT"
+
+from datetime import timedelta
+from itertools import groupby
+
+from django.db import transaction
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from to_do_overs.models import Jobs, Tasks
+from . import metrics, recreation, tag_cache
+from .to_do_overs_data import ToDoOversData
+
+# a job that failed this often is left in the table but never run again
+MAX_ATTEMPTS = 8
+# most recreations sent to Habitica in one request
+RECREATE_BATCH_SIZE = 50
+# wait before retrying, doubled after every failed attempt
+RETRY_DELAY = timedelta(minutes=1)
+MAX_RETRY_DELAY = timedelta(hours=6)
+
+
+def _enqueue(kind, owner, key, task=None, habitica_task_id="", **fields):
+    job, created = Jobs.objects.get_or_create(
+        key=key,
+        defaults=dict(
+            fields,
+            kind=kind,
+            owner=owner,
+            task=task,
+            habitica_task_id=habitica_task_id,
+        ),
+    )
+    if not created and job.next_attempt_at is None:
+        # asked for again after giving up, so give it a fresh start
+        job.attempts = 0
+        job.next_attempt_at = timezone.now()
+        job.save(update_fields=["attempts", "next_attempt_at"])
+    return job
+
+
+def enqueue_recreate(task, completed_at=None, due_at=None):
+    """Queue the recreation of a completed task.
+
+    The key is the ID of the completed Habitica task, so reporting the same
+    completion twice (e.g. by webhook and by polling) queues one job.
+
+    Args:
+        task: the task from the tool database.
+        completed_at: optional time the task was completed on Habitica.
+        due_at: optional time the task was due again. With completed_at it
+            is used to measure how long the user waited for the recreation.
+    """
+    return _enqueue(
+        Jobs.RECREATE,
+        task.owner,
+        "recreate:" + task.task_id,
+        task=task,
+        habitica_task_id=task.task_id,
+        completed_at=completed_at,
+        due_at=due_at,
+    )
+
+
+def enqueue_tag_sync(owner):
+    """Queue a refresh of a user's tags."""
+    return _enqueue(Jobs.TAG_SYNC, owner, "tag_sync:" + owner.user_id)
+
+
+def enqueue_delete(task):
+    """Queue the removal of a task that no longer exists on Habitica."""
+    return _enqueue(
+        Jobs.DELETE,
+        task.owner,
+        "delete:" + task.task_id,
+        habitica_task_id=task.task_id,
+    )
+
+
+def _owner_data(owner):
+    tdo_data = ToDoOversData()
+    tdo_data.hab_user_id = owner.user_id
+    tdo_data.api_token = owner.api_key
+    return tdo_data
+
+
+def _run_recreate(job):
+    task = job.task
+    if task.task_id != job.habitica_task_id:
+        # recreated since the job was queued
+        return True
+
+    tdo_data = ToDoOversData()
+    # the same alias on every attempt stops Habitica from creating a duplicate
+    tdo_data.alias = "tdo-" + job.habitica_task_id
+    if not recreation.recreate_task(task, tdo_data):
+        return False
+    metrics.record_recreations([job])
+    return True
+
+
+def _run_recreate_batch(jobs):
+    """Recreate the tasks of several jobs of one user with one request.
+
+    Args:
+        jobs: recreate jobs of one user, none of them recreated yet.
+
+    Returns:
+        True if every task was recreated and its job removed. On False, or
+        if it raises, nothing was saved and the jobs are left to run one by
+        one.
+    """
+    tasks = [job.task for job in jobs]
+    task_ids = recreation.create_copies(
+        tasks, ["tdo-" + job.habitica_task_id for job in jobs]
+    )
+    if not task_ids:
+        return False
+
+    with transaction.atomic():
+        recreation.save_recreated(tasks, task_ids)
+        metrics.record_recreations(jobs)
+        Jobs.objects.filter(pk__in=[job.pk for job in jobs]).delete()
+    return True
+
+
+def _try_recreate_batch(jobs):
+    try:
+        return _run_recreate_batch(jobs)
+    except Exception as exception:  # pylint: disable=broad-except
+        # Habitica may have created the copies already, the aliases stop the
+        # one by one retries from creating them twice
+        print("recreating a batch failed, running its jobs one by one")
+        print(repr(exception))
+        return False
+
+
+def _run_tag_sync(job):
+    return tag_cache.refresh_tags(_owner_data(job.owner))
+
+
+def _run_delete(job):
+    print("deleting task " + job.habitica_task_id)
+    Tasks.objects.filter(task_id=job.habitica_task_id).delete()
+    metrics.increment("deletes")
+    return True
+
+
+_RUNNERS = {
+    Jobs.RECREATE: _run_recreate,
+    Jobs.TAG_SYNC: _run_tag_sync,
+    Jobs.DELETE: _run_delete,
+}
+
+
+def run_job(job):
+    """Run one job, removing it on success and scheduling a retry on failure.
+
+    Args:
+        job: the job from the tool database.
+
+    Returns:
+        True if the job succeeded.
+    """
+    try:
+        succeeded = _RUNNERS[job.kind](job)
+        error = "" if succeeded else "failed"
+    except Exception as exception:  # pylint: disable=broad-except
+        # one broken job must not stop the others
+        succeeded = False
+        error = repr(exception)
+
+    if succeeded:
+        Jobs.objects.filter(pk=job.pk).delete()
+        return True
+
+    job.attempts += 1
+    job.last_error = error
+    if job.attempts >= MAX_ATTEMPTS:
+        print("giving up on job " + job.key + ": " + error)
+        job.next_attempt_at = None
+    else:
+        delay = min(RETRY_DELAY * 2 ** (job.attempts - 1), MAX_RETRY_DELAY)
+        print("job " + job.key + " failed, retrying in " + str(delay))
+        job.next_attempt_at = timezone.now() + delay
+    job.save(update_fields=["attempts", "last_error", "next_attempt_at"])
+    return False
+
+
+def drain(owner=None, shard=None):
+    """Run every job that is due, without waiting for jobs that are not.
+
+    Args:
+        owner: optional user to only run the jobs of.
+        shard: optional (index, count) to only run the jobs of users whose
+            pk % count == index.
+
+    Returns:
+        The number of jobs that succeeded.
+    """
+    JOBS = (
+        Jobs.objects.filter(next_attempt_at__lte=timezone.now())
+        .select_related("owner", "task", "task__owner")
+        .prefetch_related("task__tags")
+        .order_by("next_attempt_at", "pk")
+    )
+    if owner is not None:
+        JOBS = JOBS.filter(owner=owner)
+    if shard is not None:
+        JOBS = JOBS.annotate(shard=Mod("owner_id", shard[1])).filter(shard=shard[0])
+
+    jobs = list(JOBS)
+    succeeded = 0
+
+    # a user's recreations go to Habitica in batches instead of one by one
+    recreations = sorted(
+        (
+            job
+            for job in jobs
+            if job.kind == Jobs.RECREATE and job.task.task_id == job.habitica_task_id
+        ),
+        key=lambda job: job.owner_id,
+    )
+    batched = set()
+    for owner_id, owner_jobs in groupby(recreations, key=lambda job: job.owner_id):
+        owner_jobs = list(owner_jobs)
+        for start in range(0, len(owner_jobs), RECREATE_BATCH_SIZE):
+            batch = owner_jobs[start : start + RECREATE_BATCH_SIZE]
+            if len(batch) > 1 and _try_recreate_batch(batch):
+                succeeded += len(batch)
+                batched.update(job.pk for job in batch)
+
+    for job in jobs:
+        if job.pk not in batched and run_job(job):
+            succeeded += 1
+    return succeeded
@@ -0,0 +1,80 @@
+"""Benchmark the scheduler and the reports against a local fake Habitica.
+"""
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from to_do_overs.app_functions import benchmark
+from to_do_overs.app_functions.fake_habitica import FakeHabitica
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database and a fake Habitica with users and tasks, "
+        "time job() and the report jobs, and append the results to a file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument(
+            "--tasks", type=int, default=20, help="To-Do Overs per user"
+        )
+        parser.add_argument("--cycles", type=int, default=3)
+        parser.add_argument(
+            "--complete",
+            type=float,
+            default=0.2,
+            help="Share of the tasks completed before each cycle",
+        )
+        parser.add_argument("--engine", choices=("sync", "async"), default="sync")
+        parser.add_argument(
+            "--latency", type=float, default=0.0, help="Seconds per fake request"
+        )
+        parser.add_argument(
+            "--error-429-rate", type=float, default=0.0, help="Share answered 429"
+        )
+        parser.add_argument(
+            "--error-5xx-rate", type=float, default=0.0, help="Share answered 503"
+        )
+        parser.add_argument(
+            "--output",
+            default="benchmark_results.jsonl",
+            help="JSON lines file the results are appended to",
+        )
+
+    def handle(self, *args, **options):
+        # never seed the real database. A file, unlike SQLite's in-memory
+        # database, lets the report threads wait for each other's locks
+        directory = tempfile.mkdtemp(prefix="todo-overs-benchmark-")
+        old_name = connection.settings_dict["NAME"]
+        connection.settings_dict["TEST"]["NAME"] = os.path.join(directory, "database")
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with FakeHabitica(
+                latency=options["latency"],
+                error_429_rate=options["error_429_rate"],
+                error_5xx_rate=options["error_5xx_rate"],
+            ) as fake:
+                result = benchmark.run(
+                    fake,
+                    users=options["users"],
+                    tasks_per_user=options["tasks"],
+                    cycles=options["cycles"],
+                    complete_fraction=options["complete"],
+                    engine=options["engine"],
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(directory, ignore_errors=True)
+
+        regressions = benchmark.compare(result, options["output"])
+        result = benchmark.save(result, options["output"])
+        self.stdout.write(json.dumps(result, indent=2, sort_keys=True))
+        for regression in regressions:
+            self.stderr.write("regression: " + regression)
@@ -0,0 +1,44 @@
+"""Import the daily report files written before reports were kept in the database.
+"""
+from __future__ import absolute_import
+
+import os
+
+from django.core.management.base import BaseCommand
+
+from to_do_overs.app_functions.report_store import import_report_file
+from to_do_overs.models import Users
+
+
+class Command(BaseCommand):
+    help = "Import reports/<date>_<user id>.txt files into the report tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "directory",
+            nargs="?",
+            default="reports",
+            help="Directory holding the report files, defaults to reports",
+        )
+
+    def handle(self, *args, **options):
+        users_by_id = {user.user_id: user for user in Users.objects.all()}
+        imported = 0
+        skipped = 0
+        for filename in sorted(os.listdir(options["directory"])):
+            path = os.path.join(options["directory"], filename)
+            try:
+                report = import_report_file(path, users_by_id)
+            except ValueError as error:
+                # unreadable JSON
+                report = None
+                self.stderr.write("could not read %s: %s" % (filename, error))
+
+            if report is None:
+                skipped += 1
+                self.stderr.write("skipped " + filename)
+            else:
+                imported += 1
+                self.stdout.write("imported %s as %s" % (filename, report.date))
+
+        self.stdout.write("%d reports imported, %d files skipped" % (imported, skipped))
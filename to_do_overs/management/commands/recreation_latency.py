@@ -0,0 +1,52 @@
+"""Print the percentiles of the recreation latency, day by day.
+"""
+from __future__ import absolute_import
+
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from to_do_overs.app_functions.metrics import PERCENTILES, latency_percentiles
+
+
+def _seconds(value):
+    return str(timedelta(seconds=round(value)))
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the percentiles of the time between completing a To-Do Over "
+        "and its recreation, per day, task type and delay."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=7,
+            help="Number of days to print, defaults to 7",
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        columns = " ".join("p%g" % (fraction * 100) for fraction in PERCENTILES)
+        self.stdout.write(
+            "day type delayed count latency(%s) lag(%s)" % (columns, columns)
+        )
+        for days_ago in range(options["days"] - 1, -1, -1):
+            day = today - timedelta(days=days_ago)
+            since = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+            percentiles = latency_percentiles(since, since + timedelta(days=1))
+            for (task_type, delayed), group in percentiles.items():
+                self.stdout.write(
+                    "%s %s %s %d %s %s"
+                    % (
+                        day,
+                        task_type,
+                        "yes" if delayed else "no",
+                        group["count"],
+                        "/".join(_seconds(v) for v in group["latency"].values()),
+                        "/".join(_seconds(v) for v in group["lag"].values()),
+                    )
+                )
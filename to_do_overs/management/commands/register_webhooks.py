@@ -0,0 +1,44 @@
+"""Register the To-Do Overs webhook on Habitica for every user of the tool.
+"""
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+
+from to_do_overs.app_functions import habitica_client
+from to_do_overs.app_functions.to_do_overs_data import ToDoOversData
+from to_do_overs.app_functions.webhooks import webhook_url
+from to_do_overs.models import Users
+
+
+class Command(BaseCommand):
+    help = "Register a taskActivity webhook on Habitica for every user."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "base_url",
+            help="Public address of the tool, e.g. https://todo-overs.example.com",
+        )
+
+    def handle(self, *args, **options):
+        failed = 0
+        try:
+            for user in Users.objects.all():
+                tdo_data = ToDoOversData()
+                tdo_data.hab_user_id = user.user_id
+                tdo_data.api_token = user.api_key
+
+                if tdo_data.register_webhook(
+                    webhook_url(options["base_url"], user.user_id)
+                ):
+                    self.stdout.write("registered webhook for " + user.user_id)
+                else:
+                    failed += 1
+                    self.stderr.write(
+                        "webhook registration failed for %s [%s]"
+                        % (user.user_id, tdo_data.return_code)
+                    )
+        finally:
+            habitica_client.close()
+
+        if failed:
+            self.stderr.write("%d users failed" % failed)
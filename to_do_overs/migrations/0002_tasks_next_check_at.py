@@ -0,0 +1,18 @@
+# Generated by Django 3.0 on 2026-10-17 02:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('to_do_overs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tasks',
+            name='next_check_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
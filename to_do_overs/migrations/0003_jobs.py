@@ -0,0 +1,30 @@
+# Generated by Django 3.0 on 2026-10-17 02:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('to_do_overs', '0002_tasks_next_check_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Jobs',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('recreate', 'Recreate task'), ('tag_sync', 'Sync tags'), ('delete', 'Delete task')], max_length=16)),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('habitica_task_id', models.CharField(blank=True, max_length=255)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(blank=True, db_index=True, default=django.utils.timezone.now, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='to_do_overs.Users')),
+                ('task', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='to_do_overs.Tasks')),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.0 on 2026-10-17 02:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('to_do_overs', '0003_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='users',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='users',
+            name='lease_owner',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='users',
+            name='next_sync_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0 on 2026-10-17 02:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('to_do_overs', '0004_users_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='users',
+            name='tags_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
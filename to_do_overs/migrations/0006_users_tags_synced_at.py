@@ -0,0 +1,18 @@
+# Generated by Django 3.0 on 2026-10-17 02:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('to_do_overs', '0005_users_tags_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='users',
+            name='tags_synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.0 on 2026-10-17 02:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('to_do_overs', '0006_users_tags_synced_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reports',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('data', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='to_do_overs.Users')),
+            ],
+            options={
+                'unique_together': {('owner', 'date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ReportEntries',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('habit', 'Habit'), ('daily', 'Daily'), ('todo', 'To-Do')], max_length=8)),
+                ('text', models.TextField()),
+                ('frequency', models.CharField(blank=True, max_length=16)),
+                ('score', models.IntegerField(default=0)),
+                ('report', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='to_do_overs.Reports')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.0 on 2026-10-17 02:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('to_do_overs', '0007_reports'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeeklyAggregates',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('week_start', models.DateField()),
+                ('habits', models.TextField(default='{}')),
+                ('dailys', models.TextField(default='{}')),
+                ('todos', models.TextField(default='[]')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='to_do_overs.Users')),
+            ],
+            options={
+                'unique_together': {('owner', 'week_start')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.0 on 2026-10-17 02:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('to_do_overs', '0008_weeklyaggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchedulerRuns',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(db_index=True)),
+                ('duration_seconds', models.FloatField()),
+                ('users', models.PositiveIntegerField(default=0)),
+                ('tasks_scanned', models.PositiveIntegerField(default=0)),
+                ('jobs', models.PositiveIntegerField(default=0)),
+                ('recreations', models.PositiveIntegerField(default=0)),
+                ('deletes', models.PositiveIntegerField(default=0)),
+                ('http_requests', models.PositiveIntegerField(default=0)),
+                ('http_429', models.PositiveIntegerField(default=0)),
+                ('rate_limit_wait_seconds', models.FloatField(default=0)),
+                ('http_latency', models.TextField(default='{}')),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.0 on 2026-10-17 02:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('to_do_overs', '0009_schedulerruns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobs',
+            name='completed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='jobs',
+            name='due_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='RecreationLatencies',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_type', models.CharField(choices=[('0', 'Day'), ('1', 'Week'), ('2', 'Month')], max_length=3)),
+                ('delayed', models.BooleanField(default=False)),
+                ('completed_at', models.DateTimeField()),
+                ('due_at', models.DateTimeField()),
+                ('recreated_at', models.DateTimeField(db_index=True)),
+                ('latency_seconds', models.FloatField()),
+                ('lag_seconds', models.FloatField()),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='to_do_overs.Users')),
+            ],
+        ),
+    ]
@@ -3,8 +3,10 @@
 """
 from __future__ import unicode_literals
 from builtins import str
-from datetime import date
+from datetime import date, datetime, timedelta
+import calendar
 from django.db import models
+from django.utils import timezone
 
 
 class Users(models.Model):
@@ -14,12 +16,26 @@ class Users(models.Model):
         username (str): Username from Habitica.
         user_id (str): User ID from Habitica.
         api_key (str): API token from Habitica.
+        lease_owner (str): The scheduler replica working on the user.
+        lease_expires_at (datetime): When the lease runs out unless renewed.
+        next_sync_at (datetime): When the user's tasks are due to be checked
+            again. Empty means on the next run.
+        tags_hash (str): Fingerprint of the tags last synced from Habitica.
+        tags_synced_at (datetime): When the tags were last fetched from
+            Habitica. Empty means they have to be fetched before use, a
+            time in the future that a fetch is running until then.
     """
 
     user_id = models.CharField(max_length=255, unique=True)
     api_key = models.CharField(max_length=255)
     username = models.CharField(max_length=255)
 
+    lease_owner = models.CharField(max_length=255, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    next_sync_at = models.DateTimeField(null=True, blank=True)
+    tags_hash = models.CharField(max_length=64, blank=True)
+    tags_synced_at = models.DateTimeField(null=True, blank=True)
+
     def __str__(self):
         return str(self.pk) + ":" + str(self.user_id) + ":" + str(self.username)
 
@@ -49,6 +65,8 @@ class Tasks(models.Model):
         priority (str): Difficulty of task.
         days (int): Number of days until task expires from the creation.
         owner (int/Foreign Key): The owner from the users model.
+        next_check_at (datetime): When the scheduler next has to look at the
+            task. Empty means on every run.
     """
 
     task_id = models.CharField(max_length=255, unique=True)
@@ -97,8 +115,251 @@ class Tasks(models.Model):
 
     tags = models.ManyToManyField(Tags)
 
+    next_check_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def compute_next_check_at(self, today=None):
+        """Work out when the scheduler next has to look at this task.
+
+        Week and month tasks can only be recreated on their weekday or day
+        of the month, so there is no point checking them on other days.
+
+        Args:
+            today: optional date to count from, defaults to today.
+
+        Returns:
+            The start of the next day the task can be recreated on, or None
+            for tasks that have to be checked on every run.
+        """
+        if today is None:
+            today = date.today()
+
+        if self.type == "1":
+            # Week Tasks
+            next_day = today + timedelta(days=(int(self.weekday) - today.weekday()) % 7)
+        elif self.type == "2":
+            # Month Tasks, skipping months that are too short for the day
+            monthday = int(self.monthday)
+            if not 1 <= monthday <= 31:
+                return None
+            year, month = today.year, today.month
+            while True:
+                if monthday <= calendar.monthrange(year, month)[1]:
+                    next_day = date(year, month, monthday)
+                    if next_day >= today:
+                        break
+                month += 1
+                if month > 12:
+                    year, month = year + 1, 1
+        else:
+            return None
+
+        return timezone.make_aware(datetime.combine(next_day, datetime.min.time()))
+
     def __str__(self):
         return str(self.pk) + ":" + str(self.name) + ":" + str(self.task_id)
 
     def __unicode__(self):
         return str(self.pk) + ":" + str(self.name) + ":" + str(self.task_id)
+
+
+class Jobs(models.Model):
+    """Model for the scheduler's pending work, kept until it succeeds.
+
+    Fields:
+        kind (str): What has to be done, see KIND_CHOICES.
+        key (str): Idempotency key, the same work is only queued once.
+        owner (int/Foreign Key): The user the work is done for.
+        task (int/Foreign Key): The task to recreate, if any.
+        habitica_task_id (str): Task ID on Habitica the work is about.
+        attempts (int): Number of failed attempts so far.
+        next_attempt_at (datetime): When the job may run next. Empty once
+            the job has failed too often.
+        last_error (str): Why the last attempt failed.
+        completed_at (datetime): When a recreated task was completed on
+            Habitica.
+        due_at (datetime): When a recreated task was due again, after its
+            delay or on its weekday/monthday.
+    """
+
+    RECREATE = "recreate"
+    TAG_SYNC = "tag_sync"
+    DELETE = "delete"
+    KIND_CHOICES = (
+        (RECREATE, "Recreate task"),
+        (TAG_SYNC, "Sync tags"),
+        (DELETE, "Delete task"),
+    )
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    key = models.CharField(max_length=255, unique=True)
+    owner = models.ForeignKey(Users, on_delete=models.CASCADE)
+    task = models.ForeignKey(Tasks, null=True, blank=True, on_delete=models.CASCADE)
+    habitica_task_id = models.CharField(max_length=255, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(
+        null=True, blank=True, default=timezone.now, db_index=True
+    )
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    due_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return str(self.pk) + ":" + str(self.key) + ":" + str(self.attempts)
+
+    def __unicode__(self):
+        return str(self.pk) + ":" + str(self.key) + ":" + str(self.attempts)
+
+
+class Reports(models.Model):
+    """Model for the daily reports of what users completed.
+
+    Fields:
+        owner (int/Foreign Key): The user the report is about.
+        date (date): The day the report covers.
+        data (str): The report as JSON, as sent along with the weekly email.
+        created_at (datetime): When the report was saved.
+    """
+
+    owner = models.ForeignKey(Users, on_delete=models.CASCADE)
+    date = models.DateField()
+    data = models.TextField()
+    created_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (("owner", "date"),)
+
+    def __str__(self):
+        return str(self.pk) + ":" + str(self.owner_id) + ":" + str(self.date)
+
+    def __unicode__(self):
+        return str(self.pk) + ":" + str(self.owner_id) + ":" + str(self.date)
+
+
+class ReportEntries(models.Model):
+    """Model for the habits, dailys and todos of a daily report.
+
+    Fields:
+        report (int/Foreign Key): The daily report the entry belongs to.
+        kind (str): Habit, daily or todo, see KIND_CHOICES.
+        text (str): Name/title of the task.
+        frequency (str): How often a habit or daily repeats.
+        score (int): counterUp - counterDown of a habit.
+    """
+
+    HABIT = "habit"
+    DAILY = "daily"
+    TODO = "todo"
+    KIND_CHOICES = (
+        (HABIT, "Habit"),
+        (DAILY, "Daily"),
+        (TODO, "To-Do"),
+    )
+    report = models.ForeignKey(
+        Reports, related_name="entries", on_delete=models.CASCADE
+    )
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+    text = models.TextField()
+    frequency = models.CharField(max_length=16, blank=True)
+    score = models.IntegerField(default=0)
+
+    def __str__(self):
+        return str(self.pk) + ":" + str(self.kind) + ":" + str(self.text)
+
+    def __unicode__(self):
+        return str(self.pk) + ":" + str(self.kind) + ":" + str(self.text)
+
+
+class WeeklyAggregates(models.Model):
+    """Model for a user's running weekly totals, updated by each daily report.
+
+    Fields:
+        owner (int/Foreign Key): The user the totals are about.
+        week_start (date): The Monday of the week.
+        habits (str): JSON of the net score of each habit and the number of
+            report entries it was folded in from.
+        dailys (str): JSON of how often each daily was done.
+        todos (str): JSON list of the todos completed.
+    """
+
+    owner = models.ForeignKey(Users, on_delete=models.CASCADE)
+    week_start = models.DateField()
+    habits = models.TextField(default="{}")
+    dailys = models.TextField(default="{}")
+    todos = models.TextField(default="[]")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (("owner", "week_start"),)
+
+    def __str__(self):
+        return str(self.pk) + ":" + str(self.owner_id) + ":" + str(self.week_start)
+
+    def __unicode__(self):
+        return str(self.pk) + ":" + str(self.owner_id) + ":" + str(self.week_start)
+
+
+class SchedulerRuns(models.Model):
+    """Model for the ledger of scheduler runs.
+
+    Fields:
+        started_at (datetime): When the run started.
+        duration_seconds (float): How long the run took.
+        users (int): Users whose tasks were checked.
+        tasks_scanned (int): Tasks checked against Habitica.
+        jobs (int): Queued jobs that succeeded.
+        recreations (int): Tasks recreated on Habitica.
+        deletes (int): Tasks deleted because they were gone from Habitica.
+        http_requests (int): Requests sent to Habitica.
+        http_429 (int): Requests answered with 429 Too Many Requests.
+        rate_limit_wait_seconds (float): Time spent waiting on rate limits.
+        http_latency (str): JSON latency histogram per Habitica endpoint.
+    """
+
+    started_at = models.DateTimeField(db_index=True)
+    duration_seconds = models.FloatField()
+    users = models.PositiveIntegerField(default=0)
+    tasks_scanned = models.PositiveIntegerField(default=0)
+    jobs = models.PositiveIntegerField(default=0)
+    recreations = models.PositiveIntegerField(default=0)
+    deletes = models.PositiveIntegerField(default=0)
+    http_requests = models.PositiveIntegerField(default=0)
+    http_429 = models.PositiveIntegerField(default=0)
+    rate_limit_wait_seconds = models.FloatField(default=0)
+    http_latency = models.TextField(default="{}")
+
+    def __str__(self):
+        return str(self.pk) + ":" + str(self.started_at)
+
+    def __unicode__(self):
+        return str(self.pk) + ":" + str(self.started_at)
+
+
+class RecreationLatencies(models.Model):
+    """Model for how long users waited for their To-Do Overs to come back.
+
+    Fields:
+        owner (int/Foreign Key): The user the task belongs to.
+        task_type (str): Day, week or month task, see Tasks.TYPE_CHOICES.
+        delayed (bool): Whether the task had a delay.
+        completed_at (datetime): When the task was completed on Habitica.
+        due_at (datetime): When the task was due again.
+        recreated_at (datetime): When the new copy was created.
+        latency_seconds (float): From completed_at to recreated_at.
+        lag_seconds (float): From due_at to recreated_at, the part of the
+            wait that is up to the scheduler.
+    """
+
+    owner = models.ForeignKey(Users, on_delete=models.CASCADE)
+    task_type = models.CharField(max_length=3, choices=Tasks.TYPE_CHOICES)
+    delayed = models.BooleanField(default=False)
+    completed_at = models.DateTimeField()
+    due_at = models.DateTimeField()
+    recreated_at = models.DateTimeField(db_index=True)
+    latency_seconds = models.FloatField()
+    lag_seconds = models.FloatField()
+
+    def __str__(self):
+        return str(self.pk) + ":" + str(self.recreated_at)
+
+    def __unicode__(self):
+        return str(self.pk) + ":" + str(self.recreated_at)
@@ -1,6 +1,1721 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.test import TestCase
+import asyncio
+from collections import Counter
+from datetime import date, datetime, timedelta
+import io
+import json
+import os
+import pstats
+import smtplib
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+import scheduled_script
+from .app_functions import (
+    benchmark,
+    cipher_functions,
+    email_delivery,
+    habitica_client,
+    leases,
+    metrics,
+    profiling,
+    rate_limiter,
+    recreation,
+    report_store,
+    tag_cache,
+    to_do_overs_data,
+    work_queue,
+)
+from .app_functions.cipher_functions import encrypt_text
+from .app_functions.fake_habitica import FakeHabitica
+from .app_functions.to_do_overs_data import ToDoOversData
+from .app_functions.webhooks import webhook_token, webhook_url
+from .models import (
+    Jobs,
+    RecreationLatencies,
+    Reports,
+    SchedulerRuns,
+    Tags,
+    Tasks,
+    Users,
+    WeeklyAggregates,
+)
+
+
+def _create_user_with_tasks(user_number, task_count):
+    user = Users.objects.create(
+        user_id="user-%d" % user_number,
+        api_key=str(encrypt_text("key")),
+        username="name",
+    )
+    tag = Tags.objects.create(
+        tag_id="tag-%d" % user_number, tag_text="tag", tag_owner=user
+    )
+    for task_number in range(task_count):
+        task = Tasks.objects.create(
+            task_id="task-%d-%d" % (user_number, task_number),
+            name="task",
+            owner=user,
+        )
+        task.tags.add(tag)
+    return user
+
+
+class _Response(object):
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.headers = {}
+        self._data = data
+
+    def json(self):
+        return {"data": self._data}
+
+
+class SnapshotTests(TestCase):
+    """job() checks tasks against the todo snapshot and falls back to GETs."""
+
+    def setUp(self):
+        _create_user_with_tasks(0, 4)
+        self.requests = []
+        self.created = 0
+        self.completed = {
+            "id": "",
+            "completed": True,
+            "dateCompleted": timezone.now().strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        }
+
+    def _new_task(self, task_data):
+        self.created += 1
+        return dict(task_data, id="new-%d" % self.created)
+
+    def _request(self, snapshot_status):
+        def request(method, url, **kwargs):
+            method = method.upper()
+            path = url.split("/api/v3")[1]
+            self.requests.append(method + " " + path)
+            if path == "/tasks/user?type=todos":
+                return _Response(
+                    snapshot_status, [{"id": "task-0-0", "completed": False}]
+                )
+            if path == "/tasks/user?type=completedTodos":
+                return _Response(snapshot_status, [dict(self.completed, id="task-0-1")])
+            if path == "/tasks/task-0-0":
+                return _Response(200, {"id": "task-0-0", "completed": False})
+            if path == "/tasks/task-0-1" or path == "/tasks/task-0-2":
+                return _Response(200, dict(self.completed, id=path[7:]))
+            if path == "/tags":
+                return _Response(200, [])
+            if method == "POST" and path == "/tasks/user":
+                body = kwargs.get("json")
+                if isinstance(body, list):
+                    return _Response(201, [self._new_task(task) for task in body])
+                return _Response(201, self._new_task({}))
+            return _Response(404)
+
+        return request
+
+    def _run(self, snapshot_status):
+        with mock.patch(
+            "requests.Session.request", side_effect=self._request(snapshot_status)
+        ):
+            scheduled_script.job()
+
+    def _task_gets(self):
+        return [
+            request for request in self.requests if request.startswith("GET /tasks")
+        ]
+
+    def test_tasks_missing_from_the_snapshot_are_fetched(self):
+        self._run(200)
+
+        # task-0-0 and task-0-1 are in the snapshot, the others are fetched
+        self.assertEqual(
+            self._task_gets(),
+            [
+                "GET /tasks/user?type=todos",
+                "GET /tasks/user?type=completedTodos",
+                "GET /tasks/task-0-2",
+                "GET /tasks/task-0-3",
+            ],
+        )
+        # the completed ones are recreated, the one gone from Habitica deleted
+        self.assertEqual(self.created, 2)
+        self.assertEqual(
+            sorted(Tasks.objects.values_list("task_id", flat=True)),
+            ["new-1", "new-2", "task-0-0"],
+        )
+
+    def test_failed_snapshot_falls_back_to_one_request_per_task(self):
+        self._run(500)
+
+        # the snapshot gives up after its first failed request
+        self.assertEqual(
+            self._task_gets(),
+            ["GET /tasks/user?type=todos"]
+            + ["GET /tasks/task-0-%d" % number for number in range(4)],
+        )
+        self.assertEqual(
+            sorted(Tasks.objects.values_list("task_id", flat=True)),
+            ["new-1", "new-2", "task-0-0"],
+        )
+
+
+class AsyncEngineTests(TransactionTestCase):
+    """The async engine checks every user once, a few calls at a time."""
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.snapshots = Counter()
+        self.in_flight = Counter()
+        self.peak = Counter()
+
+    def _request(self, method, url, **kwargs):
+        user_id = kwargs["headers"]["x-api-user"]
+        with self.lock:
+            self.in_flight[user_id] += 1
+            self.peak[user_id] = max(self.peak[user_id], self.in_flight[user_id])
+            if url.endswith("?type=todos"):
+                self.snapshots[user_id] += 1
+        try:
+            if "/tasks/task-" in url:
+                # slow enough for the user's other calls to pile up
+                time.sleep(0.02)
+                return _Response(200, {"completed": False})
+            return _Response(200, [])
+        finally:
+            with self.lock:
+                self.in_flight[user_id] -= 1
+
+    def _run(self, **settings):
+        # fresh tags, so only task requests are sent
+        Users.objects.update(tags_synced_at=timezone.now())
+        with mock.patch(
+            "requests.Session.request", side_effect=self._request
+        ), mock.patch.multiple(scheduled_script, **settings), mock.patch.object(
+            to_do_overs_data, "RATE_LIMITER", rate_limiter.RateLimiter()
+        ):
+            with mock.patch.object(
+                scheduled_script,
+                "_next_owners",
+                wraps=scheduled_script._next_owners,
+            ) as next_owners:
+                self.stats = asyncio.run(scheduled_script._job_async())
+        return next_owners.call_count
+
+    def test_every_owner_is_synced_once(self):
+        for user_number in range(7):
+            _create_user_with_tasks(user_number, 2)
+
+        batches = self._run(SCHEDULER_MAX_CONCURRENCY=2)
+
+        self.assertEqual(self.snapshots, Counter("user-%d" % n for n in range(7)))
+        self.assertEqual((self.stats["users"], self.stats["tasks"]), (7, 14))
+        # 7 users in batches of 2, plus the empty batch at the end
+        self.assertEqual(batches, 5)
+
+    def test_calls_per_user_are_capped(self):
+        for user_number in range(2):
+            _create_user_with_tasks(user_number, 6)
+
+        # the snapshot is empty, so all 6 tasks of a user are fetched at once
+        self._run(SCHEDULER_MAX_CONCURRENCY=8, SCHEDULER_MAX_PER_USER=2)
+
+        self.assertEqual(self.peak, Counter({"user-0": 2, "user-1": 2}))
+
+
+class _Clock(object):
+    """Clock for the rate limiter that only moves when it sleeps."""
+
+    def __init__(self, now=1000000000.0):
+        self.now = now
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class RateLimiterTests(TestCase):
+    """Requests are paced per user from Habitica's rate limit headers."""
+
+    def setUp(self):
+        self.clock = _Clock()
+        self.limiter = rate_limiter.RateLimiter(self.clock.time, self.clock.sleep)
+
+    def test_reset_headers_are_parsed(self):
+        now = 1700000000.0
+        self.assertEqual(rate_limiter.parse_reset("1700000030000", now), 1700000030.0)
+        self.assertEqual(rate_limiter.parse_reset("1700000030", now), 1700000030.0)
+        self.assertEqual(rate_limiter.parse_reset("30", now), now + 30)
+        self.assertEqual(
+            rate_limiter.parse_reset(
+                "Tue Nov 14 2023 22:13:50 GMT+0000 (Coordinated Universal Time)", now
+            ),
+            1700000030.0,
+        )
+        self.assertIsNone(rate_limiter.parse_reset("soon", now))
+        self.assertIsNone(rate_limiter.parse_reset("", now))
+
+    def test_requests_are_paced_once_the_bucket_is_empty(self):
+        for _ in range(rate_limiter.DEFAULT_LIMIT):
+            self.assertEqual(self.limiter.acquire("user"), 0)
+        self.assertEqual(self.clock.slept, [])
+
+        # one token comes back every 60 / 30 seconds
+        self.assertEqual(self.limiter.acquire("user"), 2.0)
+        # other users have buckets of their own
+        self.assertEqual(self.limiter.acquire("other user"), 0)
+
+    def test_remaining_header_empties_the_bucket(self):
+        self.limiter.acquire("user")
+        self.limiter.update(
+            "user",
+            200,
+            {
+                "X-RateLimit-Limit": "60",
+                "X-RateLimit-Remaining": "0",
+                "X-RateLimit-Reset": str(self.clock.now + 5),
+            },
+        )
+        self.assertEqual(self.limiter.acquire("user"), 5.0)
+        # refilled at the new limit of one per second since then
+        self.clock.now += 10
+        self.assertEqual(self.limiter.acquire("user"), 0)
+
+    def test_wait_is_capped(self):
+        self.limiter.update("user", 429, {"Retry-After": "3600"})
+        self.assertEqual(self.limiter.acquire("user"), rate_limiter.MAX_WAIT_SECONDS)
+
+    def test_too_many_requests_is_retried_after_the_reset(self):
+        _create_user_with_tasks(0, 0)
+        tdo_data = ToDoOversData()
+        tdo_data.hab_user_id = "user-0"
+        tdo_data.api_token = Users.objects.get().api_key
+        responses = [_Response(429), _Response(200, [])]
+        responses[0].headers = {"Retry-After": "7"}
+
+        with mock.patch.object(
+            to_do_overs_data, "RATE_LIMITER", self.limiter
+        ), mock.patch(
+            "requests.Session.request",
+            side_effect=lambda method, url, **kwargs: responses.pop(0),
+        ):
+            tdo_data.get_user_tags()
+
+        self.assertEqual(tdo_data.return_code, 200)
+        self.assertEqual(self.clock.slept, [7.0])
+
+
+class HabiticaClientTests(TestCase):
+    """Requests share one session, auth headers are built per request."""
+
+    def test_session_is_shared_until_closed(self):
+        session = habitica_client.get_session()
+        self.assertIs(habitica_client.get_session(), session)
+        habitica_client.close()
+        self.assertIsNot(habitica_client.get_session(), session)
+        habitica_client.close()
+
+    def test_headers_dont_keep_the_plain_token(self):
+        api_token = str(encrypt_text("secret"))
+        with mock.patch.object(
+            habitica_client, "decrypt_text", return_value="secret"
+        ) as decrypt:
+            headers = habitica_client.user_headers("user", api_token)
+            headers["x-api-key"] = "changed"
+            self.assertEqual(
+                habitica_client.user_headers("user", api_token)["x-api-key"], "secret"
+            )
+        self.assertEqual(decrypt.call_count, 2)
+
+
+class CredentialCacheTests(TestCase):
+    """The cipher key is read once and plain tokens only live for a run."""
+
+    def setUp(self):
+        self.api_token = str(encrypt_text("secret"))
+        self.addCleanup(cipher_functions.clear_credential_cache)
+
+    def test_key_is_loaded_once(self):
+        cipher_functions._cipher_suite.cache_clear()
+        cipher_functions.decrypt_text(self.api_token)
+        cipher_functions.decrypt_text(self.api_token)
+
+        cache_info = cipher_functions._cipher_suite.cache_info()
+        self.assertEqual((cache_info.misses, cache_info.hits), (1, 1))
+
+    def test_tokens_are_decrypted_once_per_run(self):
+        cipher_functions.start_credential_cache()
+        with mock.patch.object(
+            cipher_functions,
+            "_cipher_suite",
+            wraps=cipher_functions._cipher_suite,
+        ) as cipher_suite:
+            self.assertEqual(cipher_functions.decrypt_text(self.api_token), b"secret")
+            self.assertEqual(cipher_functions.decrypt_text(self.api_token), b"secret")
+        self.assertEqual(cipher_suite.call_count, 1)
+
+        cipher_functions.clear_credential_cache()
+        self.assertIsNone(cipher_functions._credential_cache)
+
+    def _cached_during(self, run):
+        cached = []
+
+        def request(method, url, **kwargs):
+            cached.append(dict(cipher_functions._credential_cache))
+            return _Response(500)
+
+        with mock.patch("requests.Session.request", side_effect=request):
+            run()
+        return cached
+
+    def test_runs_drop_the_tokens_when_done(self):
+        _create_user_with_tasks(0, 1)
+
+        # the helper's users have the token "key"
+        cached = self._cached_during(scheduled_script.job)
+        self.assertIn(b"key", cached[0].values())
+        self.assertIsNone(cipher_functions._credential_cache)
+
+        cached = self._cached_during(scheduled_script.create_daily_report)
+        self.assertIn(b"key", cached[0].values())
+        self.assertIsNone(cipher_functions._credential_cache)
+
+
+class SchedulerQueryTests(TestCase):
+    """Database round-trips of the scheduler don't grow with the task count."""
+
+    def _load_all(self, chunk_size):
+        loaded = []
+        for owner, owner_tasks in scheduled_script._tasks_by_owner(chunk_size):
+            for task in owner_tasks:
+                loaded.append((owner.user_id, [tag.tag_id for tag in task.tags.all()]))
+        return loaded
+
+    def test_one_chunk_costs_two_queries(self):
+        for user_number in range(5):
+            _create_user_with_tasks(user_number, 10)
+
+        with self.assertNumQueries(2):
+            loaded = self._load_all(chunk_size=500)
+
+        self.assertEqual(len(loaded), 50)
+        self.assertIn(("user-3", ["tag-3"]), loaded)
+
+    def test_chunks_cover_every_task_once(self):
+        for user_number in range(3):
+            _create_user_with_tasks(user_number, 3)
+
+        # 9 tasks in chunks of 4: three task queries and three tag queries
+        with self.assertNumQueries(6):
+            loaded = self._load_all(chunk_size=4)
+
+        self.assertEqual(len(loaded), 9)
+        owners = [user_id for user_id, tags in loaded]
+        self.assertEqual(owners, sorted(owners))
+
+    def test_recreate_only_saves_the_task(self):
+        _create_user_with_tasks(0, 1)
+        owner, owner_tasks = next(scheduled_script._tasks_by_owner())
+
+        def create_task(tdo_data):
+            self.assertEqual(tdo_data.tags, ["tag-0"])
+            tdo_data.task_id = "task-new"
+            return True
+
+        with mock.patch.object(ToDoOversData, "create_task", create_task):
+            with self.assertNumQueries(1):
+                recreation.recreate_task(owner_tasks[0], ToDoOversData())
+
+        self.assertTrue(Tasks.objects.filter(task_id="task-new").exists())
+
+
+class ShardTests(TestCase):
+    """Worker processes split the users between them without overlap."""
+
+    def test_shards_cover_every_user_once(self):
+        for user_number in range(7):
+            _create_user_with_tasks(user_number, 2)
+
+        loaded = []
+        for index in range(3):
+            shard = (index, 3)
+            for owner, owner_tasks in scheduled_script._tasks_by_owner(shard=shard):
+                self.assertEqual(owner.pk % 3, index)
+                loaded.extend(task_.task_id for task_ in owner_tasks)
+
+        all_tasks = Tasks.objects.values_list("task_id", flat=True)
+        self.assertEqual(sorted(loaded), sorted(all_tasks))
+
+    def test_drain_only_runs_jobs_of_the_shard(self):
+        users = [_create_user_with_tasks(user_number, 1) for user_number in range(2)]
+        for task in Tasks.objects.all():
+            work_queue.enqueue_delete(task)
+
+        shard = (users[0].pk % 2, 2)
+        self.assertEqual(work_queue.drain(shard=shard), 1)
+        self.assertEqual(Tasks.objects.get().owner, users[1])
+
+
+class LeaseTests(TestCase):
+    """Scheduler replicas never work on the same user at once."""
+
+    def setUp(self):
+        self.user = _create_user_with_tasks(0, 1)
+
+    def test_only_one_replica_gets_the_lease(self):
+        self.assertTrue(leases.claim_user(self.user, "replica-a"))
+        self.assertFalse(leases.claim_user(self.user, "replica-b"))
+        # claiming again renews the lease of the holder
+        self.assertTrue(leases.claim_user(self.user, "replica-a"))
+
+    def test_expired_lease_is_taken_over(self):
+        leases.claim_user(self.user, "replica-a")
+        Users.objects.update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(leases.renew_leases("replica-a"), 0)
+        self.assertTrue(leases.claim_user(self.user, "replica-b"))
+        self.assertEqual(leases.renew_leases("replica-b"), 1)
+
+    def test_released_user_waits_for_next_sync(self):
+        leases.claim_user(self.user, "replica-a")
+        next_sync_at = timezone.now() + timedelta(minutes=5)
+        leases.release_user(self.user, next_sync_at, "replica-a")
+
+        self.assertFalse(leases.claim_user(self.user, "replica-b", due_only=True))
+        # jobs may still run for the user
+        self.assertTrue(leases.claim_user(self.user, "replica-b"))
+        self.assertEqual(list(scheduled_script._tasks_by_owner()), [])
+
+    def test_scheduler_skips_leased_users(self):
+        leases.claim_user(self.user, "replica-a")
+        owner, owner_tasks = next(scheduled_script._tasks_by_owner())
+
+        with mock.patch.object(scheduled_script, "_prepare_owner") as prepare_owner:
+            self.assertIsNone(scheduled_script._sync_owner(owner, owner_tasks))
+        prepare_owner.assert_not_called()
+
+
+class ReplicaTests(TransactionTestCase):
+    """Two schedulers on one database never recreate the same task twice."""
+
+    def setUp(self):
+        self.fake = FakeHabitica(latency=0.05).start()
+        self.addCleanup(self.fake.stop)
+        for user_number in range(4):
+            user = _create_user_with_tasks(user_number, 0)
+            tag_id = self.fake.add_user(user.user_id)
+            for _ in range(3):
+                task_id = self.fake.add_task(user.user_id, tags=[tag_id])["id"]
+                Tasks.objects.create(task_id=task_id, name="task", owner=user)
+                self.fake.complete(task_id, datetime.utcnow() - timedelta(minutes=1))
+        self.completed = set(Tasks.objects.values_list("task_id", flat=True))
+        Users.objects.update(tags_synced_at=timezone.now())
+
+    def test_concurrent_cycles_recreate_each_task_once(self):
+        results = {}
+
+        def run_replica():
+            try:
+                results[threading.current_thread().name] = (
+                    scheduled_script._run_cycle()
+                )
+            finally:
+                connection.close()
+
+        # a user's sync takes about three requests of 0.05s, longer than a
+        # lease, so only the heartbeat keeps the other replica off the user
+        with mock.patch.object(habitica_client, "API_URL", self.fake.url), mock.patch(
+            "to_do_overs.app_functions.leases.replica_id",
+            side_effect=lambda: threading.current_thread().name,
+        ), mock.patch.object(leases, "LEASE_SECONDS", 0.1), mock.patch.object(
+            leases, "HEARTBEAT_SECONDS", 0.02
+        ):
+            threads = [
+                threading.Thread(target=run_replica, name="replica-%s" % name)
+                for name in "ab"
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(sum(stats["users"] for stats in results.values()), 4)
+        created = Counter(
+            task["alias"]
+            for user in self.fake._users.values()
+            for task in user["tasks"]
+            if task.get("alias")
+        )
+        self.assertEqual(
+            created, Counter("tdo-" + task_id for task_id in self.completed)
+        )
+        self.assertEqual(
+            sum(
+                count
+                for (method, path, status), count in self.fake.requests.items()
+                if status >= 400
+            ),
+            0,
+        )
+        self.assertFalse(Tasks.objects.filter(task_id__in=self.completed).exists())
+
+
+    def test_heartbeat_keeps_a_long_sync_leased(self):
+        user = Users.objects.get(user_id="user-0")
+        claims = []
+        prepare_owner = scheduled_script._prepare_owner
+
+        def slow_prepare(owner, tdo_data):
+            # outlast several leases, then let another replica try the user
+            time.sleep(0.35)
+            claims.append(leases.claim_user(user, "replica-b"))
+            return prepare_owner(owner, tdo_data)
+
+        with mock.patch.object(habitica_client, "API_URL", self.fake.url), mock.patch(
+            "scheduled_script._prepare_owner", side_effect=slow_prepare
+        ), mock.patch.object(leases, "LEASE_SECONDS", 0.1), mock.patch.object(
+            leases, "HEARTBEAT_SECONDS", 0.02
+        ):
+            with leases.Heartbeat():
+                scheduled_script._sync_owner(
+                    user, list(Tasks.objects.filter(owner=user))
+                )
+
+        self.assertEqual(claims, [False])
+        user.refresh_from_db()
+        self.assertEqual(user.lease_owner, "")
+
+
+class NextCheckAtTests(TestCase):
+    """Week and month tasks are only checked on the days they can be recreated."""
+
+    def test_day_task_is_always_checked(self):
+        self.assertIsNone(Tasks(type="0").compute_next_check_at(date(2026, 10, 17)))
+
+    def test_week_task_waits_for_its_weekday(self):
+        # 2026-10-17 is a Saturday
+        task = Tasks(type="1", weekday="0")
+        self.assertEqual(
+            task.compute_next_check_at(date(2026, 10, 17)).date(), date(2026, 10, 19)
+        )
+        task.weekday = "5"
+        self.assertEqual(
+            task.compute_next_check_at(date(2026, 10, 17)).date(), date(2026, 10, 17)
+        )
+
+    def test_month_task_skips_short_months(self):
+        task = Tasks(type="2", monthday="31")
+        self.assertEqual(
+            task.compute_next_check_at(date(2026, 2, 1)).date(), date(2026, 3, 31)
+        )
+        self.assertEqual(
+            task.compute_next_check_at(date(2026, 12, 31)).date(), date(2026, 12, 31)
+        )
+
+    def test_scheduler_skips_tasks_not_due(self):
+        user = _create_user_with_tasks(0, 1)
+        task = Tasks.objects.create(
+            task_id="task-week",
+            name="week",
+            owner=user,
+            type="1",
+            weekday=str((date.today().weekday() + 1) % 7),
+        )
+
+        loaded = [
+            task_.task_id
+            for owner, owner_tasks in scheduled_script._tasks_by_owner()
+            for task_ in owner_tasks
+        ]
+
+        self.assertEqual(loaded, ["task-0-0"])
+        task.refresh_from_db()
+        self.assertEqual(task.next_check_at, task.compute_next_check_at())
+        self.assertGreater(task.next_check_at, timezone.now())
+
+
+class DelayedTaskTests(TestCase):
+    """Delayed day tasks are not polled again before their delay has passed."""
+
+    def test_delay_not_met_parks_the_task(self):
+        _create_user_with_tasks(0, 1)
+        Tasks.objects.update(delay=3)
+        owner, owner_tasks = next(scheduled_script._tasks_by_owner())
+        completed_at = timezone.now().replace(microsecond=0)
+
+        recreation.check_recreate_task(
+            {
+                "completed": True,
+                "dateCompleted": completed_at.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            },
+            owner_tasks[0],
+        )
+        self.assertFalse(Jobs.objects.exists())
+
+        self.assertEqual(
+            Tasks.objects.get().next_check_at,
+            completed_at.replace(hour=0, minute=0, second=0) + timedelta(days=3),
+        )
+        self.assertEqual(list(scheduled_script._tasks_by_owner()), [])
+
+
+class WebhookTests(TestCase):
+    """Habitica's taskActivity events recreate completed To-Do Overs."""
+
+    def setUp(self):
+        _create_user_with_tasks(0, 1)
+        self.url = reverse(
+            "to_do_overs:webhook",
+            kwargs={"user_id": "user-0", "token": webhook_token("user-0")},
+        )
+
+    def _post(self, url, task_id="task-0-0", **payload):
+        body = {
+            "webhookType": "taskActivity",
+            "type": "scored",
+            "direction": "up",
+            "task": {
+                "id": task_id,
+                "type": "todo",
+                "completed": True,
+                "dateCompleted": "2026-10-17T08:00:00.000Z",
+            },
+            "user": {"_id": "user-0"},
+        }
+        body.update(payload)
+        with mock.patch.object(ToDoOversData, "create_task") as create_task:
+            create_task.return_value = False
+            response = self.client.post(
+                url, json.dumps(body), content_type="application/json"
+            )
+        return response, create_task
+
+    def test_scored_task_is_recreated(self):
+        response, create_task = self._post(self.url)
+        self.assertEqual(response.status_code, 200)
+        create_task.assert_called_once_with()
+
+    def test_wrong_token_is_rejected(self):
+        url = reverse(
+            "to_do_overs:webhook", kwargs={"user_id": "user-0", "token": "0" * 64}
+        )
+        response, create_task = self._post(url)
+        self.assertEqual(response.status_code, 403)
+        create_task.assert_not_called()
+
+    def test_unknown_task_is_ignored(self):
+        response, create_task = self._post(self.url, task_id="someone-elses-task")
+        self.assertEqual(response.status_code, 200)
+        create_task.assert_not_called()
+
+    def test_unscoring_is_ignored(self):
+        response, create_task = self._post(self.url, direction="down")
+        self.assertEqual(response.status_code, 200)
+        create_task.assert_not_called()
+
+    def test_webhook_url_carries_the_token(self):
+        self.assertEqual(
+            webhook_url("https://example.com/", "user-0"),
+            "https://example.com" + self.url,
+        )
+
+
+class TagSyncTests(TestCase):
+    """Tags are synced with a diff and skipped when nothing changed."""
+
+    def setUp(self):
+        _create_user_with_tasks(0, 0)
+        self.tdo_data = ToDoOversData()
+        self.tdo_data.hab_user_id = "user-0"
+        self.tdo_data.api_token = Users.objects.get().api_key
+
+    def _sync(self, tags):
+        tags_json = [{"id": tag_id, "name": name} for tag_id, name in tags]
+        with mock.patch(
+            "to_do_overs.app_functions.habitica_client.request",
+            return_value=_Response(200, tags_json),
+        ):
+            return self.tdo_data.get_user_tags()
+
+    def _local_tags(self):
+        return sorted(Tags.objects.values_list("tag_id", "tag_text"))
+
+    def test_changes_are_applied(self):
+        self._sync([("tag-0", "renamed"), ("tag-new", "new")])
+        self.assertEqual(
+            self._local_tags(), [("tag-0", "renamed"), ("tag-new", "new")]
+        )
+
+        self._sync([("tag-new", "new")])
+        self.assertEqual(self._local_tags(), [("tag-new", "new")])
+
+    def test_unchanged_tags_skip_the_database(self):
+        self._sync([("tag-0", "tag"), ("tag-1", "other")])
+
+        # only the user is loaded to compare the hash
+        with self.assertNumQueries(1):
+            tags = self._sync([("tag-1", "other"), ("tag-0", "tag")])
+        self.assertEqual(len(tags), 2)
+
+
+class TagCacheTests(TestCase):
+    """Tags are fetched from Habitica at most once per TTL."""
+
+    def setUp(self):
+        _create_user_with_tasks(0, 0)
+        self.tdo_data = ToDoOversData()
+        self.tdo_data.hab_user_id = "user-0"
+        self.tdo_data.api_token = Users.objects.get().api_key
+
+    def _refresh(self, response):
+        with mock.patch(
+            "to_do_overs.app_functions.habitica_client.request",
+            return_value=response,
+        ) as request:
+            refreshed = tag_cache.refresh_tags(self.tdo_data)
+        return refreshed, request.call_count
+
+    def test_fresh_tags_are_not_fetched_again(self):
+        self.assertEqual(self._refresh(_Response(200, [])), (True, 1))
+        self.assertEqual(self._refresh(_Response(200, [])), (True, 0))
+        self.assertFalse(tag_cache.tags_stale(Users.objects.get()))
+
+        tag_cache.invalidate_tags("user-0")
+        self.assertEqual(self._refresh(_Response(200, [])), (True, 1))
+
+    def test_failed_refresh_is_tried_again(self):
+        self.assertEqual(self._refresh(_Response(500)), (False, 1))
+        self.assertTrue(tag_cache.tags_stale(Users.objects.get()))
+        self.assertEqual(self._refresh(_Response(200, [])), (True, 1))
+
+
+class TagRefreshRaceTests(TransactionTestCase):
+    """Callers that lose the refresh wait for the winner's tags."""
+
+    def setUp(self):
+        _create_user_with_tasks(0, 0)
+        self.fetching = threading.Event()
+        self.release = threading.Event()
+        self.requests = 0
+
+    def _tdo_data(self):
+        tdo_data = ToDoOversData()
+        tdo_data.hab_user_id = "user-0"
+        tdo_data.api_token = Users.objects.get().api_key
+        return tdo_data
+
+    def _race(self, status, winner_data=None):
+        def slow_request(method, url, **kwargs):
+            self.requests += 1
+            self.fetching.set()
+            self.release.wait(5)
+            return _Response(status, winner_data)
+
+        results = {}
+
+        def refresh(name):
+            try:
+                results[name] = tag_cache.refresh_tags(self._tdo_data())
+            finally:
+                connection.close()
+
+        with mock.patch(
+            "to_do_overs.app_functions.habitica_client.request",
+            side_effect=slow_request,
+        ), mock.patch.object(tag_cache, "TAGS_REFRESH_POLL", 0.01):
+            winner = threading.Thread(target=refresh, args=("winner",))
+            winner.start()
+            self.fetching.wait(5)
+            loser = threading.Thread(target=refresh, args=("loser",))
+            loser.start()
+            # the loser is polling, not gone with the old tags
+            loser.join(0.2)
+            self.assertTrue(loser.is_alive())
+            self.release.set()
+            winner.join()
+            loser.join()
+        return results
+
+    def test_loser_waits_for_the_winners_tags(self):
+        results = self._race(200, [{"id": "tag-new", "name": "new"}])
+
+        self.assertEqual(results, {"winner": True, "loser": True})
+        self.assertEqual(self.requests, 1)
+        self.assertEqual(
+            list(Tags.objects.values_list("tag_id", flat=True)), ["tag-new"]
+        )
+        self.assertFalse(tag_cache.tags_stale(Users.objects.get()))
+
+    def test_loser_sees_a_failed_refresh(self):
+        results = self._race(500)
+
+        self.assertEqual(results, {"winner": False, "loser": False})
+        self.assertEqual(self.requests, 1)
+        self.assertTrue(tag_cache.tags_stale(Users.objects.get()))
+
+    def test_loser_stops_waiting_after_the_timeout(self):
+        def hanging_request(method, url, **kwargs):
+            self.release.wait(5)
+            return _Response(200, [])
+
+        with mock.patch(
+            "to_do_overs.app_functions.habitica_client.request",
+            side_effect=hanging_request,
+        ), mock.patch.object(tag_cache, "TAGS_REFRESH_WAIT", 0.2), mock.patch.object(
+            tag_cache, "TAGS_REFRESH_POLL", 0.01
+        ):
+            winner = threading.Thread(
+                target=scheduled_script._close_db_after,
+                args=(tag_cache.refresh_tags, self._tdo_data()),
+            )
+            winner.start()
+            while Users.objects.get().tags_synced_at is None:
+                time.sleep(0.01)
+            started = time.monotonic()
+            self.assertTrue(tag_cache.refresh_tags(self._tdo_data()))
+            self.assertLess(time.monotonic() - started, 1)
+            self.release.set()
+            winner.join()
+
+
+class DailyReportTests(TestCase):
+    """The daily report is collected with two requests per user."""
+
+    def test_tasks_are_partitioned_in_one_pass(self):
+        now_ms = datetime.now().timestamp() * 1e3
+        yesterday_ms = now_ms - 86400e3
+        habit = {
+            "type": "habit",
+            "text": "walk",
+            "frequency": "daily",
+            "notes": "",
+            "createdAt": "",
+            "counterUp": 2,
+            "counterDown": 0,
+            "history": [{"date": yesterday_ms}, {"date": now_ms}],
+        }
+        daily = {
+            "type": "daily",
+            "text": "read",
+            "frequency": "daily",
+            "notes": "",
+            "createdAt": "",
+            "repeat": {},
+            "everyX": 1,
+            "streak": 3,
+            "history": [
+                {"date": now_ms, "isDue": True, "completed": True},
+                {"date": now_ms, "isDue": True, "completed": True},
+            ],
+        }
+        open_todo = {"type": "todo", "text": "open", "completed": False}
+        done_todo = {
+            "type": "todo",
+            "text": "done",
+            "dateCompleted": datetime.now().strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        }
+        responses = [
+            _Response(200, [habit, daily, open_todo]),
+            _Response(200, [done_todo]),
+        ]
+        tdo_data = ToDoOversData()
+        tdo_data.hab_user_id = "user-0"
+        tdo_data.api_token = str(encrypt_text("key"))
+
+        with mock.patch(
+            "to_do_overs.app_functions.habitica_client.request",
+            side_effect=lambda method, url, **kwargs: responses.pop(0),
+        ):
+            report = tdo_data.get_today_report()
+
+        self.assertEqual(responses, [])
+        self.assertEqual([entry["text"] for entry in report["habits"]], ["walk"])
+        self.assertEqual([entry["text"] for entry in report["dailys"]], ["read"])
+        self.assertEqual(report["todos"], [done_todo])
+
+
+    def test_history_is_searched_for_the_day(self):
+        window = to_do_overs_data._report_window(date(2026, 10, 17))
+        day_ms = 86400e3
+        # two years of history, three entries on the day itself
+        history = [{"date": window[0] - n * day_ms / 2} for n in range(1460, 0, -1)]
+        history += [{"date": window[0] + n * 1e3} for n in (0, 1, 2)]
+        history += [{"date": window[1]}]
+
+        entries = to_do_overs_data._history_on_day(history, window)
+
+        self.assertEqual(
+            [entry["date"] for entry in entries],
+            [window[0], window[0] + 1e3, window[0] + 2e3],
+        )
+        self.assertEqual(to_do_overs_data._history_on_day([], window), [])
+
+
+def _habit(text, frequency, up):
+    return {"text": text, "frequency": frequency, "counterUp": up, "counterDown": 0}
+
+
+class ReportPoolTests(TestCase):
+    """The report pool counts failed and overdue users and waits for them."""
+
+    def setUp(self):
+        self.users = [_create_user_with_tasks(n, 0) for n in range(20)]
+
+    def _run(self, func):
+        out = io.StringIO()
+        with mock.patch.object(
+            scheduled_script, "REPORT_USER_TIMEOUT", 0.1
+        ), mock.patch.object(scheduled_script, "REPORT_POLL_SECONDS", 0.02), mock.patch(
+            "sys.stdout", out
+        ):
+            stats = scheduled_script._run_report_pool(func, self.users, "test report")
+        return stats, out.getvalue()
+
+    def test_stats_and_progress(self):
+        events = []
+
+        def report(user_):
+            if user_.user_id == "user-3":
+                raise RuntimeError("fetching tasks failed")
+            if user_.user_id == "user-7":
+                time.sleep(0.5)
+                events.append("straggler finished")
+
+        stats, out = self._run(report)
+        events.append("pool returned")
+
+        self.assertEqual(stats, Counter({"done": 18, "failed": 1, "timed out": 1}))
+        # the straggler is not torn down under, nor counted when it finishes
+        self.assertEqual(events, ["straggler finished", "pool returned"])
+        self.assertIn("test report failed for user-3: RuntimeError(", out)
+        self.assertIn("test report timed out for user-7", out)
+        self.assertIn("test report: waiting for 1 timed out users", out)
+        self.assertIn("test report: 2/20 users", out)
+        self.assertIn("test report: 18/20 users", out)
+        self.assertIn("18 done, 1 failed, 1 timed out", out)
+
+    def test_all_done(self):
+        stats, out = self._run(lambda user_: None)
+
+        self.assertEqual(stats, Counter({"done": 20}))
+        self.assertNotIn("waiting for", out)
+
+
+class ReportStoreTests(TestCase):
+    """Daily reports are kept per user and day and summed up for the week."""
+
+    def setUp(self):
+        self.user = _create_user_with_tasks(0, 0)
+
+    def test_week_is_summed_up(self):
+        monday = date(2026, 10, 12)
+        report_store.save_daily_report(
+            self.user,
+            monday,
+            {
+                "habits": [_habit("walk", "daily", 2), _habit("gym", "weekly", 1)],
+                "dailys": [{"text": "read", "frequency": "daily"}],
+                "todos": [{"text": "taxes"}],
+            },
+        )
+        tuesday = {
+            "habits": [_habit("walk", "daily", 3), _habit("gym", "weekly", 2)],
+            "dailys": [{"text": "read", "frequency": "daily"}],
+            "todos": [],
+        }
+        report_store.save_daily_report(self.user, monday + timedelta(days=1), tuesday)
+        # saving a day again replaces it
+        report_store.save_daily_report(self.user, monday + timedelta(days=1), tuesday)
+        self.assertEqual(Reports.objects.count(), 2)
+        week = [monday + timedelta(days=n) for n in range(7)]
+
+        # the daily reports keep the week's totals up to date
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                report_store.weekly_totals(self.user, monday),
+                ({"walk": 5, "gym": 2}, {"read": 2}, ["taxes"]),
+            )
+        self.assertEqual(
+            report_store.weekly_totals(self.user, monday + timedelta(days=7)),
+            ({}, {}, []),
+        )
+        attachments = report_store.report_attachments(self.user, week)
+        self.assertEqual(
+            [name for name, content in attachments],
+            ["2026-10-12_user-0.txt", "2026-10-13_user-0.txt"],
+        )
+
+    def test_saving_a_day_again_replaces_its_share_of_the_week(self):
+        monday = date(2026, 10, 12)
+        report_store.save_daily_report(
+            self.user,
+            monday,
+            {
+                "habits": [_habit("walk", "daily", 2), _habit("gym", "weekly", 1)],
+                "dailys": [{"text": "read", "frequency": "daily"}],
+                "todos": [{"text": "taxes"}],
+            },
+        )
+        tuesday = monday + timedelta(days=1)
+        report_store.save_daily_report(
+            self.user,
+            tuesday,
+            {
+                "habits": [_habit("walk", "daily", 3), _habit("gym", "weekly", 4)],
+                "dailys": [
+                    {"text": "read", "frequency": "daily"},
+                    {"text": "floss", "frequency": "daily"},
+                ],
+                "todos": [{"text": "taxes"}, {"text": "call"}],
+            },
+        )
+        # tuesday again, with a lower best for gym and less done
+        report_store.save_daily_report(
+            self.user,
+            tuesday,
+            {
+                "habits": [_habit("walk", "daily", 1), _habit("gym", "weekly", 0)],
+                "dailys": [{"text": "read", "frequency": "daily"}],
+                "todos": [{"text": "taxes"}],
+            },
+        )
+
+        self.assertEqual(
+            report_store.weekly_totals(self.user, monday),
+            ({"walk": 3, "gym": 1}, {"read": 2}, ["taxes", "taxes"]),
+        )
+        # only the re-saved day's entries were read back, the totals are stored
+        aggregate = WeeklyAggregates.objects.get()
+        self.assertEqual(json.loads(aggregate.habits), {"walk": [3, 2], "gym": [1, 2]})
+
+    def test_ambiguous_file_name_uses_the_day_it_was_written(self):
+        parse = report_store.parse_report_file_name
+        self.assertEqual(
+            parse("2026111_user-0.txt", date(2026, 1, 11)),
+            ("user-0", date(2026, 1, 11)),
+        )
+        self.assertEqual(
+            parse("2026111_user-0.txt", date(2026, 11, 2)),
+            ("user-0", date(2026, 11, 1)),
+        )
+        self.assertIsNone(parse("notes.txt", date.today()))
+
+    def test_old_report_file_is_imported(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "20261017_user-0.txt")
+            with open(path, "w") as report_file:
+                json.dump(
+                    {"date": "20261017", "habits": False, "dailys": [], "todos": []},
+                    report_file,
+                )
+            report = report_store.import_report_file(path, {"user-0": self.user})
+
+        self.assertEqual(report.date, date(2026, 10, 17))
+        self.assertEqual(json.loads(report.data)["date"], "2026-10-17")
+
+
+class _FakeSMTP(object):
+    """Local SMTP stand-in that records what is sent over it."""
+
+    def __init__(self, sent, fail=False, error=None):
+        self.sent = sent
+        self.fail = fail
+        self.error = error
+
+    def send_message(self, message):
+        if self.error is not None:
+            raise self.error
+        if self.fail:
+            raise smtplib.SMTPServerDisconnected("gone")
+        self.sent.append(message)
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class EmailDeliveryTests(TestCase):
+    """Weekly emails reuse SMTP connections and retry failed sends."""
+
+    def setUp(self):
+        self.sent = []
+        self.connections = []
+
+    def _factory(self, fail_first=False):
+        def smtp_factory():
+            server = _FakeSMTP(self.sent, fail=fail_first and not self.connections)
+            self.connections.append(server)
+            return server
+
+        return smtp_factory
+
+    def test_connection_is_reused_for_the_batch(self):
+        mailer = email_delivery.Mailer(connections=2, smtp_factory=self._factory())
+        for number in range(5):
+            mailer.send(email_delivery.build_message(str(number), "<p>hi</p>", []))
+        mailer.close()
+
+        self.assertEqual(len(self.sent), 5)
+        self.assertEqual(len(self.connections), 1)
+
+    def test_failed_send_is_retried_on_a_new_connection(self):
+        mailer = email_delivery.Mailer(
+            smtp_factory=self._factory(fail_first=True), sleep=lambda seconds: None
+        )
+        mailer.send(email_delivery.build_message("report", "<p>hi</p>", []))
+
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(len(self.connections), 2)
+
+    def _failing_factory(self, error):
+        def smtp_factory():
+            server = _FakeSMTP(self.sent, error=error)
+            self.connections.append(server)
+            return server
+
+        return smtp_factory
+
+    def test_permanent_failures_are_not_retried(self):
+        for error in (
+            smtplib.SMTPRecipientsRefused({"to@example.com": (550, b"no")}),
+            smtplib.SMTPDataError(554, b"rejected"),
+            smtplib.SMTPResponseException(552, b"too big"),
+        ):
+            self.connections = []
+            mailer = email_delivery.Mailer(
+                smtp_factory=self._failing_factory(error), sleep=lambda seconds: None
+            )
+            with self.assertRaises(type(error)):
+                mailer.send(email_delivery.build_message("report", "<p>hi</p>", []))
+            self.assertEqual(len(self.connections), 1)
+
+    def test_temporary_failures_are_retried(self):
+        mailer = email_delivery.Mailer(
+            retries=2,
+            smtp_factory=self._failing_factory(smtplib.SMTPDataError(451, b"later")),
+            sleep=lambda seconds: None,
+        )
+        with self.assertRaises(smtplib.SMTPDataError):
+            mailer.send(email_delivery.build_message("report", "<p>hi</p>", []))
+        self.assertEqual(len(self.connections), 3)
+
+    def test_connection_is_closed_when_login_fails(self):
+        server = mock.Mock()
+        server.login.side_effect = smtplib.SMTPAuthenticationError(535, b"bad")
+        with mock.patch.object(email_delivery, "SMTP_SSL", False), mock.patch(
+            "smtplib.SMTP", return_value=server
+        ), mock.patch.dict(os.environ, {"EMAIL_PASS": "secret"}):
+            with self.assertRaises(smtplib.SMTPAuthenticationError):
+                email_delivery.connect()
+        server.close.assert_called_once_with()
+
+    def test_weekly_report_is_rendered_from_the_template(self):
+        user = _create_user_with_tasks(0, 0)
+        monday = date(2026, 10, 12)
+        report_store.save_daily_report(
+            user,
+            monday,
+            {"habits": [_habit("<walk>", "daily", 2)], "dailys": [], "todos": []},
+        )
+        mailer = email_delivery.Mailer(smtp_factory=self._factory())
+        week = [monday + timedelta(days=n) for n in range(7)]
+
+        # the week's totals, then the reports only for their attachments
+        with self.assertNumQueries(2):
+            scheduled_script._create_weekly_report_for(user, week, mailer)
+
+        message = self.sent[0]
+        html = message.get_body().get_content()
+        self.assertIn("12.10.2026 - 18.10.2026", html)
+        self.assertIn("&lt;walk&gt;: 2", html)
+        self.assertEqual(
+            [part.get_filename() for part in message.iter_attachments()],
+            ["2026-10-12_user-0.txt"],
+        )
+
+    def test_habit_names_dont_clash_with_the_template(self):
+        user = _create_user_with_tasks(0, 0)
+        monday = date(2026, 10, 12)
+        report_store.save_daily_report(
+            user,
+            monday,
+            {
+                "habits": [_habit("items", "daily", 3), _habit("walk", "daily", 1)],
+                "dailys": [],
+                "todos": [],
+            },
+        )
+        mailer = email_delivery.Mailer(smtp_factory=self._factory())
+        week = [monday + timedelta(days=n) for n in range(7)]
+
+        scheduled_script._create_weekly_report_for(user, week, mailer)
+
+        html = self.sent[0].get_body().get_content()
+        self.assertIn("items: 3", html)
+        self.assertIn("walk: 1", html)
+
+
+class WorkQueueTests(TestCase):
+    """Queued work survives failures and never creates duplicate todos."""
+
+    def setUp(self):
+        _create_user_with_tasks(0, 1)
+        self.task = Tasks.objects.get()
+
+    def test_same_completion_is_queued_once(self):
+        work_queue.enqueue_recreate(self.task)
+        work_queue.enqueue_recreate(self.task)
+        self.assertEqual(Jobs.objects.count(), 1)
+
+    def test_failed_job_is_retried_later(self):
+        work_queue.enqueue_recreate(self.task)
+
+        with mock.patch(
+            "to_do_overs.app_functions.habitica_client.request",
+            return_value=_Response(500),
+        ), mock.patch.object(ToDoOversData, "get_user_tags"):
+            self.assertEqual(work_queue.drain(), 0)
+            # not due yet, so draining again doesn't try it
+            self.assertEqual(work_queue.drain(), 0)
+
+        job = Jobs.objects.get()
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.next_attempt_at, timezone.now())
+
+    def test_retry_finds_the_task_created_before(self):
+        work_queue.enqueue_recreate(self.task)
+        responses = [_Response(400), _Response(200, {"id": "task-new"})]
+
+        def request(method, url, **kwargs):
+            if method == "POST":
+                self.assertEqual(kwargs["data"]["alias"], "tdo-task-0-0")
+            else:
+                self.assertTrue(url.endswith("/tasks/tdo-task-0-0"))
+            return responses.pop(0)
+
+        with mock.patch(
+            "to_do_overs.app_functions.habitica_client.request", request
+        ):
+            self.assertEqual(work_queue.drain(), 1)
+
+        self.assertFalse(Jobs.objects.exists())
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.task_id, "task-new")
+
+    def test_recreations_of_a_user_are_batched(self):
+        _create_user_with_tasks(1, 3)
+        for task in Tasks.objects.filter(owner__user_id="user-1"):
+            work_queue.enqueue_recreate(task)
+
+        def request(method, url, **kwargs):
+            self.assertEqual(method, "POST")
+            created = [
+                {"id": "new-" + task_json["alias"], "alias": task_json["alias"]}
+                # answer out of order, the aliases tell the tasks apart
+                for task_json in reversed(kwargs["json"])
+            ]
+            return _Response(201, created)
+
+        with mock.patch(
+            "to_do_overs.app_functions.habitica_client.request", side_effect=request
+        ) as patched:
+            self.assertEqual(work_queue.drain(), 3)
+
+        self.assertEqual(patched.call_count, 1)
+        self.assertFalse(Jobs.objects.exists())
+        self.assertEqual(
+            sorted(Tasks.objects.values_list("task_id", flat=True)),
+            ["new-tdo-task-1-0", "new-tdo-task-1-1", "new-tdo-task-1-2", "task-0-0"],
+        )
+
+    def test_failed_batch_falls_back_to_single_creates(self):
+        _create_user_with_tasks(1, 2)
+        for task in Tasks.objects.filter(owner__user_id="user-1"):
+            work_queue.enqueue_recreate(task)
+        responses = [
+            _Response(500),
+            _Response(201, {"id": "a"}),
+            _Response(201, {"id": "b"}),
+        ]
+
+        with mock.patch(
+            "to_do_overs.app_functions.habitica_client.request",
+            side_effect=lambda method, url, **kwargs: responses.pop(0),
+        ):
+            self.assertEqual(work_queue.drain(), 2)
+
+        self.assertEqual(
+            sorted(Tasks.objects.values_list("task_id", flat=True)),
+            ["a", "b", "task-0-0"],
+        )
+
+    def test_batch_that_raises_falls_back_to_single_creates(self):
+        _create_user_with_tasks(1, 2)
+        for task in Tasks.objects.filter(owner__user_id="user-1"):
+            work_queue.enqueue_recreate(task)
+
+        def request(method, url, **kwargs):
+            if method == "POST" and isinstance(kwargs.get("json"), list):
+                created = [
+                    {"id": "new-" + task_json["alias"], "alias": task_json["alias"]}
+                    for task_json in kwargs["json"]
+                ]
+                return _Response(201, created)
+            if method == "POST":
+                # the batch already created a task with this alias
+                return _Response(400)
+            return _Response(200, {"id": "new-" + url.rsplit("/", 1)[1]})
+
+        with mock.patch(
+            "to_do_overs.app_functions.habitica_client.request", side_effect=request
+        ), mock.patch.object(
+            recreation,
+            "save_recreated",
+            side_effect=OperationalError("database is locked"),
+        ):
+            self.assertEqual(work_queue.drain(), 2)
+
+        self.assertFalse(Jobs.objects.exists())
+        self.assertEqual(
+            sorted(Tasks.objects.values_list("task_id", flat=True)),
+            ["new-tdo-task-1-0", "new-tdo-task-1-1", "task-0-0"],
+        )
+
+    def test_failed_user_doesnt_stop_the_run(self):
+        _create_user_with_tasks(1, 1)
+        Users.objects.update(tags_synced_at=timezone.now())
+
+        def drain(owner=None, shard=None):
+            if owner.user_id == "user-0":
+                raise OperationalError("database is locked")
+            return 0
+
+        with mock.patch(
+            "to_do_overs.app_functions.habitica_client.request",
+            return_value=_Response(200, []),
+        ), mock.patch.object(work_queue, "drain", side_effect=drain) as patched:
+            stats = scheduled_script._check_users()
+
+        self.assertEqual(
+            [call.args[0].user_id for call in patched.call_args_list],
+            ["user-0", "user-1"],
+        )
+        self.assertEqual(stats["users"], 2)
+
+    def test_delete_job_removes_the_task(self):
+        work_queue.enqueue_delete(self.task)
+        self.assertEqual(work_queue.drain(), 1)
+        self.assertFalse(Tasks.objects.exists())
+        self.assertFalse(Jobs.objects.exists())
+
+
+class MetricsTests(TestCase):
+    """Scheduler runs are counted, saved to the ledger and served."""
+
+    def setUp(self):
+        metrics.take()
+        _create_user_with_tasks(0, 0)
+        self.tdo_data = ToDoOversData()
+        self.tdo_data.hab_user_id = "user-0"
+        self.tdo_data.api_token = Users.objects.get().api_key
+
+    def test_ids_are_left_out_of_endpoint_names(self):
+        self.assertEqual(
+            metrics.endpoint_name(
+                "POST", "https://habitica.com/api/v3/tasks/tdo-1234/tags/5678"
+            ),
+            "POST /tasks/{id}/tags/{id}",
+        )
+        self.assertEqual(
+            metrics.endpoint_name(
+                "GET", "https://habitica.com/api/v3/tasks/user?type=completedTodos"
+            ),
+            "GET /tasks/user?type=completedTodos",
+        )
+
+    def test_requests_are_counted(self):
+        with mock.patch(
+            "to_do_overs.app_functions.habitica_client.request",
+            return_value=_Response(200, []),
+        ):
+            self.tdo_data.get_user_tags()
+
+        counts = metrics.take()
+        self.assertEqual(counts["http_requests"], 1)
+        self.assertEqual(counts[("http_count", "GET /tags")], 1)
+        self.assertFalse(metrics.take())
+
+    def test_run_is_served_to_prometheus(self):
+        metrics.record_request("GET", "https://habitica.com/api/v3/tags", 429, 0.2, 1)
+        counts = metrics.take()
+        counts.update({"users": 1, "tasks": 3, "recreations": 2})
+        metrics.save_run(timezone.now(), 1.5, counts)
+
+        run = SchedulerRuns.objects.get()
+        self.assertEqual((run.tasks_scanned, run.http_429), (3, 1))
+        response = self.client.get(reverse("to_do_overs:metrics"))
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn("todo_overs_last_run_recreations 2\n", text)
+        self.assertIn(
+            'todo_overs_last_run_http_request_duration_seconds_bucket'
+            '{endpoint="GET /tags",le="0.1"} 0\n',
+            text,
+        )
+        self.assertIn(
+            'todo_overs_last_run_http_request_duration_seconds_bucket'
+            '{endpoint="GET /tags",le="0.25"} 1\n',
+            text,
+        )
+
+
+class RecreationLatencyTests(TestCase):
+    """The wait between completing a To-Do Over and getting it back is kept."""
+
+    def setUp(self):
+        _create_user_with_tasks(0, 1)
+        self.task = Tasks.objects.get()
+
+    def _complete(self, completed_at):
+        recreation.check_recreate_task(
+            {
+                "completed": True,
+                "dateCompleted": completed_at.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            },
+            Tasks.objects.select_related("owner").get(),
+        )
+        with mock.patch(
+            "to_do_overs.app_functions.habitica_client.request",
+            return_value=_Response(201, {"id": "new-task"}),
+        ):
+            self.assertEqual(work_queue.drain(), 1)
+        return RecreationLatencies.objects.get()
+
+    def test_latency_of_a_task_without_delay(self):
+        latency = self._complete(timezone.now() - timedelta(minutes=10))
+        self.assertEqual((latency.task_type, latency.delayed), ("0", False))
+        self.assertAlmostEqual(latency.latency_seconds, 600, delta=5)
+        self.assertAlmostEqual(latency.lag_seconds, 600, delta=5)
+
+    def test_lag_of_a_delayed_task_starts_after_the_delay(self):
+        Tasks.objects.update(delay=2)
+        completed_at = timezone.now() - timedelta(days=3)
+        latency = self._complete(completed_at)
+
+        due_at = completed_at.replace(hour=0, minute=0, second=0) + timedelta(days=2)
+        self.assertTrue(latency.delayed)
+        self.assertEqual(latency.due_at, due_at.replace(microsecond=0))
+        self.assertGreater(latency.latency_seconds, 3 * 24 * 3600 - 5)
+        self.assertLess(latency.lag_seconds, latency.latency_seconds)
+
+    def test_percentiles_per_task_type_and_delay(self):
+        now = timezone.now()
+        for seconds in range(1, 11):
+            RecreationLatencies.objects.create(
+                owner=self.task.owner,
+                task_type="0",
+                completed_at=now,
+                due_at=now,
+                recreated_at=now,
+                latency_seconds=seconds,
+                lag_seconds=seconds / 10,
+            )
+
+        percentiles = metrics.latency_percentiles(now - timedelta(hours=1))
+        self.assertEqual(list(percentiles), [("day", False)])
+        self.assertEqual(percentiles[("day", False)]["count"], 10)
+        self.assertEqual(
+            percentiles[("day", False)]["latency"], {0.5: 5, 0.9: 9, 0.99: 10}
+        )
+        self.assertIn(
+            'todo_overs_recreation_latency_seconds{type="day",delayed="false",'
+            'quantile="0.9"} 9.0\n',
+            metrics.prometheus_text(),
+        )
+
+        out = io.StringIO()
+        call_command("recreation_latency", "--days", "1", stdout=out)
+        self.assertIn(" day no 10 0:00:05/0:00:09/0:00:10 ", out.getvalue())
+
+
+class ProfilingTests(TestCase):
+    """Jobs named in PROFILE_JOBS are profiled into the profile directory."""
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        patcher = mock.patch.multiple(
+            profiling,
+            PROFILE_JOBS="create_daily_report",
+            PROFILE_SAMPLE_RATE=1.0,
+            PROFILE_DIR=self.profile_dir,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_threads_of_the_job_are_profiled(self):
+        def work_in_thread():
+            return [str(number) for number in range(1000)]
+
+        @profiling.profiled("create_daily_report")
+        def report():
+            thread = threading.Thread(target=work_in_thread)
+            thread.start()
+            thread.join()
+            return "done"
+
+        self.assertEqual(report(), "done")
+
+        names = sorted(os.listdir(self.profile_dir))
+        self.assertEqual(len(names), 2)
+        self.assertTrue(names[0].startswith("create_daily_report-"))
+        self.assertEqual(
+            [os.path.splitext(name)[1] for name in names], [".prof", ".txt"]
+        )
+        stats = pstats.Stats(os.path.join(self.profile_dir, names[0]))
+        self.assertIn("work_in_thread", [function for _, _, function in stats.stats])
+        with open(os.path.join(self.profile_dir, names[1])) as summary:
+            self.assertIn("top 25 allocations by line", summary.read())
+
+    @unittest.skipIf(
+        sys.version_info >= (3, 12), "one profiler covers every thread"
+    )
+    def test_thread_profilers_are_disabled_in_their_threads(self):
+        release = threading.Event()
+        profiles_seen = []
+
+        def work_in_thread():
+            return [str(number) for number in range(1000)]
+
+        def after_target():
+            # the profiler this thread enabled, if any, is still installed
+            profiles_seen.append(sys.getprofile())
+
+        def still_running():
+            release.wait(5)
+
+        class Worker(threading.Thread):
+            def run(self):
+                super().run()
+                after_target()
+
+        session = profiling._Session()
+        session.start()
+        worker = Worker(target=work_in_thread)
+        worker.start()
+        worker.join()
+        straggler = threading.Thread(target=still_running)
+        straggler.start()
+        session.stop()
+
+        profiles, running = session.finished_profiles()
+        release.set()
+        straggler.join()
+
+        self.assertEqual(profiles_seen, [None])
+        self.assertIsNone(sys.getprofile())
+        self.assertEqual(len(profiles), 2)
+        self.assertEqual(running, 1)
+        functions = [function for _, _, function in pstats.Stats(profiles[1]).stats]
+        self.assertIn("work_in_thread", functions)
+        self.assertNotIn("after_target", functions)
+
+    def test_other_jobs_are_not_profiled(self):
+        scheduled_script.create_weekly_report()
+        self.assertEqual(os.listdir(self.profile_dir), [])
+        scheduled_script.create_daily_report()
+        self.assertEqual(len(os.listdir(self.profile_dir)), 2)
+
+
+class FakeHabiticaTests(TestCase):
+    """The fake Habitica answers the tool like the real one."""
+
+    def setUp(self):
+        self.fake = FakeHabitica().start()
+        self.addCleanup(self.fake.stop)
+        patcher = mock.patch.object(habitica_client, "API_URL", self.fake.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(habitica_client.close)
+
+        _create_user_with_tasks(0, 0)
+        self.fake.add_user("user-0")
+        self.tdo_data = ToDoOversData()
+        self.tdo_data.hab_user_id = "user-0"
+        self.tdo_data.api_token = Users.objects.get().api_key
+
+    def test_alias_is_only_created_once(self):
+        self.tdo_data.task_name = "task"
+        self.tdo_data.alias = "tdo-task-0"
+        self.assertTrue(self.tdo_data.create_task())
+        task_id = self.tdo_data.task_id
+
+        self.assertTrue(self.tdo_data.create_task())
+        self.assertEqual(self.tdo_data.task_id, task_id)
+        self.assertEqual(self.fake.requests[("POST", "/tasks/user", 400)], 1)
+
+    def test_completed_task_moves_to_completed_todos(self):
+        task_id = self.fake.add_task("user-0")["id"]
+        self.fake.complete(task_id)
+
+        snapshot = self.tdo_data.get_todo_snapshot()
+        self.assertTrue(snapshot[task_id]["completed"])
+        self.tdo_data.task_id = "missing"
+        self.assertFalse(self.tdo_data.get_task())
+        self.assertEqual(self.tdo_data.return_code, 404)
+
+    def test_injected_errors(self):
+        self.fake.error_429_rate = 1.0
+        self.assertFalse(self.tdo_data.get_user_tags())
+        self.assertEqual(self.tdo_data.return_code, 429)
+        self.assertEqual(
+            self.fake.requests[("GET", "/tags", 429)],
+            to_do_overs_data.TOO_MANY_REQUESTS_RETRIES + 1,
+        )
+
+
+class BenchmarkTests(TransactionTestCase):
+    """The benchmark runs end to end against the fake Habitica."""
+
+    def test_benchmark_smoke(self):
+        with FakeHabitica() as fake:
+            result = benchmark.run(
+                fake, users=2, tasks_per_user=3, cycles=1, complete_fraction=0.5
+            )
+
+        self.assertEqual(result["recreations"], 3)
+        self.assertEqual(result["jobs_left"], 0)
+        self.assertEqual(result["jobs_given_up"], 0)
+        self.assertEqual(result["http_5xx"], 0)
+        self.assertEqual(result["report_failed"], 0)
+        self.assertEqual(result["report_timed_out"], 0)
+        self.assertGreater(result["cycles_per_second"], 0)
+        # two snapshot requests per user and at most one create per recreation
+        self.assertLessEqual(result["requests_per_recreation"], 7 / 3)
+
+        path = os.path.join(tempfile.mkdtemp(), "results.jsonl")
+        benchmark.save(result, path)
+        with open(path) as results:
+            saved = json.loads(results.readline())
+        self.assertEqual(saved["report_failed"], 0)
+        self.assertEqual(saved["http_5xx"], 0)
+        slower = dict(result, cycles_per_second=result["cycles_per_second"] / 2)
+        self.assertEqual(len(benchmark.compare(slower, path)), 1)
+        self.assertEqual(benchmark.compare(result, path), [])
@@ -30,5 +30,11 @@ urlpatterns = [
         views.edit_task_action,
         name="edit_task_action",
     ),
+    url(
+        r"^webhook/(?P<user_id>[-\w]+)/(?P<token>\w+)/$",
+        views.webhook,
+        name="webhook",
+    ),
+    url(r"^metrics$", views.metrics_view, name="metrics"),
     url(r"^test_500/", views.test_500_view, name="test_500"),
 ]
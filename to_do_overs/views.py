@@ -11,9 +11,20 @@ from .models import Users, Tasks, Tags
 import django.contrib.messages as messages
 import jsonpickle
 from .app_functions.cipher_functions import encrypt_text
-from django.http import HttpResponseServerError
+from .app_functions.metrics import prometheus_text
+from .app_functions.report_store import save_daily_report
+from .app_functions.tag_cache import invalidate_tags, refresh_tags
+from .app_functions.webhooks import check_webhook_token, handle_task_activity
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    HttpResponseServerError,
+)
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 import json
-from datetime import datetime
+from datetime import date
 
 
 def index(request):
@@ -45,6 +56,7 @@ def login(request):
     password = request.POST.get("password", False)
 
     if session_class.login(password):
+        invalidate_tags(session_class.hab_user_id)
         request.session["session_data"] = jsonpickle.encode(session_class)
         request.session.create()
         return redirect("to_do_overs:dashboard")
@@ -70,6 +82,7 @@ def login_api_key(request):
     session_class.api_token = encrypt_text(request.POST.get("api_token"))
 
     if session_class.login_api_key():
+        invalidate_tags(session_class.hab_user_id)
         request.session["session_data"] = jsonpickle.encode(session_class)
         request.session.create()
         return redirect("to_do_overs:dashboard")
@@ -126,9 +139,9 @@ def create_task(request):
         return redirect("to_do_overs:index")
 
     if session_class.logged_in:
-        # Get the user's tags
+        # Get the user's tags, from Habitica only once the cached ones are too old
         session_class = jsonpickle.decode(request.session["session_data"])
-        session_class.get_user_tags()
+        refresh_tags(session_class)
 
         form = TasksModelForm(session_class.hab_user_id)
 
@@ -192,6 +205,7 @@ def create_task_action(request):
             if session_class.create_task():
                 messages.success(request, "Task created successfully.")
                 task.task_id = session_class.task_id
+                task.next_check_at = task.compute_next_check_at()
 
                 task.save()
 
@@ -215,20 +229,13 @@ def create_task_action(request):
 def create_daily_report_action(request):
     session_class = jsonpickle.decode(request.session["session_data"])
     if session_class.logged_in:
-        todo_results = session_class.get_today_completed_tasks()
-        habit_results = session_class.get_today_completed_habits()
-        daily_results = session_class.get_today_completed_dailies()
-        date_today = (
-            f"{datetime.today().year}{datetime.today().month}{datetime.today().day}"
-        )
-        results = {
-            "date": date_today,
-            "habits": habit_results,
-            "dailys": daily_results,
-            "todos": todo_results,
-        }
-        with open("reports/" + date_today + ".txt", "w") as f:
-            json.dump(results, f, default=str)
+        results = session_class.get_today_report()
+        if results is not False:
+            save_daily_report(
+                Users.objects.get(user_id=session_class.hab_user_id),
+                date.today(),
+                results,
+            )
     return dashboard(request)
 
 
@@ -337,8 +344,8 @@ def edit_task(request, task_pk):
 
     logged_in_user = Users.objects.get(user_id=session_class.hab_user_id)
     if logged_in_user.pk == owner.pk:
-        # get the user's tags
-        session_class.get_user_tags()
+        # get the user's tags, from Habitica only once the cached ones are too old
+        refresh_tags(session_class)
 
         form = TasksModelForm(session_class.hab_user_id, instance=task)
         return render(
@@ -414,6 +421,7 @@ def edit_task_action(request, task_pk):
                     type=task.type,
                     weekday=task.weekday,
                     monthday=task.monthday,
+                    next_check_at=task.compute_next_check_at(),
                 )
 
                 task_object = Tasks.objects.get(task_id=task.task_id)
@@ -432,5 +440,49 @@ def edit_task_action(request, task_pk):
         return redirect("to_do_overs:dashboard")
 
 
+@csrf_exempt
+@require_POST
+def webhook(request, user_id, token):
+    """Receive a taskActivity event from Habitica.
+
+    This view will never actually be displayed.
+
+    Args:
+        request: the request from Habitica.
+        user_id: the user ID from Habitica the webhook was registered for.
+        token: the secret from the registered webhook URL.
+
+    Returns:
+        403 for an unknown token, 400 for a body that isn't JSON, 200 otherwise.
+    """
+    if not check_webhook_token(user_id, token):
+        return HttpResponseForbidden()
+
+    try:
+        payload = json.loads(request.body.decode("utf-8"))
+    except ValueError:
+        return HttpResponseBadRequest()
+    if not isinstance(payload, dict):
+        return HttpResponseBadRequest()
+
+    if payload.get("webhookType", "taskActivity") == "taskActivity":
+        handle_task_activity(user_id, payload)
+    return HttpResponse("ok")
+
+
+def metrics_view(request):
+    """Scheduler metrics for Prometheus.
+
+    Args:
+        request: the request from Prometheus.
+
+    Returns:
+        The latest scheduler run in the Prometheus text format.
+    """
+    return HttpResponse(
+        prometheus_text(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 def test_500_view(request):
     return HttpResponseServerError()